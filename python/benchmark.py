@@ -0,0 +1,346 @@
+#!/usr/bin/python
+
+"""
+Micro-benchmarks of the design and simulation hot paths.
+
+Times pole placement, discretization, polytope vertex enumeration, loop
+simulation and gain file emission on random systems of several sizes, with no
+robot or network.  Results are saved as JSON along with a description of the
+machine, and can be compared against a stored baseline to catch regressions.
+
+  benchmark.py [--output=<file>] [--baseline=<file>] [--threshold=<fraction>]
+      [--threshold=<name prefix>=<fraction>] [--filter=<regex>]
+      [--min_time=<seconds>]
+
+The exit status is 1 if any benchmark is slower than its baseline by more than
+its threshold.
+"""
+
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import ccde
+import control_loop
+import controls
+import numpy
+
+# The state sizes every benchmark is run at.
+STATE_SIZES = [2, 4, 8]
+
+# The number of loops in the gain schedules written by the writer benchmarks.
+SCHEDULE_SIZES = [1, 16]
+
+# The number of constraints of the polytopes, for each state size.
+CONSTRAINTS_PER_STATE = 4
+
+# The default time spent timing each benchmark, in seconds.
+DEFAULT_MIN_TIME = 0.5
+
+# The number of timing runs each benchmark is split into.
+NUM_RUNS = 5
+
+# By default, a benchmark regresses if it is 25% slower than the baseline.
+DEFAULT_THRESHOLD = 0.25
+
+
+def _RandomSystem(num_states, num_inputs=1, seed=0):
+  """Returns a random stable continuous system (A, B), the same every time.
+
+  The poles are real and distinct, from -1 to -num_states, since c2d and
+  acker don't handle complex ones.
+  """
+  random = numpy.random.RandomState(seed + num_states)
+  V = numpy.matrix(numpy.eye(num_states) +
+                   0.3 * random.randn(num_states, num_states))
+  A = V * numpy.matrix(numpy.diag(-numpy.arange(1.0, num_states + 1.0))) * \
+      numpy.linalg.inv(V)
+  B = numpy.matrix(random.randn(num_states, num_inputs))
+  return A, B
+
+
+def _Poles(num_states, radius):
+  """Returns num_states distinct real poles inside radius."""
+  return numpy.linspace(0.3, 0.9, num_states) * radius
+
+
+def _DesignedLoop(name, num_states, dt=0.01):
+  """Returns a designed single input, single output loop with num_states."""
+  A_continuous, B_continuous = _RandomSystem(num_states)
+  loop = control_loop.ControlLoop(name)
+  loop.A, loop.B = controls.c2d(A_continuous, B_continuous, dt)
+  loop.C = numpy.matrix(numpy.zeros((1, num_states)))
+  loop.C[0, 0] = 1.0
+  loop.D = numpy.matrix([[0.0]])
+  loop.dt = dt
+  loop.PlaceControllerPoles(_Poles(num_states, 0.9))
+  loop.PlaceObserverPoles(_Poles(num_states, 0.5))
+  loop.U_max = numpy.matrix([[12.0]])
+  loop.U_min = numpy.matrix([[-12.0]])
+  loop.InitializeState()
+  return loop
+
+
+def _Box(num_states):
+  """Returns the H and k of a polytope with CONSTRAINTS_PER_STATE * n sides."""
+  random = numpy.random.RandomState(num_states)
+  H = numpy.matrix(random.randn(CONSTRAINTS_PER_STATE * num_states,
+                                num_states))
+  k = numpy.matrix(numpy.ones((H.shape[0], 1)))
+  return H, k
+
+
+def BenchDplace(num_states):
+  A_continuous, B_continuous = _RandomSystem(num_states)
+  A, B = controls.c2d(A_continuous, B_continuous, 0.01)
+  poles = _Poles(num_states, 0.9)
+  return lambda: controls.dplace(A, B, poles)
+
+
+def BenchC2d(num_states):
+  A, B = _RandomSystem(num_states)
+  return lambda: controls.c2d(A, B, 0.01)
+
+
+def BenchAcker(num_states):
+  A_continuous, B_continuous = _RandomSystem(num_states)
+  A, B = controls.c2d(A_continuous, B_continuous, 0.01)
+  poles = list(_Poles(num_states, 0.9))
+  return lambda: ccde.acker(A, B, poles)
+
+
+def BenchCtrb(num_states):
+  A, B = _RandomSystem(num_states)
+  return lambda: ccde.ctrb(A, B)
+
+
+def BenchVertices(num_states):
+  import polytope
+  box = polytope.HPolytope(*_Box(num_states))
+  return box.Vertices
+
+
+def BenchIsInside(num_states):
+  import polytope
+  box = polytope.HPolytope(*_Box(num_states))
+  point = numpy.matrix(numpy.zeros((num_states, 1)))
+  return lambda: box.IsInside(point)
+
+
+def BenchUpdate(num_states):
+  loop = _DesignedLoop('Bench', num_states)
+  U = numpy.matrix([[1.0]])
+  return lambda: loop.Update(U)
+
+
+class _WriterBench(object):
+  """Writes a gain schedule of num_loops loops to a temporary directory.
+
+  The files are removed each time, so every call writes them in full.
+  """
+
+  def __init__(self, num_loops, write):
+    loops = [_DesignedLoop('Bench%d' % index, 4)
+             for index in xrange(num_loops)]
+    self._writer = control_loop.ControlLoopWriter('Bench', loops)
+    self._write = write
+    self._directory = tempfile.mkdtemp()
+
+  def __call__(self):
+    self._write(self._writer, self._directory)
+    for filename in os.listdir(self._directory):
+      os.unlink(os.path.join(self._directory, filename))
+
+  def __del__(self):
+    shutil.rmtree(self._directory, ignore_errors=True)
+
+
+def BenchWriteJava(num_loops):
+  return _WriterBench(num_loops, lambda writer, directory: writer.WriteJava(
+      os.path.join(directory, 'BenchGains.java')))
+
+
+def BenchWriteCC(num_loops):
+  return _WriterBench(num_loops, lambda writer, directory: writer.WriteCC(
+      'bench.h', os.path.join(directory, 'bench.cc')))
+
+
+# (name, setup, sizes).  setup(size) returns the function to time.
+BENCHMARKS = [
+    ('dplace', BenchDplace, STATE_SIZES),
+    ('c2d', BenchC2d, STATE_SIZES),
+    ('acker', BenchAcker, STATE_SIZES),
+    ('ctrb', BenchCtrb, STATE_SIZES),
+    ('Vertices', BenchVertices, STATE_SIZES[:2]),
+    ('IsInside', BenchIsInside, STATE_SIZES),
+    ('Update', BenchUpdate, STATE_SIZES),
+    ('WriteJava', BenchWriteJava, SCHEDULE_SIZES),
+    ('WriteCC', BenchWriteCC, SCHEDULE_SIZES),
+]
+
+
+def Time(function, min_time=DEFAULT_MIN_TIME, num_runs=NUM_RUNS):
+  """Times function, calling it enough to spend about min_time in total.
+
+  Returns:
+    dict, with the 'best' and 'median' seconds per call over the runs, and the
+      'calls' per run.
+  """
+  calls = 1
+  while True:
+    start = timeit.default_timer()
+    for _ in xrange(calls):
+      function()
+    elapsed = timeit.default_timer() - start
+    if elapsed >= min_time / num_runs / 10.0:
+      break
+    calls *= 10
+  calls = max(1, int(calls * min_time / num_runs / max(elapsed, 1e-9)))
+
+  times = []
+  for _ in xrange(num_runs):
+    start = timeit.default_timer()
+    for _ in xrange(calls):
+      function()
+    times.append((timeit.default_timer() - start) / calls)
+  return {'best': min(times), 'median': float(numpy.median(times)),
+          'calls': calls}
+
+
+def MachineInfo():
+  """Returns a description of the machine and the libraries benchmarked."""
+  return {
+      'hostname': platform.node(),
+      'platform': platform.platform(),
+      'processor': platform.processor(),
+      'cpu_count': _CpuCount(),
+      'python': platform.python_version(),
+      'numpy': numpy.__version__,
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+  }
+
+
+def _CpuCount():
+  try:
+    import multiprocessing
+    return multiprocessing.cpu_count()
+  except NotImplementedError:
+    return None
+
+
+def Run(pattern=None, min_time=DEFAULT_MIN_TIME, log=None):
+  """Runs the benchmarks whose names match the regular expression pattern.
+
+  Benchmarks which can't be set up, like the polytope ones without libcdd, are
+  skipped.
+
+  Args:
+    pattern: string, Only names like 'dplace/4' which re.search finds pattern
+      in are run.  If None, all are run.
+    min_time: float, Seconds to spend timing each benchmark.
+    log: file, If provided, a line is written to it for each benchmark.
+
+  Returns:
+    dict, with the 'machine' from MachineInfo, the 'results' from Time by
+      name, and the reasons benchmarks were 'skipped' by name.
+  """
+  results = {}
+  skipped = {}
+  for base_name, setup, sizes in BENCHMARKS:
+    for size in sizes:
+      name = '%s/%d' % (base_name, size)
+      if pattern is not None and not re.search(pattern, name):
+        continue
+      try:
+        function = setup(size)
+      except (ImportError, OSError) as e:
+        skipped[name] = str(e)
+        if log:
+          log.write('%-16s skipped: %s\n' % (name, e))
+        continue
+      results[name] = Time(function, min_time)
+      if log:
+        log.write('%-16s %12.2f us\n' % (name, results[name]['median'] * 1e6))
+  return {'machine': MachineInfo(), 'results': results, 'skipped': skipped}
+
+
+def Compare(results, baseline, threshold=DEFAULT_THRESHOLD, thresholds=None):
+  """Compares median times against a baseline from Run.
+
+  Args:
+    results: dict, The output of Run.
+    baseline: dict, The output of an earlier Run.
+    threshold: float, The fraction slower than the baseline a benchmark may be.
+    thresholds: dict, Thresholds which override threshold for the benchmarks
+      whose names start with each key.  The longest matching key wins.
+
+  Returns:
+    array[(name, ratio, threshold)], the benchmarks which regressed, with
+      their time divided by the baseline time.
+  """
+  thresholds = thresholds or {}
+  regressions = []
+  for name in sorted(results['results']):
+    if name not in baseline['results']:
+      continue
+    prefixes = [prefix for prefix in thresholds if name.startswith(prefix)]
+    limit = thresholds[max(prefixes, key=len)] if prefixes else threshold
+    ratio = (results['results'][name]['median'] /
+             baseline['results'][name]['median'])
+    if ratio > 1.0 + limit:
+      regressions.append((name, ratio, limit))
+  return regressions
+
+
+def main(argv):
+  output = None
+  baseline_file = None
+  threshold = DEFAULT_THRESHOLD
+  thresholds = {}
+  pattern = None
+  min_time = DEFAULT_MIN_TIME
+  for arg in argv[1:]:
+    flag, _, value = arg.partition('=')
+    if flag == '--output':
+      output = value
+    elif flag == '--baseline':
+      baseline_file = value
+    elif flag == '--threshold' and '=' in value:
+      prefix, _, value = value.rpartition('=')
+      thresholds[prefix] = float(value)
+    elif flag == '--threshold':
+      threshold = float(value)
+    elif flag == '--filter':
+      pattern = value
+    elif flag == '--min_time':
+      min_time = float(value)
+    else:
+      print "Expected --output, --baseline, --threshold, --filter or --min_time"
+      quit()
+
+  results = Run(pattern, min_time, log=sys.stdout)
+  if output:
+    with open(output, 'w') as fd:
+      json.dump(results, fd, indent=2, sort_keys=True)
+
+  if baseline_file:
+    with open(baseline_file) as fd:
+      baseline = json.load(fd)
+    regressions = Compare(results, baseline, threshold, thresholds)
+    for name, ratio, limit in regressions:
+      print "%s regressed: %.2fx the baseline, limit %.2fx" % (
+          name, ratio, 1.0 + limit)
+    if regressions:
+      return 1
+    print "No regressions against %s" % baseline_file
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
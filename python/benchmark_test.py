@@ -0,0 +1,33 @@
+#!/usr/bin/python
+
+import benchmark
+import unittest
+
+
+def MakeResults(**medians):
+  return {'results': dict((name.replace('_', '/'), {'median': median})
+                          for name, median in medians.iteritems())}
+
+
+class TestBenchmark(unittest.TestCase):
+  def test_Compare(self):
+    """Tests the default threshold, and that the longest prefix wins."""
+    baseline = MakeResults(c2d_2=1.0, c2d_4=1.0, dplace_2=1.0)
+    results = MakeResults(c2d_2=1.3, c2d_4=1.3, dplace_2=1.1, ctrb_2=9.0)
+    self.assertEqual([('c2d/2', 1.3, 0.25), ('c2d/4', 1.3, 0.25)],
+                     benchmark.Compare(results, baseline))
+    self.assertEqual(
+        [('c2d/2', 1.3, 0.25), ('dplace/2', 1.1, 0.05)],
+        benchmark.Compare(results, baseline, 0.25,
+                          {'c2d': 0.5, 'c2d/2': 0.25, 'dplace': 0.05}))
+
+  def test_Run(self):
+    """Tests that the filter selects benchmarks, and the results are saved."""
+    results = benchmark.Run('^ctrb/2$', min_time=0.001)
+    self.assertEqual(['ctrb/2'], results['results'].keys())
+    self.assertGreater(results['results']['ctrb/2']['median'], 0.0)
+    self.assertIn('numpy', results['machine'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -96,6 +96,117 @@ def buildSSfromTF(a, b):
 	
   return G, H, C
 
+# The largest number of elements in the stacked block Toeplitz matrices built by
+# simulateSS.  The block size is reduced to stay under it for big batches.
+MAX_BLOCK_ELEMENTS = 1 << 17
+
+def _blockMatrices(powers, H, C, length):
+  """Builds the matrices which run a block of length samples at once.
+
+  For a block starting in state x0 with inputs u,
+    y = O x0 + T u
+    x = P x0 + R u
+  powers is G^0 ... G^length, stacked as (length + 1, K, n, n).
+
+  Returns O (K x length x n), T (K x length x length), P (K x n x n) and
+  R (K x n x length).
+  """
+  O = numpy.einsum('kn,jknm->kjm', C, powers[:length])
+  powers_H = numpy.einsum('jknm,km->kjn', powers[:length], H)
+  markov = numpy.einsum('kn,kjn->kj', C, powers_H)
+  offsets = numpy.subtract.outer(numpy.arange(length), numpy.arange(length))
+  T = numpy.where(offsets > 0, markov[:, numpy.clip(offsets - 1, 0, None)],
+                  0.0)
+  R = powers_H[:, ::-1, :].transpose(0, 2, 1)
+  return O, T, powers[length], R
+
+# Simulates x(n + 1) = G x(n) + H u(n), y(n) = C x(n) over a whole input array.
+# The input is split into blocks, and the outputs and final state of each block
+# are linear in its starting state and inputs.  The input terms for every block
+# are found with one matrix multiply, so only the block to block state update
+# is a python loop.
+#
+# G, H and C may be stacks (K x n x n, K x n x 1 and K x 1 x n) to run K
+# systems at once.  u is (T) to drive every system with the same input, or
+# (K x T).  x0 is the starting state, (n) or (K x n), zero if None.
+### returns y, x: the outputs (T) or (K x T), and the final state (n) or (K x n)
+### to pass as x0 for the next chunk of input.
+def simulateSS(G, H, C, u, x0=None, block_size=256):
+  G = numpy.asarray(G, dtype=numpy.float64)
+  batched = G.ndim == 3
+  G = G.reshape((-1,) + G.shape[-2:])
+  K, n = G.shape[0], G.shape[1]
+  H = numpy.asarray(H, dtype=numpy.float64).reshape((K, n))
+  C = numpy.asarray(C, dtype=numpy.float64).reshape((K, n))
+  u = numpy.asarray(u, dtype=numpy.float64)
+  num_samples = u.shape[-1]
+  u = numpy.broadcast_to(u.reshape((-1, num_samples)), (K, num_samples))
+  if x0 is None:
+    x = numpy.zeros((K, n))
+  else:
+    x = numpy.array(x0, dtype=numpy.float64).reshape((K, n))
+
+  length = max(1, min(block_size, num_samples,
+                      int(numpy.sqrt(MAX_BLOCK_ELEMENTS / K))))
+  powers = numpy.empty((length + 1, K, n, n))
+  powers[0] = numpy.eye(n)
+  for i in range(1, length + 1):
+    powers[i] = numpy.einsum('knm,kml->knl', G, powers[i - 1])
+
+  y = numpy.empty((K, num_samples))
+  num_blocks = num_samples // length
+  blocks = [(0, num_blocks, length)]
+  if num_samples > num_blocks * length:
+    blocks.append((num_blocks * length, 1, num_samples - num_blocks * length))
+
+  for start, count, size in blocks:
+    if count == 0:
+      continue
+    O, T, P, R = _blockMatrices(powers, H, C, size)
+    u_blocks = u[:, start:start + count * size].reshape((K, count, size))
+    input_outputs = numpy.matmul(u_blocks, T.transpose(0, 2, 1))
+    input_states = numpy.matmul(u_blocks, R.transpose(0, 2, 1))
+    starts = numpy.empty((K, count, n))
+    for b in range(count):
+      starts[:, b] = x
+      x = numpy.einsum('knm,km->kn', P, x) + input_states[:, b]
+    y[:, start:start + count * size] = (
+        numpy.matmul(starts, O.transpose(0, 2, 1)) + input_outputs).reshape(
+            (K, count * size))
+
+  if batched:
+    return y, x
+  return y[0], x[0]
+
+def _stack(builder, a, b):
+  """Builds and stacks the companion matrices of one or more a, b pairs."""
+  a = numpy.asarray(a, dtype=numpy.float64)
+  b = numpy.asarray(b, dtype=numpy.float64)
+  if a.ndim == 1 and b.ndim == 1:
+    G, H, C = builder(a.tolist(), b.tolist())
+    return numpy.asarray(G), numpy.asarray(H), numpy.asarray(C)
+  a, b = numpy.atleast_2d(a), numpy.atleast_2d(b)
+  count = max(a.shape[0], b.shape[0])
+  a = numpy.broadcast_to(a, (count, a.shape[1]))
+  b = numpy.broadcast_to(b, (count, b.shape[1]))
+  matrices = [builder(a[i].tolist(), b[i].tolist()) for i in range(count)]
+  return tuple(numpy.array([numpy.asarray(m[j]) for m in matrices])
+               for j in range(3))
+
+# Runs the difference equation from buildSSfromCCDE over an input array.
+# a and b may be (K x len) arrays of coefficient sets to run K equations at
+# once, to score many candidates against one log.  See simulateSS for u, x0
+# and the results.
+def filterCCDE(a, b, u, x0=None, block_size=256):
+  G, H, C = _stack(buildSSfromCCDE, a, b)
+  return simulateSS(G, H, C, u, x0, block_size)
+
+# Runs the transfer function from buildSSfromTF over an input array.  a and b
+# may be (K x len) arrays of coefficient sets, like filterCCDE.
+def filterTF(a, b, u, x0=None, block_size=256):
+  G, H, C = _stack(buildSSfromTF, a, b)
+  return simulateSS(G, H, C, u, x0, block_size)
+
 # To get if something is controlable, use the following algorythm.
 # http://www.math.epn.edu.ec/eventos/ev_pdf/staircase.pdf
 
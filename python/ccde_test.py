@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+import ccde
+import numpy
+from numpy.testing import *
+import unittest
+
+
+def StepSS(G, H, C, u):
+  """Steps the system one sample at a time, returning the outputs and state."""
+  x = numpy.matrix(numpy.zeros((G.shape[0], 1)))
+  y = []
+  for value in u:
+    y.append((C * x)[0, 0])
+    x = G * x + H * value
+  return numpy.array(y), numpy.asarray(x).ravel()
+
+
+class TestFilter(unittest.TestCase):
+  def test_FilterCCDE(self):
+    """Tests that the blocked filter matches stepping the system."""
+    a = [0.5, -0.2, 0.1]
+    b = [1.0, 0.3]
+    u = numpy.sin(numpy.arange(1000) * 0.1)
+
+    G, H, C = ccde.buildSSfromCCDE(a, b)
+    expected_y, expected_x = StepSS(G, H, C, u)
+    y, x = ccde.filterCCDE(a, b, u, block_size=64)
+    assert_almost_equal(y, expected_y)
+    assert_almost_equal(x, expected_x)
+
+  def test_Chunks(self):
+    """Tests that chunks pick up where the last one left off."""
+    a = [0.5, -0.2, 0.1]
+    b = [1.0, 0.3]
+    u = numpy.sin(numpy.arange(1000) * 0.1)
+
+    G, H, C = ccde.buildSSfromCCDE(a, b)
+    expected_y, expected_x = StepSS(G, H, C, u)
+    y1, x1 = ccde.filterCCDE(a, b, u[:333], block_size=64)
+    y2, x2 = ccde.filterCCDE(a, b, u[333:], x0=x1, block_size=64)
+    assert_almost_equal(numpy.concatenate((y1, y2)), expected_y)
+    assert_almost_equal(x2, expected_x)
+
+  def test_FilterTFBatch(self):
+    """Tests that each row of coefficients is filtered on its own."""
+    a = numpy.array([[1.0, 0.5], [2.0, 0.0], [0.0, 1.0]])
+    b = [1.0, -1.2, 0.5]
+    u = numpy.cos(numpy.arange(500) * 0.05)
+
+    y, x = ccde.filterTF(a, b, u, block_size=32)
+    self.assertEqual((3, 500), y.shape)
+    for i in xrange(3):
+      G, H, C = ccde.buildSSfromTF(a[i].tolist(), b)
+      expected_y, expected_x = StepSS(G, H, C, u)
+      assert_almost_equal(y[i], expected_y)
+      assert_almost_equal(x[i], expected_x)
+
+
+if __name__ == '__main__':
+  unittest.main()
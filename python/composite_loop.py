@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+"""
+Block diagonal composite of several control loops.
+
+Stepping every mechanism of a robot one ControlLoop at a time costs a round of
+numpy calls per mechanism.  A CompositeLoop stacks the loops into one block
+diagonal system, so a CompositeStepper steps the whole robot with one set of
+array operations.  Each mechanism's states, inputs and outputs are slices of
+the composite, and views of them can be read and written without copies.
+"""
+
+import collections
+
+import control_loop
+import numpy
+
+# The per-mechanism views returned by CompositeStepper.View.  Each field is a
+# view into the composite stepper's arrays.
+MechanismView = collections.namedtuple('MechanismView',
+                                       ['X', 'Y', 'X_hat', 'R', 'U'])
+
+
+def _BlockDiagonal(matrices):
+  """Returns the block diagonal matrix with matrices along the diagonal."""
+  rows = sum(matrix.shape[0] for matrix in matrices)
+  cols = sum(matrix.shape[1] for matrix in matrices)
+  result = numpy.matrix(numpy.zeros((rows, cols)))
+  row = 0
+  col = 0
+  for matrix in matrices:
+    result[row:row + matrix.shape[0], col:col + matrix.shape[1]] = matrix
+    row += matrix.shape[0]
+    col += matrix.shape[1]
+  return result
+
+
+def _Slices(sizes):
+  """Returns consecutive slices with the provided sizes."""
+  slices = []
+  start = 0
+  for size in sizes:
+    slices.append(slice(start, start + size))
+    start += size
+  return slices
+
+
+class CompositeLoop(control_loop.ControlLoop):
+  """A ControlLoop made of several independent loops.
+
+  The A, B, C, D, L and K matrices are block diagonal, and U_max and U_min are
+  stacked.  state_slices, input_slices and output_slices map the name of each
+  loop to its rows of X, U and Y.
+  """
+
+  def __init__(self, name, loops):
+    """Constructs a composite loop, starting from the state of each loop.
+
+    Args:
+      name: string, The name of the composite loop.
+      loops: array[ControlLoop], The loops.  Their names must be unique.
+
+    Raises:
+      ValueError: Two loops have the same name, or the loops have different
+        time steps.
+    """
+    super(CompositeLoop, self).__init__(name)
+    names = [loop._name for loop in loops]
+    if len(set(names)) != len(names):
+      raise ValueError('Loop names must be unique, got %s.' % names)
+    time_steps = set(getattr(loop, 'dt', None) for loop in loops)
+    if len(time_steps) > 1:
+      raise ValueError('Loops must share a time step, got %s.' %
+                       sorted(time_steps))
+    self.dt = time_steps.pop() if time_steps else None
+    self.loops = list(loops)
+
+    self.state_slices = collections.OrderedDict(zip(
+        names, _Slices([loop.A.shape[0] for loop in loops])))
+    self.input_slices = collections.OrderedDict(zip(
+        names, _Slices([loop.B.shape[1] for loop in loops])))
+    self.output_slices = collections.OrderedDict(zip(
+        names, _Slices([loop.C.shape[0] for loop in loops])))
+
+    for matrix_name in ['A', 'B', 'C', 'D', 'L', 'K']:
+      setattr(self, matrix_name, _BlockDiagonal(
+          [getattr(loop, matrix_name) for loop in loops]))
+    self.U_max = numpy.matrix(numpy.vstack([loop.U_max for loop in loops]))
+    self.U_min = numpy.matrix(numpy.vstack([loop.U_min for loop in loops]))
+
+    self.X = numpy.matrix(numpy.vstack([loop.X for loop in loops]))
+    self.Y = numpy.matrix(numpy.vstack([loop.Y for loop in loops]))
+    self.X_hat = numpy.matrix(numpy.vstack([loop.X_hat for loop in loops]))
+
+  def Stepper(self):
+    """Returns a CompositeStepper starting from the composite's state."""
+    return CompositeStepper(self)
+
+
+class CompositeStepper(control_loop.ArrayStepper):
+  """Runs every loop of a CompositeLoop with one set of array operations.
+
+  R and U are the stacked goals and inputs.  Like X, Y and X_hat, they are
+  updated in place, so the views from View stay current.
+  """
+
+  def __init__(self, composite):
+    """Constructs a stepper starting from the composite's current state.
+
+    Args:
+      composite: CompositeLoop, The loops to step.  It isn't modified.
+    """
+    super(CompositeStepper, self).__init__(composite)
+    self.K = numpy.array(composite.K, dtype=numpy.float64)
+    self.R = numpy.zeros((self.A.shape[0], 1))
+    self.U = numpy.zeros((self.B.shape[1], 1))
+    self._loops = composite.loops
+    self._state_slices = composite.state_slices
+    self._input_slices = composite.input_slices
+    self._output_slices = composite.output_slices
+    self._goal_error = numpy.zeros((self.A.shape[0], 1))
+
+  def View(self, name):
+    """Returns the MechanismView of the loop with the provided name."""
+    states = self._state_slices[name]
+    return MechanismView(X=self.X[states],
+                         Y=self.Y[self._output_slices[name]],
+                         X_hat=self.X_hat[states],
+                         R=self.R[states],
+                         U=self.U[self._input_slices[name]])
+
+  def Step(self):
+    """Runs the controllers, observers and plants of every loop for one cycle.
+
+    Computes U = K (R - X_hat) clipped to U_min and U_max, then updates the
+    observers and the plants with U.
+    """
+    numpy.subtract(self.R, self.X_hat, out=self._goal_error)
+    numpy.dot(self.K, self._goal_error, out=self.U)
+    numpy.clip(self.U, self.U_min, self.U_max, out=self.U)
+    self.UpdateObserver(self.U)
+    self.Update(self.U)
+
+  def CopyStateToLoops(self):
+    """Sets each loop's X, Y and X_hat to copies of its part of the state."""
+    for loop in self._loops:
+      view = self.View(loop._name)
+      loop.X = numpy.matrix(view.X)
+      loop.Y = numpy.matrix(view.Y)
+      loop.X_hat = numpy.matrix(view.X_hat)
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+import composite_loop
+import control_loop_test
+import numpy
+from numpy.testing import *
+import unittest
+
+
+class TestCompositeLoop(unittest.TestCase):
+  def setUp(self):
+    self.loops = [control_loop_test.MakeLoop('Left', 1.0),
+                  control_loop_test.MakeLoop('Right', 2.0),
+                  control_loop_test.MakeLoop('Hood', 3.0)]
+    self.composite = composite_loop.CompositeLoop('Robot', self.loops)
+
+  def test_Slices(self):
+    """Tests that each loop maps to its block of the composite."""
+    states = self.composite.state_slices['Right']
+    inputs = self.composite.input_slices['Right']
+    assert_array_equal(self.composite.A[states, states], self.loops[1].A)
+    assert_array_equal(self.composite.K[inputs, states], self.loops[1].K)
+    self.assertEqual(0.0, self.composite.A[states, :2].sum())
+
+  def test_StepMatchesLoops(self):
+    """Tests that stepping the composite matches stepping each loop."""
+    stepper = self.composite.Stepper()
+    goals = [numpy.matrix([[0.0], [100.0 * (i + 1)]]) for i in xrange(3)]
+    for loop, goal in zip(self.loops, goals):
+      stepper.View(loop._name).R[:] = goal
+
+    for _ in xrange(50):
+      stepper.Step()
+      for loop, goal in zip(self.loops, goals):
+        U = numpy.clip(loop.K * (goal - loop.X_hat), loop.U_min, loop.U_max)
+        loop.UpdateObserver(U)
+        loop.Update(U)
+
+    for loop in self.loops:
+      view = stepper.View(loop._name)
+      assert_almost_equal(view.X, loop.X)
+      assert_almost_equal(view.X_hat, loop.X_hat)
+      assert_almost_equal(view.Y, loop.Y)
+
+  def test_ViewsAreNotCopies(self):
+    """Tests that the views track the stepper's state in place."""
+    stepper = self.composite.Stepper()
+    view = stepper.View('Hood')
+    view.R[1, 0] = 50.0
+    self.assertEqual(50.0, stepper.R[5, 0])
+    stepper.Step()
+    assert_array_equal(view.X, stepper.X[4:6])
+    self.assertNotEqual(0.0, view.X[0, 0])
+
+  def test_DuplicateNames(self):
+    """Tests that loops with the same name are rejected."""
+    self.assertRaises(ValueError, composite_loop.CompositeLoop, 'Robot',
+                      [control_loop_test.MakeLoop('Left', 1.0),
+                       control_loop_test.MakeLoop('Left', 2.0)])
+
+
+if __name__ == '__main__':
+  unittest.main()
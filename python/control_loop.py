@@ -1,8 +1,370 @@
+import collections
+import copy
+import cPickle
+import cStringIO
 import controls
+import hashlib
 import numpy
+import os
+import struct
+import sys
+
+# The binary gain schedule format written by ControlLoopWriter.WriteBinary.
+# It is a fixed little-endian header (magic, version, number of loops, states,
+# inputs and outputs), followed by the A, B, C, D, L, K, U_max and U_min
+# matrices of each loop as row-major little-endian doubles.
+BINARY_MAGIC = 'SSGS'
+BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct('<4sIIIII')
+
+# Cache of discretizations and pole placements, keyed by the fingerprint of
+# their inputs.  Shared by all the loops in the process.
+_design_cache = {}
+
+# Bump whenever the design code changes its results, so cached designs from
+# older code are never used.  Part of every design cache key, and of the saved
+# cache file.
+DESIGN_CACHE_VERSION = 1
+
+# The number of k step matrices each loop keeps for StepMatrices.
+STEP_MATRIX_CACHE_SIZE = 32
+
+# Fully designed loops built by Model, keyed by their class and constructor
+# arguments.  Only copies are handed out.
+_model_registry = {}
+
+
+def _Fingerprint(*values):
+  """Returns a hex digest which identifies the provided values.
+
+  Matrices are identified by their type, shape and contents, and everything
+  else by its repr.
+  """
+  digest = hashlib.sha1()
+  for value in values:
+    if isinstance(value, numpy.ndarray):
+      value = numpy.ascontiguousarray(value)
+      digest.update('%s %s ' % (value.dtype.str, value.shape))
+      digest.update(value.tostring())
+    else:
+      digest.update(repr(value))
+    digest.update('\0')
+  return digest.hexdigest()
+
+
+def _CachedDesign(key, design_function):
+  """Returns the cached result for key, calling design_function on a miss.
+
+  Args:
+    key: string, The fingerprint of the inputs to design_function.
+    design_function: function, Computes a tuple of matrices.
+
+  Returns:
+    tuple(numpy.matrix), copies of the cached matrices.
+  """
+  key = _Fingerprint(DESIGN_CACHE_VERSION, key)
+  if key not in _design_cache:
+    _design_cache[key] = tuple(numpy.array(matrix)
+                               for matrix in design_function())
+  return tuple(numpy.matrix(matrix) for matrix in _design_cache[key])
+
+
+def LoadDesignCache(filename):
+  """Loads the design cache saved by SaveDesignCache, if there is one.
+
+  Missing, corrupt or out of date files are treated as an empty cache.
+  """
+  try:
+    with open(filename, 'rb') as fd:
+      version, designs = cPickle.load(fd)
+    if version != DESIGN_CACHE_VERSION:
+      return
+    _design_cache.update(designs)
+  except (IOError, EOFError, cPickle.UnpicklingError, ValueError,
+          TypeError, AttributeError, ImportError, IndexError):
+    pass
+
+
+def SaveDesignCache(filename):
+  """Saves the design cache so later runs can skip unchanged designs."""
+  with open(filename, 'wb') as fd:
+    cPickle.dump((DESIGN_CACHE_VERSION, _design_cache), fd,
+                 cPickle.HIGHEST_PROTOCOL)
+
+
+def ExtractDesignCacheFlag(argv):
+  """Removes --design_cache=<file> from a command line.
+
+  Returns:
+    (argv, filename), the command line without the flag, and the design cache
+      file or None.
+  """
+  remaining_argv = []
+  filename = None
+  for arg in argv:
+    if arg.startswith('--design_cache='):
+      filename = arg[len('--design_cache='):]
+    else:
+      remaining_argv.append(arg)
+  return remaining_argv, filename
+
+
+def Model(loop_class, *args, **kwargs):
+  """Returns a copy of a designed loop, designing it once per process.
+
+  The physical constants, time step, poles and augmentation of the loops in
+  this package are all fixed by their class, so the class and the constructor
+  arguments identify the design.  Reloading a module makes new classes, so
+  edited models are designed again.
+
+  Args:
+    loop_class: class, The ControlLoop subclass to construct.
+    args, kwargs: The constructor arguments.
+
+  Returns:
+    ControlLoop, a Copy of the registered loop, with its own state.
+  """
+  key = (loop_class, _Fingerprint(*(list(args) + [
+      value for name in sorted(kwargs) for value in (name, kwargs[name])])))
+  if key not in _model_registry:
+    _model_registry[key] = loop_class(*args, **kwargs)
+  return _model_registry[key].Copy()
+
+
+def _WriteIfChanged(filename, contents):
+  """Writes contents to filename unless the file already holds exactly that.
+
+  Leaving identical files alone keeps their modification time, so builds which
+  depend on them aren't redone.
+
+  Returns:
+    boolean, True if the file was written.
+  """
+  if os.path.exists(filename):
+    with open(filename, 'rb') as fd:
+      if (hashlib.sha1(fd.read()).digest() ==
+          hashlib.sha1(contents).digest()):
+        return False
+  with open(filename, 'wb') as fd:
+    fd.write(contents)
+  return True
+
+
+def _BinaryMatrixShapes(num_states, num_inputs, num_outputs):
+  """Returns the names and shapes of the matrices of a loop in a binary file."""
+  return [('A', (num_states, num_states)),
+          ('B', (num_states, num_inputs)),
+          ('C', (num_outputs, num_states)),
+          ('D', (num_outputs, num_inputs)),
+          ('L', (num_states, num_outputs)),
+          ('K', (num_inputs, num_states)),
+          ('U_max', (num_inputs, 1)),
+          ('U_min', (num_inputs, 1))]
+
+
+def ReadBinary(binary_file):
+  """Reads a gain schedule written by ControlLoopWriter.WriteBinary.
+
+  Args:
+    binary_file: string, The file to read.
+
+  Raises:
+    ValueError: The file is not a gain schedule in a supported format.
+
+  Returns:
+    array[ControlLoop], the loops in the schedule, named Loop0, Loop1, ...
+  """
+  with open(binary_file, 'rb') as fd:
+    contents = fd.read()
+
+  if len(contents) < _BINARY_HEADER.size:
+    raise ValueError('%s is too short to be a gain schedule.' % binary_file)
+  (magic, version, num_loops, num_states, num_inputs,
+   num_outputs) = _BINARY_HEADER.unpack_from(contents)
+  if magic != BINARY_MAGIC:
+    raise ValueError('%s is not a gain schedule.' % binary_file)
+  if version != BINARY_VERSION:
+    raise ValueError('%s is version %d, expected version %d.' % (
+        binary_file, version, BINARY_VERSION))
+
+  shapes = _BinaryMatrixShapes(num_states, num_inputs, num_outputs)
+  loop_size = sum(rows * cols for _, (rows, cols) in shapes)
+  if len(contents) != _BINARY_HEADER.size + num_loops * loop_size * 8:
+    raise ValueError('%s has the wrong size for %d loops.' % (
+        binary_file, num_loops))
+
+  values = numpy.frombuffer(contents, dtype='<f8',
+                            offset=_BINARY_HEADER.size)
+  loops = []
+  offset = 0
+  for index in xrange(num_loops):
+    loop = ControlLoop('Loop%d' % index)
+    for name, (rows, cols) in shapes:
+      setattr(loop, name, numpy.matrix(
+          values[offset:offset + rows * cols].reshape((rows, cols)),
+          dtype=numpy.float64))
+      offset += rows * cols
+    loop.InitializeState()
+    loops.append(loop)
+  return loops
+
+
+class _GeneratedFile(object):
+  """Buffers a generated file, and only writes it out if it changed.
+
+  Used in place of open(filename, 'w').  After the with block, changed is True
+  if the file was written.
+  """
+  def __init__(self, filename):
+    self._filename = filename
+    self._buffer = cStringIO.StringIO()
+    self.changed = False
+
+  def __enter__(self):
+    return self._buffer
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.changed = _WriteIfChanged(self._filename, self._buffer.getvalue())
+    return False
+
+
+class GainSchedule(object):
+  """A set of control loops indexed by the value of a scheduling variable.
+
+  The loops are sorted by their breakpoints.  Lookup picks the loop for a value
+  with a binary search, and Interpolate linearly interpolates K and L between
+  the neighboring loops.  Values off either end use the end loop.
+  """
+
+  def __init__(self, breakpoints, loops):
+    """Constructs a gain schedule.
+
+    Args:
+      breakpoints: array[float], The scheduling variable value for each loop.
+      loops: array[ControlLoop], The loops, in the same order as breakpoints.
+
+    Raises:
+      ValueError: There isn't one unique breakpoint per loop.
+    """
+    if len(breakpoints) != len(loops):
+      raise ValueError('Expected %d breakpoints, got %d.' % (
+          len(loops), len(breakpoints)))
+    order = sorted(xrange(len(loops)), key=lambda index: breakpoints[index])
+    self.breakpoints = numpy.array([breakpoints[index] for index in order],
+                                   dtype=numpy.float64)
+    self.loops = [loops[index] for index in order]
+    if (numpy.diff(self.breakpoints) == 0.0).any():
+      raise ValueError('Breakpoints must be unique.')
+
+  def Lookup(self, value):
+    """Returns the index of the last breakpoint <= value, clamped to the ends."""
+    index = numpy.searchsorted(self.breakpoints, value, side='right') - 1
+    return min(max(index, 0), len(self.loops) - 1)
+
+  def Interpolate(self, value):
+    """Returns (K, L) linearly interpolated to value."""
+    index = self.Lookup(value)
+    loop = self.loops[index]
+    if index == len(self.loops) - 1 or value <= self.breakpoints[0]:
+      return loop.K, loop.L
+
+    next_loop = self.loops[index + 1]
+    fraction = ((value - self.breakpoints[index]) /
+                (self.breakpoints[index + 1] - self.breakpoints[index]))
+    return (loop.K + fraction * (next_loop.K - loop.K),
+            loop.L + fraction * (next_loop.L - loop.L))
+
+
+class StabilityReport(object):
+  """The closed loop poles of every loop in a gain schedule.
+
+  The controller (A - B K) and observer (A - L C) matrices of all the loops are
+  stacked and their eigenvalues are found with one batched call.  Poles on or
+  outside the unit circle are unstable.  Poles with a magnitude above
+  max_spectral_radius, or a damping ratio below min_damping, are flagged as
+  marginal.  Poles on the negative real axis flip sign every step, which no
+  continuous damping ratio describes, so they are left out of min_damping and
+  flagged as alternating instead.
+
+  Attributes:
+    names: array[string], The name of each loop.
+    controller_poles: numpy.array(N x n), The controller poles of each loop.
+    observer_poles: numpy.array(N x n), The observer poles of each loop.
+    spectral_radius: numpy.array(2N), The largest pole magnitude of each
+      controller, followed by each observer.
+    min_damping: numpy.array(2N), The smallest damping ratio, in the same
+      order as spectral_radius.
+    unstable: array[string], A description of each unstable pole set.
+    marginal: array[string], A description of each marginal pole set.
+    alternating: array[string], A description of each stable pole set with
+      poles on the negative real axis.
+  """
+
+  def __init__(self, loops, max_spectral_radius=0.995, min_damping=0.3):
+    """Analyzes the loops.
+
+    Args:
+      loops: array[ControlLoop], The loops.  They must all be the same size.
+      max_spectral_radius: float, Poles with a larger magnitude are marginal.
+      min_damping: float, Poles with a smaller damping ratio are marginal.
+    """
+    self.names = [loop._name for loop in loops]
+    matrices = numpy.array(
+        [numpy.asarray(loop.A - loop.B * loop.K) for loop in loops] +
+        [numpy.asarray(loop.A - loop.L * loop.C) for loop in loops])
+    poles = numpy.linalg.eigvals(matrices)
+    self.controller_poles = poles[:len(loops)]
+    self.observer_poles = poles[len(loops):]
+
+    magnitude = numpy.abs(poles)
+    # The damping ratio of the continuous pole s = ln(z) / dt doesn't depend
+    # on dt.  Poles at the origin are deadbeat, and count as well damped.
+    # Negative real poles have no real logarithm, and ln(z) puts them at the
+    # Nyquist frequency with a damping ratio which only depends on their
+    # magnitude, so they are checked separately.
+    negative_real = ((numpy.abs(poles.imag) <= 1.0e-12 * magnitude) &
+                     (poles.real < 0.0))
+    log_poles = numpy.log(numpy.where(magnitude == 0.0, 1.0,
+                                      poles.astype(numpy.complex128)))
+    damping = numpy.where(
+        (magnitude == 0.0) | negative_real, 1.0,
+        -log_poles.real / numpy.maximum(numpy.abs(log_poles), 1.0e-300))
+
+    self.spectral_radius = magnitude.max(axis=1)
+    self.min_damping = damping.min(axis=1)
+
+    unstable = self.spectral_radius >= 1.0
+    marginal = ~unstable & ((self.spectral_radius > max_spectral_radius) |
+                            (self.min_damping < min_damping))
+    alternating = ~unstable & negative_real.any(axis=1)
+    self.unstable = [self._Describe(poles, index)
+                     for index in numpy.nonzero(unstable)[0]]
+    self.marginal = [self._Describe(poles, index)
+                     for index in numpy.nonzero(marginal)[0]]
+    self.alternating = [self._Describe(poles, index)
+                        for index in numpy.nonzero(alternating)[0]]
+
+  def _Describe(self, poles, index):
+    """Describes the poles of row index of the stacked poles."""
+    num_loops = len(self.names)
+    return '%s %s poles %s (radius %.4f, damping %.3f)' % (
+        self.names[index % num_loops],
+        'observer' if index >= num_loops else 'controller',
+        poles[index], self.spectral_radius[index], self.min_damping[index])
+
+  def __str__(self):
+    lines = ['Unstable: %s' % line for line in self.unstable]
+    lines.extend('Marginal: %s' % line for line in self.marginal)
+    lines.extend('Alternating: %s' % line for line in self.alternating)
+    if not lines:
+      lines.append('All %d loops are stable.' % len(self.names))
+    return '\n'.join(lines)
+
 
 class ControlLoopWriter(object):
-  def __init__(self, gain_schedule_name, loops, namespaces=None):
+  def __init__(self, gain_schedule_name, loops, namespaces=None,
+               fused=False, breakpoints=None):
     """Constructs a control loop writer.
 
     Args:
@@ -11,9 +373,24 @@ class ControlLoopWriter(object):
         in order.
       namespaces: array[string], a list of names of namespaces to nest in
         order.  If None, the default will be used.
+      fused: boolean, If true, also write the precomputed matrices from
+        ControlLoop.DerivedMatrices, and unrolled observer and controller step
+        functions which skip the exact zeros.  The java gains then need the
+        StateSpaceGains constructor which takes the extra matrices.
+      breakpoints: array[float], The value of the scheduling variable for each
+        loop.  If provided, the loops are written sorted by breakpoint along
+        with lookup and K and L interpolation functions.  See GainSchedule.
     """
     self._gain_schedule_name = gain_schedule_name
-    self._loops = loops
+    self._fused = fused
+    # (Fingerprint, StabilityReport) of the last gains checked.
+    self._stability = None
+    if breakpoints is None:
+      self._schedule = None
+      self._loops = loops
+    else:
+      self._schedule = GainSchedule(breakpoints, loops)
+      self._loops = self._schedule.loops
     if namespaces:
       self._namespaces = namespaces
     else:
@@ -30,9 +407,54 @@ class ControlLoopWriter(object):
             header_file.upper().replace('.', '_').replace('/', '_') +
             '_')
 
+  def CheckStability(self):
+    """Checks the closed loop poles of every loop in the schedule.
+
+    Marginal and alternating loops are reported on stderr, once for each
+    version of the gains.  Every method which writes gains out checks first.
+
+    Raises:
+      ValueError: A loop has an unstable controller or observer.
+
+    Returns:
+      StabilityReport, the report.
+    """
+    fingerprint = self.Fingerprint()
+    if self._stability is not None and self._stability[0] == fingerprint:
+      return self._stability[1]
+
+    report = StabilityReport(self._loops)
+    if report.unstable:
+      raise ValueError('%s has unstable loops:\n%s' % (
+          self._gain_schedule_name, report))
+    for line in report.marginal:
+      sys.stderr.write('%s: marginal %s\n' % (self._gain_schedule_name, line))
+    for line in report.alternating:
+      sys.stderr.write('%s: alternating %s\n' % (self._gain_schedule_name,
+                                                  line))
+    self._stability = (fingerprint, report)
+    return report
+
   def Write(self, java_file):
-    """Writes the loops to the specified files."""
-    self.WriteJava(java_file)
+    """Checks the stability of the loops, and writes them out.
+
+    Raises:
+      ValueError: A loop is unstable.  See CheckStability.
+
+    Returns:
+      boolean, True if any file was changed.
+    """
+    return self.WriteJava(java_file)
+
+  def Fingerprint(self):
+    """Returns a hex digest which identifies the generated gain schedule."""
+    if self._schedule is None:
+      breakpoints = None
+    else:
+      breakpoints = self._schedule.breakpoints
+    return _Fingerprint(self._gain_schedule_name, self._namespaces,
+                        breakpoints,
+                        *[loop.Fingerprint() for loop in self._loops])
 
   def _GenericType(self, typename):
     """Returns a loop template using typename for the type."""
@@ -59,8 +481,18 @@ class ControlLoopWriter(object):
     return self._GenericType('StateFeedbackPlantCoefficients')
 
   def WriteJava(self, java_file):
-    """Writes the java file to the file named java_file."""
-    with open(java_file, 'w') as fd:
+    """Writes the java file to the file named java_file.
+
+    Raises:
+      ValueError: A loop is unstable.  See CheckStability.
+
+    Returns:
+      boolean, True if the file was changed.
+    """
+    self.CheckStability()
+    generated_file = _GeneratedFile(java_file)
+    with generated_file as fd:
+      fd.write('// Gain schedule fingerprint %s\n' % self.Fingerprint())
       fd.write('package com.team254.frc2014;\n')
       fd.write('\n')
       fd.write('import com.team254.lib.StateSpaceGains;\n')
@@ -69,14 +501,174 @@ class ControlLoopWriter(object):
       fd.write('  static public StateSpaceGains[] getGains() {\n')
       fd.write('    return new StateSpaceGains[] {\n')
       for loop in self._loops:
-        fd.write(loop.DumpPlantJava())
+        fd.write(loop.DumpPlantJava(fused=self._fused))
       fd.write('        };\n')
       fd.write('  }\n')
+      if self._schedule is not None:
+        fd.write('\n')
+        fd.write(self._DumpScheduleJava())
+      if self._fused:
+        for index, loop in enumerate(self._loops):
+          fd.write('\n')
+          fd.write(loop.DumpObserverStepJava('observerStep%d' % index))
+          fd.write('\n')
+          fd.write(loop.DumpControllerStepJava('controllerStep%d' % index))
       fd.write('}\n')
+    return generated_file.changed
+
+  def _ScheduleTable(self, name):
+    """Returns the named matrix of every loop, flattened row-major, as text."""
+    return [', '.join(repr(float(value))
+                      for value in numpy.asarray(getattr(loop, name)).flat)
+            for loop in self._loops]
+
+  def _DumpScheduleJava(self):
+    """Writes out the java breakpoint lookup and interpolation functions."""
+    num_loops = len(self._loops)
+    ans = ['  static private final double[] BREAKPOINTS = {\n'
+           '      %s};\n' % ', '.join(repr(float(value))
+                                    for value in self._schedule.breakpoints)]
+    for name in ['K', 'L']:
+      ans.append('  static private final double[][] %s_TABLE = {\n' % name)
+      ans.extend('      {%s},\n' % row for row in self._ScheduleTable(name))
+      ans.append('  };\n')
+    ans.append('\n')
+    ans.append('  static public double[] getBreakpoints() {\n'
+               '    return (double[]) BREAKPOINTS.clone();\n'
+               '  }\n'
+               '\n'
+               '  // Returns the index of the last breakpoint <= value, clamped'
+               ' to the ends.\n'
+               '  static public int lookup(double value) {\n'
+               '    int low = 0;\n'
+               '    int high = %d;\n'
+               '    while (low < high) {\n'
+               '      int middle = (low + high + 1) / 2;\n'
+               '      if (BREAKPOINTS[middle] <= value) {\n'
+               '        low = middle;\n'
+               '      } else {\n'
+               '        high = middle - 1;\n'
+               '      }\n'
+               '    }\n'
+               '    return low;\n'
+               '  }\n'
+               '\n'
+               '  static private void interpolate(double[][] table,'
+               ' double value,\n'
+               '      double[] out) {\n'
+               '    int index = lookup(value);\n'
+               '    if (index == %d || value <= BREAKPOINTS[0]) {\n'
+               '      System.arraycopy(table[index], 0, out, 0, out.length);\n'
+               '      return;\n'
+               '    }\n'
+               '    double fraction = (value - BREAKPOINTS[index]) /\n'
+               '        (BREAKPOINTS[index + 1] - BREAKPOINTS[index]);\n'
+               '    for (int i = 0; i < out.length; ++i) {\n'
+               '      out[i] = table[index][i] +\n'
+               '          fraction * (table[index + 1][i] - table[index][i]);\n'
+               '    }\n'
+               '  }\n' % (num_loops - 1, num_loops - 1))
+    for name in ['K', 'L']:
+      ans.append('\n'
+                 '  // Sets %s to %s interpolated linearly to value.\n'
+                 '  static public void interpolate%s(double value,'
+                 ' double[] %s) {\n'
+                 '    interpolate(%s_TABLE, value, %s);\n'
+                 '  }\n' % ((name.lower(), name, name, name.lower(), name,
+                              name.lower())))
+    return ''.join(ans)
+
+  def _DumpScheduleHeader(self):
+    """Writes out the c++ declarations for the breakpoint lookup functions."""
+    num_states = self._loops[0].A.shape[0]
+    num_inputs = self._loops[0].B.shape[1]
+    num_outputs = self._loops[0].C.shape[0]
+    return ('// Returns the index of the last breakpoint <= value, clamped to'
+            ' the ends.\n'
+            'int %sLookup(double value);\n\n'
+            '// Sets K to K interpolated linearly to value.\n'
+            'void %sInterpolateK(double value,'
+            ' Eigen::Matrix<double, %d, %d> *K);\n\n'
+            '// Sets L to L interpolated linearly to value.\n'
+            'void %sInterpolateL(double value,'
+            ' Eigen::Matrix<double, %d, %d> *L);\n\n' % (
+                self._gain_schedule_name,
+                self._gain_schedule_name, num_inputs, num_states,
+                self._gain_schedule_name, num_states, num_outputs))
+
+  def _DumpScheduleCC(self):
+    """Writes out the c++ breakpoint lookup and interpolation functions."""
+    num_states = self._loops[0].A.shape[0]
+    num_inputs = self._loops[0].B.shape[1]
+    num_outputs = self._loops[0].C.shape[0]
+    num_loops = len(self._loops)
+    name = self._gain_schedule_name
+
+    ans = ['namespace {\n\n',
+           'const int kNumBreakpoints = %d;\n' % num_loops,
+           'const double kBreakpoints[%d] = {%s};\n' % (
+               num_loops, ', '.join(repr(float(value))
+                                    for value in self._schedule.breakpoints))]
+    for matrix_name, size in [('K', num_inputs * num_states),
+                              ('L', num_states * num_outputs)]:
+      ans.append('const double k%sTable[%d][%d] = {\n' % (
+          matrix_name, num_loops, size))
+      ans.extend('    {%s},\n' % row
+                 for row in self._ScheduleTable(matrix_name))
+      ans.append('};\n')
+    ans.append('\n}  // namespace\n\n')
+
+    ans.append('int %sLookup(double value) {\n'
+               '  int low = 0;\n'
+               '  int high = kNumBreakpoints - 1;\n'
+               '  while (low < high) {\n'
+               '    const int middle = (low + high + 1) / 2;\n'
+               '    if (kBreakpoints[middle] <= value) {\n'
+               '      low = middle;\n'
+               '    } else {\n'
+               '      high = middle - 1;\n'
+               '    }\n'
+               '  }\n'
+               '  return low;\n'
+               '}\n\n' % name)
+
+    for matrix_name, rows, cols in [('K', num_inputs, num_states),
+                                    ('L', num_states, num_outputs)]:
+      ans.append('void %sInterpolate%s(double value,'
+                 ' Eigen::Matrix<double, %d, %d> *%s) {\n' % (
+                     name, matrix_name, rows, cols, matrix_name))
+      ans.append('  const int index = %sLookup(value);\n' % name)
+      ans.append('  const double *low = k%sTable[index];\n'
+                 '  const double *high = low;\n'
+                 '  double fraction = 0.0;\n'
+                 '  if (index < kNumBreakpoints - 1 &&'
+                 ' value > kBreakpoints[0]) {\n'
+                 '    high = k%sTable[index + 1];\n'
+                 '    fraction = (value - kBreakpoints[index]) /\n'
+                 '        (kBreakpoints[index + 1] - kBreakpoints[index]);\n'
+                 '  }\n' % (matrix_name, matrix_name))
+      ans.append('  for (int i = 0; i < %d; ++i) {\n'
+                 '    for (int j = 0; j < %d; ++j) {\n'
+                 '      const int element = i * %d + j;\n'
+                 '      (*%s)(i, j) = low[element] +\n'
+                 '          fraction * (high[element] - low[element]);\n'
+                 '    }\n'
+                 '  }\n'
+                 '}\n\n' % (rows, cols, cols, matrix_name))
+    return ''.join(ans)
 
   def WriteHeader(self, header_file):
-    """Writes the header file to the file named header_file."""
-    with open(header_file, 'w') as fd:
+    """Writes the header file to the file named header_file.
+
+    Raises:
+      ValueError: A loop is unstable.  See CheckStability.
+
+    Returns:
+      boolean, True if the file was changed.
+    """
+    self.CheckStability()
+    generated_file = _GeneratedFile(header_file)
+    with generated_file as fd:
       header_guard = self._HeaderGuard(header_file)
       fd.write('#ifndef %s\n'
                '#define %s\n\n' % (header_guard, header_guard))
@@ -90,6 +682,11 @@ class ControlLoopWriter(object):
         fd.write('\n')
         fd.write(loop.DumpControllerHeader())
         fd.write('\n')
+        if self._fused:
+          fd.write(loop.DumpObserverStepHeader())
+          fd.write('\n')
+          fd.write(loop.DumpControllerStepHeader())
+          fd.write('\n')
 
       fd.write('%s Make%sPlant();\n\n' %
                (self._PlantType(), self._gain_schedule_name))
@@ -97,13 +694,27 @@ class ControlLoopWriter(object):
       fd.write('%s Make%sLoop();\n\n' %
                (self._LoopType(), self._gain_schedule_name))
 
+      if self._schedule is not None:
+        fd.write(self._DumpScheduleHeader())
+
       fd.write(self._namespace_end)
       fd.write('\n\n')
       fd.write("#endif  // %s\n" % header_guard)
+    return generated_file.changed
 
   def WriteCC(self, header_file_name, cc_file):
-    """Writes the cc file to the file named cc_file."""
-    with open(cc_file, 'w') as fd:
+    """Writes the cc file to the file named cc_file.
+
+    Raises:
+      ValueError: A loop is unstable.  See CheckStability.
+
+    Returns:
+      boolean, True if the file was changed.
+    """
+    self.CheckStability()
+    generated_file = _GeneratedFile(cc_file)
+    with generated_file as fd:
+      fd.write('// Gain schedule fingerprint %s\n' % self.Fingerprint())
       fd.write('#include \"frc971/control_loops/%s\"\n' % header_file_name)
       fd.write('\n')
       fd.write('#include <vector>\n')
@@ -120,6 +731,13 @@ class ControlLoopWriter(object):
         fd.write(loop.DumpController())
         fd.write('\n')
 
+      if self._fused:
+        for loop in self._loops:
+          fd.write(loop.DumpObserverStep())
+          fd.write('\n')
+          fd.write(loop.DumpControllerStep())
+          fd.write('\n')
+
       fd.write('%s Make%sPlant() {\n' %
                (self._PlantType(), self._gain_schedule_name))
       fd.write('  ::std::vector<%s *> plants(%d);\n' % (
@@ -142,8 +760,291 @@ class ControlLoopWriter(object):
       fd.write('  return %s(controllers);\n' % self._LoopType())
       fd.write('}\n\n')
 
+      if self._schedule is not None:
+        fd.write(self._DumpScheduleCC())
+
       fd.write(self._namespace_end)
       fd.write('\n')
+    return generated_file.changed
+
+  def _BinaryShapes(self):
+    """Returns the names and shapes of the matrices of each binary loop."""
+    num_states = self._loops[0].A.shape[0]
+    num_inputs = self._loops[0].B.shape[1]
+    num_outputs = self._loops[0].C.shape[0]
+    return _BinaryMatrixShapes(num_states, num_inputs, num_outputs)
+
+  def _BinaryLoopBytes(self):
+    """Returns the number of bytes each loop takes in the binary file."""
+    return sum(rows * cols for _, (rows, cols) in self._BinaryShapes()) * 8
+
+  def WriteBinary(self, binary_file):
+    """Writes all the loops at full precision to the binary file binary_file.
+
+    See BINARY_MAGIC for the format.
+
+    Raises:
+      ValueError: A loop is unstable.  See CheckStability.
+
+    Returns:
+      boolean, True if the file was changed.
+    """
+    self.CheckStability()
+    num_states = self._loops[0].A.shape[0]
+    num_inputs = self._loops[0].B.shape[1]
+    num_outputs = self._loops[0].C.shape[0]
+    shapes = self._BinaryShapes()
+
+    contents = [_BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION,
+                                    len(self._loops), num_states, num_inputs,
+                                    num_outputs)]
+    for loop in self._loops:
+      for name, shape in shapes:
+        matrix = numpy.asarray(getattr(loop, name), dtype='<f8')
+        if matrix.shape != shape:
+          raise ValueError('Loop %s has a %s of shape %s, expected %s.' % (
+              loop._name, name, matrix.shape, shape))
+        contents.append(matrix.tostring())
+    return _WriteIfChanged(binary_file, ''.join(contents))
+
+  def WriteJavaBinaryLoader(self, java_file):
+    """Writes a java class which loads the gains written by WriteBinary.
+
+    Returns:
+      boolean, True if the file was changed.
+    """
+    num_states = self._loops[0].A.shape[0]
+    num_inputs = self._loops[0].B.shape[1]
+    num_outputs = self._loops[0].C.shape[0]
+    generated_file = _GeneratedFile(java_file)
+    with generated_file as fd:
+      fd.write('package com.team254.frc2014;\n')
+      fd.write('\n')
+      fd.write('import com.team254.lib.StateSpaceGains;\n')
+      fd.write('import java.io.IOException;\n')
+      fd.write('import java.io.RandomAccessFile;\n')
+      fd.write('import java.nio.ByteBuffer;\n')
+      fd.write('import java.nio.ByteOrder;\n')
+      fd.write('\n')
+      fd.write('public class %sGainsLoader {\n' % self._gain_schedule_name)
+      fd.write('  static private double[] readMatrix(ByteBuffer buffer,'
+               ' int size) {\n')
+      fd.write('    double[] matrix = new double[size];\n')
+      fd.write('    for (int i = 0; i < size; ++i) {\n')
+      fd.write('      matrix[i] = buffer.getDouble();\n')
+      fd.write('    }\n')
+      fd.write('    return matrix;\n')
+      fd.write('  }\n')
+      fd.write('\n')
+      fd.write('  static public StateSpaceGains[] getGains(String filename)\n')
+      fd.write('      throws IOException {\n')
+      fd.write('    RandomAccessFile file = new RandomAccessFile(filename,'
+               ' "r");\n')
+      fd.write('    byte[] contents;\n')
+      fd.write('    try {\n')
+      fd.write('      contents = new byte[(int) file.length()];\n')
+      fd.write('      file.readFully(contents);\n')
+      fd.write('    } finally {\n')
+      fd.write('      file.close();\n')
+      fd.write('    }\n')
+      fd.write('\n')
+      fd.write('    ByteBuffer buffer = ByteBuffer.wrap(contents);\n')
+      fd.write('    buffer.order(ByteOrder.LITTLE_ENDIAN);\n')
+      fd.write('    if (contents.length < %d' % _BINARY_HEADER.size)
+      for character in BINARY_MAGIC:
+        fd.write(' ||\n        buffer.get() != \'%s\'' % character)
+      fd.write(') {\n')
+      fd.write('      throw new IOException(filename + " is not a gain'
+               ' schedule.");\n')
+      fd.write('    }\n')
+      fd.write('    if (buffer.getInt() != %d) {\n' % BINARY_VERSION)
+      fd.write('      throw new IOException(filename + " has the wrong'
+               ' version.");\n')
+      fd.write('    }\n')
+      fd.write('    int numLoops = buffer.getInt();\n')
+      fd.write('    if (buffer.getInt() != %d || buffer.getInt() != %d ||\n'
+               '        buffer.getInt() != %d ||\n'
+               '        buffer.remaining() != numLoops * %d) {\n' % (
+                   num_states, num_inputs, num_outputs,
+                   self._BinaryLoopBytes()))
+      fd.write('      throw new IOException(filename + " has the wrong'
+               ' shape.");\n')
+      fd.write('    }\n')
+      fd.write('\n')
+      fd.write('    StateSpaceGains[] gains = new StateSpaceGains[numLoops];\n')
+      fd.write('    for (int i = 0; i < numLoops; ++i) {\n')
+      fd.write('      gains[i] = new StateSpaceGains(\n')
+      fd.write(',\n'.join('          readMatrix(buffer, %d)' % (rows * cols)
+                          for _, (rows, cols) in self._BinaryShapes()))
+      fd.write(');\n')
+      fd.write('    }\n')
+      fd.write('    return gains;\n')
+      fd.write('  }\n')
+      fd.write('}\n')
+    return generated_file.changed
+
+  def WriteBinaryLoaderHeader(self, header_file):
+    """Writes a header declaring the loaders for the gains from WriteBinary.
+
+    Returns:
+      boolean, True if the file was changed.
+    """
+    generated_file = _GeneratedFile(header_file)
+    with generated_file as fd:
+      header_guard = self._HeaderGuard(header_file)
+      fd.write('#ifndef %s\n'
+               '#define %s\n\n' % (header_guard, header_guard))
+      fd.write('#include \"frc971/control_loops/state_feedback_loop.h\"\n')
+      fd.write('\n')
+
+      fd.write(self._namespace_start)
+      fd.write('\n\n')
+      fd.write('// Returns NULL if filename isn\'t a matching gain schedule.\n')
+      fd.write('%s *Load%sPlant(const char *filename);\n\n' %
+               (self._PlantType(), self._gain_schedule_name))
+
+      fd.write('// Returns NULL if filename isn\'t a matching gain schedule.\n')
+      fd.write('%s *Load%sLoop(const char *filename);\n\n' %
+               (self._LoopType(), self._gain_schedule_name))
+
+      fd.write(self._namespace_end)
+      fd.write('\n\n')
+      fd.write("#endif  // %s\n" % header_guard)
+    return generated_file.changed
+
+  def WriteBinaryLoaderCC(self, header_file_name, cc_file):
+    """Writes the loaders for the gains from WriteBinary to cc_file.
+
+    Returns:
+      boolean, True if the file was changed.
+    """
+    num_states = self._loops[0].A.shape[0]
+    num_inputs = self._loops[0].B.shape[1]
+    num_outputs = self._loops[0].C.shape[0]
+    shapes = self._BinaryShapes()
+
+    generated_file = _GeneratedFile(cc_file)
+    with generated_file as fd:
+      fd.write('#include \"frc971/control_loops/%s\"\n' % header_file_name)
+      fd.write('\n')
+      fd.write('#include <stdint.h>\n')
+      fd.write('#include <stdio.h>\n')
+      fd.write('#include <string.h>\n')
+      fd.write('\n')
+      fd.write('#include <vector>\n')
+      fd.write('\n')
+      fd.write('#include \"frc971/control_loops/state_feedback_loop.h\"\n')
+      fd.write('\n')
+      fd.write(self._namespace_start)
+      fd.write('\n')
+      fd.write('namespace {\n\n')
+
+      fd.write('// The schedule is little-endian, like the robot.\n')
+      fd.write('template <int rows, int cols>\n')
+      fd.write('Eigen::Matrix<double, rows, cols> ReadMatrix('
+               'const char **data) {\n')
+      fd.write('  Eigen::Matrix<double, rows, cols> matrix;\n')
+      fd.write('  for (int i = 0; i < rows; ++i) {\n')
+      fd.write('    for (int j = 0; j < cols; ++j) {\n')
+      fd.write('      memcpy(&matrix(i, j), *data, sizeof(double));\n')
+      fd.write('      *data += sizeof(double);\n')
+      fd.write('    }\n')
+      fd.write('  }\n')
+      fd.write('  return matrix;\n')
+      fd.write('}\n\n')
+
+      fd.write('uint32_t ReadUint32(const char **data) {\n')
+      fd.write('  uint32_t value;\n')
+      fd.write('  memcpy(&value, *data, sizeof(value));\n')
+      fd.write('  *data += sizeof(value);\n')
+      fd.write('  return value;\n')
+      fd.write('}\n\n')
+
+      fd.write('// Reads filename with a single read, and checks the header.\n')
+      fd.write('// Returns the number of loops, or -1 on error.\n')
+      fd.write('int ReadSchedule(const char *filename, '
+               '::std::vector<char> *contents) {\n')
+      fd.write('  FILE *file = fopen(filename, "rb");\n')
+      fd.write('  if (file == NULL) return -1;\n')
+      fd.write('  fseek(file, 0, SEEK_END);\n')
+      fd.write('  const long size = ftell(file);\n')
+      fd.write('  fseek(file, 0, SEEK_SET);\n')
+      fd.write('  if (size < %d) {\n' % _BINARY_HEADER.size)
+      fd.write('    fclose(file);\n')
+      fd.write('    return -1;\n')
+      fd.write('  }\n')
+      fd.write('  contents->resize(size);\n')
+      fd.write('  const size_t read = fread(&(*contents)[0], 1, size, file);\n')
+      fd.write('  fclose(file);\n')
+      fd.write('  if (read != static_cast<size_t>(size)) return -1;\n')
+      fd.write('\n')
+      fd.write('  const char *data = &(*contents)[0];\n')
+      fd.write('  if (memcmp(data, "%s", 4) != 0) return -1;\n' % BINARY_MAGIC)
+      fd.write('  data += 4;\n')
+      fd.write('  if (ReadUint32(&data) != %d) return -1;\n' % BINARY_VERSION)
+      fd.write('  const uint32_t num_loops = ReadUint32(&data);\n')
+      fd.write('  if (ReadUint32(&data) != %d) return -1;\n' % num_states)
+      fd.write('  if (ReadUint32(&data) != %d) return -1;\n' % num_inputs)
+      fd.write('  if (ReadUint32(&data) != %d) return -1;\n' % num_outputs)
+      fd.write('  if (static_cast<size_t>(size) != %d + num_loops * %d) {\n' % (
+          _BINARY_HEADER.size, self._BinaryLoopBytes()))
+      fd.write('    return -1;\n')
+      fd.write('  }\n')
+      fd.write('  return num_loops;\n')
+      fd.write('}\n\n')
+
+      fd.write('%s ReadCoefficients(\n'
+               '    const char **data, %s *L,\n'
+               '    %s *K) {\n' % (
+          self._CoeffType(),
+          'Eigen::Matrix<double, %d, %d>' % shapes[4][1],
+          'Eigen::Matrix<double, %d, %d>' % shapes[5][1]))
+      for name, shape in shapes:
+        if name in ('L', 'K'):
+          fd.write('  *%s = ReadMatrix<%d, %d>(data);\n' % (
+              (name,) + shape))
+        else:
+          fd.write('  const Eigen::Matrix<double, %d, %d> %s = '
+                   'ReadMatrix<%d, %d>(data);\n' % (shape + (name,) + shape))
+      fd.write('  return %s(A, B, C, D, U_max, U_min);\n' %
+               self._CoeffType())
+      fd.write('}\n\n')
+
+      fd.write('}  // namespace\n\n')
+
+      for function_name, vector_type, vector_name, result_type in (
+          ('Plant', self._CoeffType(), 'plants', self._PlantType()),
+          ('Loop', self._ControllerType(), 'controllers', self._LoopType())):
+        fd.write('%s *Load%s%s(const char *filename) {\n' % (
+            result_type, self._gain_schedule_name, function_name))
+        fd.write('  ::std::vector<char> contents;\n')
+        fd.write('  const int num_loops = ReadSchedule(filename, '
+                 '&contents);\n')
+        fd.write('  if (num_loops < 0) return NULL;\n')
+        fd.write('  const char *data = &contents[%d];\n' %
+                 _BINARY_HEADER.size)
+        fd.write('  ::std::vector<%s *> %s(num_loops);\n' % (
+            vector_type, vector_name))
+        fd.write('  for (int i = 0; i < num_loops; ++i) {\n')
+        fd.write('    Eigen::Matrix<double, %d, %d> L;\n' % shapes[4][1])
+        fd.write('    Eigen::Matrix<double, %d, %d> K;\n' % shapes[5][1])
+        if function_name == 'Plant':
+          fd.write('    %s[i] = new %s(\n'
+                   '        ReadCoefficients(&data, &L, &K));\n' % (
+                       vector_name, vector_type))
+        else:
+          fd.write('    const %s coefficients =\n'
+                   '        ReadCoefficients(&data, &L, &K);\n' %
+                   self._CoeffType())
+          fd.write('    %s[i] = new %s(L, K, coefficients);\n' % (
+              vector_name, vector_type))
+        fd.write('  }\n')
+        fd.write('  return new %s(%s);\n' % (result_type, vector_name))
+        fd.write('}\n\n')
+
+      fd.write(self._namespace_end)
+      fd.write('\n')
+    return generated_file.changed
 
 
 class ControlLoop(object):
@@ -166,7 +1067,93 @@ class ControlLoop(object):
       Returns:
         (A, B), numpy.matrix, the control matricies.
     """
-    return controls.c2d(A_continuous, B_continuous, dt)
+    return _CachedDesign(
+        _Fingerprint('c2d', A_continuous, B_continuous, dt),
+        lambda: controls.c2d(A_continuous, B_continuous, dt))
+
+  def _BatchParameters(self, parameters, names):
+    """Broadcasts arrays of physical parameters against each other.
+
+    Args:
+      parameters: dict, Arrays of parameter values keyed by attribute name.
+      names: array[string], The parameters to return.  Missing parameters use
+        the loop's attribute of the same name.
+
+    Returns:
+      array[numpy.array(N)], the parameters in the order of names.
+    """
+    return numpy.broadcast_arrays(*[
+        numpy.atleast_1d(numpy.asarray(parameters.get(name, getattr(self, name)),
+                                       dtype=numpy.float64))
+        for name in names])
+
+  def Copy(self):
+    """Returns a copy of the loop which shares nothing mutable with it.
+
+    Much cheaper than constructing the loop again, since nothing is designed.
+    """
+    loop = copy.copy(self)
+    for name, value in vars(self).iteritems():
+      if isinstance(value, numpy.ndarray):
+        setattr(loop, name, value.copy())
+    return loop
+
+  def StepMatrices(self, k):
+    """Returns the matrices which take k steps at once with U held constant.
+
+    X(n + k) = A_k X(n) + B_k U, with A_k = A^k and
+    B_k = (A^(k - 1) + ... + A + I) B.  These are computed by squaring, and
+    the most recent STEP_MATRIX_CACHE_SIZE are kept, so a new k costs
+    O(log k) multiplies and a repeated k is a lookup.  The caches are thrown
+    away if A or B change.
+
+    Args:
+      k: int, The number of steps, at least 0.
+
+    Returns:
+      (A_k, B_k), numpy.matrix.  Don't modify them, they are cached.
+    """
+    if k < 0:
+      raise ValueError('k must not be negative, got %d.' % k)
+    fingerprint = _Fingerprint(self.A, self.B)
+    if getattr(self, '_step_matrix_fingerprint', None) != fingerprint:
+      self._step_matrix_fingerprint = fingerprint
+      self._step_matrix_cache = collections.OrderedDict()
+      # (A^(2^i), A^(2^i - 1) + ... + I) for i = 0, 1, ...
+      self._step_matrix_squares = [
+          (self.A, numpy.matrix(numpy.eye(self.A.shape[0])))]
+
+    cache = self._step_matrix_cache
+    if k in cache:
+      matrices = cache.pop(k)
+    else:
+      squares = self._step_matrix_squares
+      A_k = numpy.matrix(numpy.eye(self.A.shape[0]))
+      sum_k = numpy.matrix(numpy.zeros(self.A.shape))
+      bit = 0
+      while k >> bit:
+        if bit == len(squares):
+          power, total = squares[-1]
+          squares.append((power * power, total + power * total))
+        if (k >> bit) & 1:
+          power, total = squares[bit]
+          # Appending 2^bit more steps to the ones so far.
+          sum_k = sum_k + A_k * total
+          A_k = A_k * power
+        bit += 1
+      matrices = (A_k, sum_k * self.B)
+      if len(cache) >= STEP_MATRIX_CACHE_SIZE:
+        cache.popitem(last=False)
+    cache[k] = matrices
+    return matrices
+
+  def Predict(self, X, U, k):
+    """Returns the state k steps after X with U held constant.
+
+    Useful for compensating for k steps of latency.
+    """
+    A_k, B_k = self.StepMatrices(k)
+    return A_k * X + B_k * numpy.clip(U, self.U_min, self.U_max)
 
   def InitializeState(self):
     """Sets X, Y, and X_hat to zero defaults."""
@@ -174,14 +1161,144 @@ class ControlLoop(object):
     self.Y = self.C * self.X
     self.X_hat = numpy.zeros((self.A.shape[0], 1))
 
-  def PlaceControllerPoles(self, poles):
+  def _Augmented(self, name, A, B, C, D):
+    """Returns an undesigned loop with the provided matrices.
+
+    The time step and input limits are copied from this loop.  K and L still
+    need to be placed.
+    """
+    loop = ControlLoop(name or self._name)
+    if hasattr(self, 'dt'):
+      loop.dt = self.dt
+    loop.A = numpy.matrix(A, dtype=numpy.float64)
+    loop.B = numpy.matrix(B, dtype=numpy.float64)
+    loop.C = numpy.matrix(C, dtype=numpy.float64)
+    loop.D = numpy.matrix(D, dtype=numpy.float64)
+    loop.U_max = numpy.matrix(self.U_max)
+    loop.U_min = numpy.matrix(self.U_min)
+    loop.InitializeState()
+    return loop
+
+  def AugmentDeltaU(self, name=None):
+    """Returns this plant with U as a state, driven by the change in U.
+
+    The state is [U; X], so
+      U(n + 1) = U(n) + dU(n), X(n + 1) = A X(n) + B U(n)
+    The discrete matrices of this loop are used as is.
+
+    Args:
+      name: string, The name of the new loop.  Defaults to this loop's name.
+
+    Returns:
+      ControlLoop, the augmented plant, without K or L.
+    """
+    num_states = self.A.shape[0]
+    num_inputs = self.B.shape[1]
+    return self._Augmented(
+        name,
+        numpy.bmat([[numpy.eye(num_inputs),
+                     numpy.zeros((num_inputs, num_states))],
+                    [self.B, self.A]]),
+        numpy.bmat([[numpy.eye(num_inputs)],
+                    [numpy.zeros((num_states, num_inputs))]]),
+        numpy.bmat([[self.D, self.C]]),
+        numpy.zeros(self.D.shape))
+
+  def AugmentIntegral(self, name=None):
+    """Returns this plant with the integral of its output error as states.
+
+    The inputs are [U; R], where R is the reference for the outputs, and the
+    state is [X; Z], with
+      Z(n + 1) = Z(n) + dt (R(n) - Y(n))
+    so Z only settles once Y reaches R.  The controller computes Z itself, so
+    Z is added to the outputs for the observer.  R isn't limited.
+
+    Place K with num_inputs set to the number of inputs of this loop, so R
+    gets no gain, then drive the plant with U = -K X_hat and the reference.
+
+    Args:
+      name: string, The name of the new loop.  Defaults to this loop's name.
+
+    Returns:
+      ControlLoop, the augmented plant, without K or L.
+    """
+    num_states = self.A.shape[0]
+    num_inputs = self.B.shape[1]
+    num_outputs = self.C.shape[0]
+    loop = self._Augmented(
+        name,
+        numpy.bmat([[self.A, numpy.zeros((num_states, num_outputs))],
+                    [-self.dt * self.C, numpy.eye(num_outputs)]]),
+        numpy.bmat([[self.B, numpy.zeros((num_states, num_outputs))],
+                    [-self.dt * self.D, self.dt * numpy.eye(num_outputs)]]),
+        numpy.bmat([[self.C, numpy.zeros((num_outputs, num_outputs))],
+                    [numpy.zeros((num_outputs, num_states)),
+                     numpy.eye(num_outputs)]]),
+        numpy.bmat([[self.D, numpy.zeros((num_outputs, num_outputs))],
+                    [numpy.zeros((num_outputs, num_inputs + num_outputs))]]))
+    loop.U_max = numpy.matrix(numpy.vstack(
+        (self.U_max, numpy.full((num_outputs, 1), numpy.inf))))
+    loop.U_min = numpy.matrix(numpy.vstack(
+        (self.U_min, numpy.full((num_outputs, 1), -numpy.inf))))
+    return loop
+
+  def AugmentInputDisturbance(self, name=None):
+    """Returns this plant with a constant disturbance on each input as states.
+
+    The state is [X; W], with X(n + 1) = A X(n) + B (U(n) + W(n)) and
+    W(n + 1) = W(n), so the observer estimates the disturbance.
+
+    Args:
+      name: string, The name of the new loop.  Defaults to this loop's name.
+
+    Returns:
+      ControlLoop, the augmented plant, without K or L.
+    """
+    num_states = self.A.shape[0]
+    num_inputs = self.B.shape[1]
+    return self._Augmented(
+        name,
+        numpy.bmat([[self.A, self.B],
+                    [numpy.zeros((num_inputs, num_states)),
+                     numpy.eye(num_inputs)]]),
+        numpy.bmat([[self.B], [numpy.zeros((num_inputs, num_inputs))]]),
+        numpy.bmat([[self.C, self.D]]),
+        self.D)
+
+  def Reduce(self, order=None, tolerance=None, name=None):
+    """Returns this plant reduced by balanced truncation.
+
+    See controls.balred for order and tolerance.
+
+    Args:
+      name: string, The name of the new loop.  Defaults to this loop's name.
+
+    Returns:
+      (loop, hankel), the reduced plant without K or L, and the Hankel singular
+        values of this plant.
+    """
+    A, B, C, D, hankel = controls.balred(self.A, self.B, self.C, self.D,
+                                         order=order, tolerance=tolerance)
+    return self._Augmented(name, A, B, C, D), hankel
+
+  def PlaceControllerPoles(self, poles, num_inputs=None):
     """Places the controller poles.
 
     Args:
       poles: array, An array of poles.  Must be complex conjegates if they have
         any imaginary portions.
+      num_inputs: int, The number of leading inputs the controller drives.  The
+        rest, like the reference of AugmentIntegral, get rows of zeros in K.
+        Defaults to all of them.
     """
-    self.K = controls.dplace(self.A, self.B, poles)
+    B = self.B if num_inputs is None else self.B[:, :num_inputs]
+    K, = _CachedDesign(
+        _Fingerprint('dplace', self.A, B, list(poles)),
+        lambda: (controls.dplace(self.A, B, poles),))
+    if B.shape[1] < self.B.shape[1]:
+      K = numpy.matrix(numpy.vstack((
+          K, numpy.zeros((self.B.shape[1] - B.shape[1], self.A.shape[0])))))
+    self.K = K
 
   def PlaceObserverPoles(self, poles):
     """Places the observer poles.
@@ -190,7 +1307,102 @@ class ControlLoop(object):
       poles: array, An array of poles.  Must be complex conjegates if they have
         any imaginary portions.
     """
-    self.L = controls.dplace(self.A.T, self.C.T, poles).T
+    L_transpose, = _CachedDesign(
+        _Fingerprint('dplace', self.A.T, self.C.T, list(poles)),
+        lambda: (controls.dplace(self.A.T, self.C.T, poles),))
+    self.L = L_transpose.T
+
+  def DerivedMatrices(self):
+    """Returns the matrix products the robot would otherwise redo every cycle.
+
+    With U = K (R - X_hat), the observer update is
+      X_hat = A_LC X_hat + B_LD U + L Y
+    and the closed loop plant is X = A_BK X + B K R.  KA is K A.
+
+    Returns:
+      array[(string, numpy.matrix)], the names and values of the matrices.
+    """
+    return [('A_LC', self.A - self.L * self.C),
+            ('B_LD', self.B - self.L * self.D),
+            ('A_BK', self.A - self.B * self.K),
+            ('KA', self.K * self.A)]
+
+  def ZeroStructure(self):
+    """Returns which entries of the loop's matrices are exactly zero.
+
+    Returns:
+      dict, numpy.array(bool) masks which are True for the zero entries, keyed
+        by matrix name.  Includes the matrices from DerivedMatrices.
+    """
+    matrices = [('A', self.A), ('B', self.B), ('C', self.C), ('D', self.D),
+                ('L', self.L), ('K', self.K)] + self.DerivedMatrices()
+    return dict((name, numpy.asarray(matrix) == 0.0)
+                for name, matrix in matrices)
+
+  def FrequencyResponse(self, frequencies=None):
+    """Evaluates the open and closed loop frequency responses of the loop.
+
+    The controller is the observer and K together, running as a regulator:
+      X_hat(n + 1) = (A - L C - (B - L D) K) X_hat + L Y, U = -K X_hat
+    so the feedback is U = -controller(z) Y.  The loop is broken at the plant
+    input, which makes the loop gain controller(z) plant(z).
+
+    Args:
+      frequencies: array(F), The frequencies in radians per second.  Defaults
+        to 500 points log spaced from 0.1 rad/s up to the Nyquist frequency.
+
+    Returns:
+      dict, numpy.array(F x ...) complex responses keyed by 'plant' (p x m),
+        'controller' (m x p), 'loop_gain' (m x m), 'sensitivity' (m x m) and
+        'complementary_sensitivity' (m x m), along with 'frequencies'.  Single
+        input loops also get 'gain_margin' (dB), 'phase_margin' (degrees),
+        'phase_crossover' and 'gain_crossover' (rad/s) from controls.margins.
+    """
+    if frequencies is None:
+      frequencies = numpy.logspace(-1.0, numpy.log10(numpy.pi / self.dt), 500)
+    frequencies = numpy.asarray(frequencies, dtype=numpy.float64)
+
+    plant = controls.freqresp(self.A, self.B, self.C, self.D, frequencies,
+                              self.dt)
+    controller_A = (self.A - self.L * self.C -
+                    (self.B - self.L * self.D) * self.K)
+    controller = controls.freqresp(controller_A, self.L, self.K,
+                                   numpy.zeros((self.K.shape[0],
+                                                self.L.shape[1])),
+                                   frequencies, self.dt)
+
+    loop_gain = numpy.einsum('kij,kjl->kil', controller, plant)
+    identity = numpy.eye(loop_gain.shape[1])
+    sensitivity = numpy.linalg.inv(identity + loop_gain)
+
+    response = {
+        'frequencies': frequencies,
+        'plant': plant,
+        'controller': controller,
+        'loop_gain': loop_gain,
+        'sensitivity': sensitivity,
+        'complementary_sensitivity': identity - sensitivity,
+    }
+    if loop_gain.shape[1] == 1:
+      (response['gain_margin'], response['phase_margin'],
+       response['phase_crossover'], response['gain_crossover']) = (
+           controls.margins(frequencies, loop_gain[:, 0, 0]))
+    return response
+
+  def Fingerprint(self):
+    """Returns a hex digest which identifies the generated gains of the loop."""
+    return _Fingerprint(self._name, self.A, self.B, self.C, self.D, self.L,
+                        self.K, self.U_max, self.U_min)
+
+  def Stepper(self):
+    """Returns the fastest stepper for the loop, starting from its state.
+
+    Tiny single input loops (see ScalarStepper) get a ScalarStepper, and
+    everything else gets an ArrayStepper.
+    """
+    if ScalarStepper.Supports(self):
+      return ScalarStepper(self)
+    return ArrayStepper(self)
 
   def Update(self, U):
     """Simulates one time step with the provided U."""
@@ -293,17 +1505,157 @@ class ControlLoop(object):
     ans.append('  // %s\n' % name)
     return ''.join(ans)
 
-  def DumpPlantJava(self):
-    """Writes out a StateSpaceGains declaration."""
+  def DumpPlantJava(self, fused=False):
+    """Writes out a StateSpaceGains declaration.
+
+    Args:
+      fused: boolean, If true, the matrices from DerivedMatrices are passed to
+        the constructor after Umin.
+    """
+    matrices = [('A', self.A), ('B', self.B), ('C', self.C), ('D', self.D),
+                ('L', self.L), ('K', self.K), ('Umax', self.U_max),
+                ('Umin', self.U_min)]
+    if fused:
+      matrices.extend(self.DerivedMatrices())
+
     ans = ['        new StateSpaceGains(\n']
-    ans.append(self._DumpJavaMatrix('A', self.A))
-    ans.append(self._DumpJavaMatrix('B', self.B))
-    ans.append(self._DumpJavaMatrix('C', self.C))
-    ans.append(self._DumpJavaMatrix('D', self.D))
-    ans.append(self._DumpJavaMatrix('L', self.L))
-    ans.append(self._DumpJavaMatrix('K', self.K))
-    ans.append(self._DumpJavaMatrix('Umax', self.U_max))
-    ans.append(self._DumpJavaMatrix('Umin', self.U_min, last=True))
+    for index, (name, matrix) in enumerate(matrices):
+      ans.append(self._DumpJavaMatrix(name, matrix,
+                                      last=(index == len(matrices) - 1)))
+    return ''.join(ans)
+
+  def _DumpUnrolledProducts(self, output_format, products, indent):
+    """Writes out statements computing output = sum(matrix * vector).
+
+    Exactly zero coefficients are skipped, and exactly one coefficients don't
+    multiply.
+
+    Args:
+      output_format: string, Formats an index to an element of the output.
+      products: array[(numpy.matrix, string)], The matrices and the formats
+        which turn an index into an element of the vectors they multiply.
+      indent: string, The indentation of each statement.
+
+    Returns:
+      string, The statements.
+    """
+    ans = []
+    num_skipped = 0
+    num_multiplies = 0
+    for row in xrange(products[0][0].shape[0]):
+      terms = []
+      for matrix, element_format in products:
+        for column in xrange(matrix.shape[1]):
+          value = matrix[row, column]
+          num_multiplies += 1
+          if value == 0.0:
+            num_skipped += 1
+            continue
+          element = element_format % column
+          if abs(value) != 1.0:
+            element = '%r * %s' % (abs(value), element)
+          if value < 0.0:
+            terms.append(' - ' + element if terms else '-' + element)
+          else:
+            terms.append(' + ' + element if terms else element)
+      ans.append('%s%s = %s;\n' % (indent, output_format % row,
+                                   ''.join(terms) or '0.0'))
+    ans.insert(0, '%s// Skips %d of %d multiplies for exact zeros.\n' % (
+        indent, num_skipped, num_multiplies))
+    return ''.join(ans)
+
+  def _DumpErrors(self, declaration, r_format, x_hat_format, indent):
+    """Writes out declarations of the errors R - X_hat, named error0, ..."""
+    return ''.join('%s%s error%d = %s - %s;\n' % (
+                       indent, declaration, index, r_format % index,
+                       x_hat_format % index)
+                   for index in xrange(self.A.shape[0]))
+
+  def _ObserverStepProducts(self, x_hat_format, u_format, y_format):
+    """Returns the products computing the next observer state."""
+    derived = dict(self.DerivedMatrices())
+    return [(derived['A_LC'], x_hat_format), (derived['B_LD'], u_format),
+            (self.L, y_format)]
+
+  def DumpObserverStepJava(self, method_name):
+    """Writes out a java method which runs one observer update.
+
+    The update is unrolled using the matrices from DerivedMatrices.
+    """
+    ans = ['  // Sets xHatNext to the observer state after applying u and'
+           ' measuring y.\n',
+           '  static public void %s(double[] xHat, double[] u, double[] y,\n'
+           '      double[] xHatNext) {\n' % method_name]
+    ans.append(self._DumpUnrolledProducts(
+        'xHatNext[%d]',
+        self._ObserverStepProducts('xHat[%d]', 'u[%d]', 'y[%d]'), '    '))
+    ans.append('  }\n')
+    return ''.join(ans)
+
+  def DumpControllerStepJava(self, method_name):
+    """Writes out a java method which computes U = K (R - X_hat), unclipped."""
+    ans = ['  // Sets u to K (r - xHat), before clipping to Umin and Umax.\n',
+           '  static public void %s(double[] r, double[] xHat,'
+           ' double[] u) {\n' % method_name]
+    ans.append(self._DumpErrors('final double', 'r[%d]', 'xHat[%d]', '    '))
+    ans.append(self._DumpUnrolledProducts('u[%d]', [(self.K, 'error%d')],
+                                          '    '))
+    ans.append('  }\n')
+    return ''.join(ans)
+
+  def _ObserverStepSignature(self):
+    """Returns the c++ signature of the observer step function."""
+    num_states = self.A.shape[0]
+    num_inputs = self.B.shape[1]
+    num_outputs = self.C.shape[0]
+    return ('void %sObserverStep(\n'
+            '    const Eigen::Matrix<double, %d, 1> &X_hat,\n'
+            '    const Eigen::Matrix<double, %d, 1> &U,\n'
+            '    const Eigen::Matrix<double, %d, 1> &Y,\n'
+            '    Eigen::Matrix<double, %d, 1> *X_hat_next)' % (
+                self._name, num_states, num_inputs, num_outputs, num_states))
+
+  def _ControllerStepSignature(self):
+    """Returns the c++ signature of the controller step function."""
+    num_states = self.A.shape[0]
+    num_inputs = self.B.shape[1]
+    return ('void %sControllerStep(\n'
+            '    const Eigen::Matrix<double, %d, 1> &R,\n'
+            '    const Eigen::Matrix<double, %d, 1> &X_hat,\n'
+            '    Eigen::Matrix<double, %d, 1> *U)' % (
+                self._name, num_states, num_states, num_inputs))
+
+  def DumpObserverStepHeader(self):
+    """Writes out a c++ header declaration for the observer step function."""
+    return ('// Sets X_hat_next to the observer state after applying U and'
+            ' measuring Y.\n%s;\n' % self._ObserverStepSignature())
+
+  def DumpControllerStepHeader(self):
+    """Writes out a c++ header declaration for the controller step function."""
+    return ('// Sets U to K (R - X_hat), before clipping to U_min and U_max.\n'
+            '%s;\n' % self._ControllerStepSignature())
+
+  def DumpObserverStep(self):
+    """Writes out a c++ function which runs one observer update.
+
+    The update is unrolled using the matrices from DerivedMatrices.
+    """
+    ans = ['%s {\n' % self._ObserverStepSignature()]
+    ans.append(self._DumpUnrolledProducts(
+        '(*X_hat_next)(%d, 0)',
+        self._ObserverStepProducts('X_hat(%d, 0)', 'U(%d, 0)', 'Y(%d, 0)'),
+        '  '))
+    ans.append('}\n')
+    return ''.join(ans)
+
+  def DumpControllerStep(self):
+    """Writes out a c++ function which computes U = K (R - X_hat), unclipped."""
+    ans = ['%s {\n' % self._ControllerStepSignature()]
+    ans.append(self._DumpErrors('const double', 'R(%d, 0)', 'X_hat(%d, 0)',
+                               '  '))
+    ans.append(self._DumpUnrolledProducts('(*U)(%d, 0)',
+                                          [(self.K, 'error%d')], '  '))
+    ans.append('}\n')
     return ''.join(ans)
 
   def DumpControllerHeader(self):
@@ -338,3 +1690,190 @@ class ControlLoop(object):
                                              num_outputs, self._name))
     ans.append('}\n')
     return ''.join(ans)
+
+
+class ArrayStepper(object):
+  """Steps a ControlLoop without allocating any memory per step.
+
+  Works on ndarray copies of the loop's matrices and writes every intermediate
+  result into preallocated buffers.  Update and UpdateObserver behave like
+  ControlLoop.Update and ControlLoop.UpdateObserver.  X, Y and X_hat are
+  (n x 1) ndarrays which are updated in place, so references to them stay
+  current.
+  """
+
+  def __init__(self, loop):
+    """Constructs a stepper starting from the loop's current state.
+
+    Args:
+      loop: ControlLoop, The loop to step.  It isn't modified.
+    """
+    self.A = numpy.array(loop.A, dtype=numpy.float64)
+    self.B = numpy.array(loop.B, dtype=numpy.float64)
+    self.C = numpy.array(loop.C, dtype=numpy.float64)
+    self.D = numpy.array(loop.D, dtype=numpy.float64)
+    self.L = numpy.array(loop.L, dtype=numpy.float64)
+    self.U_max = numpy.array(loop.U_max, dtype=numpy.float64)
+    self.U_min = numpy.array(loop.U_min, dtype=numpy.float64)
+
+    self.X = numpy.array(loop.X, dtype=numpy.float64)
+    self.Y = numpy.array(loop.Y, dtype=numpy.float64)
+    self.X_hat = numpy.array(loop.X_hat, dtype=numpy.float64)
+
+    num_states = self.A.shape[0]
+    num_inputs = self.B.shape[1]
+    num_outputs = self.C.shape[0]
+    self._U = numpy.zeros((num_inputs, 1))
+    self._state = numpy.zeros((num_states, 1))
+    self._state_term = numpy.zeros((num_states, 1))
+    self._output_term = numpy.zeros((num_outputs, 1))
+    self._error = numpy.zeros((num_outputs, 1))
+
+  def Update(self, U):
+    """Simulates one time step with the provided U."""
+    numpy.clip(U, self.U_min, self.U_max, out=self._U)
+    numpy.dot(self.A, self.X, out=self._state)
+    numpy.dot(self.B, self._U, out=self._state_term)
+    numpy.add(self._state, self._state_term, out=self.X)
+    numpy.dot(self.C, self.X, out=self.Y)
+    numpy.dot(self.D, self._U, out=self._output_term)
+    self.Y += self._output_term
+
+  def UpdateObserver(self, U):
+    """Updates the observer given the provided U."""
+    self._U[...] = U
+    # error = Y - C * X_hat - D * U
+    numpy.dot(self.C, self.X_hat, out=self._error)
+    numpy.subtract(self.Y, self._error, out=self._error)
+    numpy.dot(self.D, self._U, out=self._output_term)
+    self._error -= self._output_term
+    # X_hat = A * X_hat + B * U + L * error
+    numpy.dot(self.A, self.X_hat, out=self._state)
+    numpy.dot(self.B, self._U, out=self._state_term)
+    self._state += self._state_term
+    numpy.dot(self.L, self._error, out=self._state_term)
+    numpy.add(self._state, self._state_term, out=self.X_hat)
+
+  def State(self, row):
+    """Returns one element of X as a float."""
+    return float(self.X[row, 0])
+
+  def CopyStateTo(self, loop):
+    """Sets the loop's X, Y and X_hat to copies of the stepper's."""
+    loop.X = numpy.matrix(self.X)
+    loop.Y = numpy.matrix(self.Y)
+    loop.X_hat = numpy.matrix(self.X_hat)
+
+
+def _Rows(matrix):
+  """Returns a matrix as a list of rows of python floats."""
+  return [[float(value) for value in row] for row in numpy.asarray(matrix)]
+
+
+def _Dot(row, vector):
+  """Returns the dot product of two short lists, summed in order."""
+  total = row[0] * vector[0]
+  for index in xrange(1, len(row)):
+    total += row[index] * vector[index]
+  return total
+
+
+class ScalarStepper(object):
+  """Steps a tiny single input ControlLoop using python floats.
+
+  For loops like Shooter, numpy's dispatch overhead is far more than the
+  arithmetic, so this caches the matrices as floats and evaluates the same
+  sums in the same order as ControlLoop.Update and ControlLoop.UpdateObserver.
+  x, y and x_hat are lists of floats, and X, Y and X_hat build matrices from
+  them.
+  """
+
+  # The largest number of states and outputs this is faster for.
+  MAX_STATES = 2
+  MAX_OUTPUTS = 2
+
+  @staticmethod
+  def Supports(loop):
+    """Returns True if the loop is small enough to step with floats."""
+    return (loop.A.shape[0] <= ScalarStepper.MAX_STATES and
+            loop.B.shape[1] == 1 and
+            loop.C.shape[0] <= ScalarStepper.MAX_OUTPUTS)
+
+  def __init__(self, loop):
+    """Constructs a stepper starting from the loop's current state.
+
+    Args:
+      loop: ControlLoop, The loop to step.  It isn't modified.
+
+    Raises:
+      ValueError: The loop is too big.
+    """
+    if not ScalarStepper.Supports(loop):
+      raise ValueError('Loop %s is too big to step with floats.' % loop._name)
+    self._A = _Rows(loop.A)
+    self._B = [row[0] for row in _Rows(loop.B)]
+    self._C = _Rows(loop.C)
+    self._D = [row[0] for row in _Rows(loop.D)]
+    self._L = _Rows(loop.L)
+    self._U_max = float(loop.U_max[0, 0])
+    self._U_min = float(loop.U_min[0, 0])
+
+    self.x = [float(value) for value in numpy.asarray(loop.X).flat]
+    self.y = [float(value) for value in numpy.asarray(loop.Y).flat]
+    self.x_hat = [float(value) for value in numpy.asarray(loop.X_hat).flat]
+
+  @property
+  def X(self):
+    return numpy.matrix(self.x).T
+
+  @property
+  def Y(self):
+    return numpy.matrix(self.y).T
+
+  @property
+  def X_hat(self):
+    return numpy.matrix(self.x_hat).T
+
+  def State(self, row):
+    """Returns one element of X as a float, like ArrayStepper.State."""
+    return self.x[row]
+
+  def Update(self, U):
+    """Simulates one time step with the provided U, a float or 1x1 matrix."""
+    u = min(max(float(U), self._U_min), self._U_max)
+    self.x = x = [_Dot(a, self.x) + b * u for a, b in zip(self._A, self._B)]
+    self.y = [_Dot(c, x) + d * u for c, d in zip(self._C, self._D)]
+
+  def UpdateObserver(self, U):
+    """Updates the observer given the provided U, a float or 1x1 matrix."""
+    u = float(U)
+    x_hat = self.x_hat
+    error = [y - _Dot(c, x_hat) - d * u
+             for y, c, d in zip(self.y, self._C, self._D)]
+    self.x_hat = [_Dot(a, x_hat) + b * u + _Dot(l, error)
+                  for a, b, l in zip(self._A, self._B, self._L)]
+
+  def Simulate(self, U):
+    """Runs Update over a whole array of inputs.
+
+    Args:
+      U: array(n), The input for each step.
+
+    Returns:
+      (X, Y), numpy.array(n x num_states) and numpy.array(n x num_outputs),
+        the state and output after each step.
+    """
+    num_steps = len(U)
+    X = numpy.zeros((num_steps, len(self.x)))
+    Y = numpy.zeros((num_steps, len(self.y)))
+    for step in xrange(num_steps):
+      self.Update(U[step])
+      X[step, :] = self.x
+      Y[step, :] = self.y
+    return X, Y
+
+  def CopyStateTo(self, loop):
+    """Sets the loop's X, Y and X_hat to copies of the stepper's."""
+    loop.X = self.X
+    loop.Y = self.Y
+    loop.X_hat = self.X_hat
@@ -0,0 +1,460 @@
+#!/usr/bin/python
+
+import cPickle
+import control_loop
+import controls
+import numpy
+from numpy.testing import *
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def MakeLoop(name, scale=1.0):
+  """Makes a 2 state, 1 input, 1 output loop without designing it."""
+  loop = control_loop.ControlLoop(name)
+  loop.dt = 0.01
+  loop.A = numpy.matrix([[1.0, 0.0],
+                         [0.691279 * scale, 0.988930]])
+  loop.B = numpy.matrix([[1.0],
+                         [0.0]])
+  loop.C = numpy.matrix([[0.0, 1.0]])
+  loop.D = numpy.matrix([[0.0]])
+  loop.L = numpy.matrix([[0.0723296612345678],
+                         [0.438929891234567 * scale]])
+  loop.K = numpy.matrix([[0.968929891234567, 0.279588641234567 / scale]])
+  loop.U_max = numpy.matrix([[12.0]])
+  loop.U_min = numpy.matrix([[-2.0]])
+  loop.InitializeState()
+  return loop
+
+
+class TestControlLoop(unittest.TestCase):
+  def setUp(self):
+    self.loop = MakeLoop('Shooter')
+
+  def test_DerivedMatrices(self):
+    """Tests that the fused observer update matches UpdateObserver."""
+    derived = dict(self.loop.DerivedMatrices())
+    X_hat = numpy.matrix([[1.5], [-2.0]])
+    U = numpy.matrix([[3.0]])
+    self.loop.X_hat = X_hat
+    self.loop.Y = numpy.matrix([[0.25]])
+    self.loop.UpdateObserver(U)
+
+    assert_almost_equal(self.loop.X_hat,
+                        derived['A_LC'] * X_hat + derived['B_LD'] * U +
+                        self.loop.L * numpy.matrix([[0.25]]))
+    assert_almost_equal(derived['KA'], self.loop.K * self.loop.A)
+
+  def test_ZeroStructure(self):
+    """Tests that the exact zeros are found."""
+    zeros = self.loop.ZeroStructure()
+    assert_array_equal(zeros['A'], [[False, True], [False, False]])
+    assert_array_equal(zeros['B_LD'], [[False], [True]])
+
+  def test_FrequencyResponse(self):
+    """Tests the vectorized responses against a direct inverse."""
+    self.loop.dt = 0.01
+    frequencies = [0.5, 5.0, 50.0]
+    response = self.loop.FrequencyResponse(frequencies)
+    for i, w in enumerate(frequencies):
+      z = numpy.exp(1j * w * self.loop.dt)
+      plant = (self.loop.C * numpy.linalg.inv(z * numpy.eye(2) - self.loop.A) *
+               self.loop.B + self.loop.D)
+      assert_almost_equal(response['plant'][i], plant)
+    assert_almost_equal(response['sensitivity'] +
+                        response['complementary_sensitivity'],
+                        numpy.ones((3, 1, 1)))
+    self.assertTrue('phase_margin' in response)
+
+  def test_Margins(self):
+    """Tests that the margins are interpolated between grid points."""
+    frequencies = numpy.array([1.0, 2.0, 3.0])
+    loop_gain = (numpy.array([4.0, 0.25, 0.1]) *
+                 numpy.exp(1j * numpy.radians([-90.0, -150.0, -210.0])))
+    gain_margin, phase_margin, phase_crossover, gain_crossover = (
+        controls.margins(frequencies, loop_gain))
+    self.assertAlmostEqual(phase_margin, 30.0 + 60.0 / 2.0)
+    self.assertAlmostEqual(gain_crossover, 1.5)
+    self.assertAlmostEqual(phase_crossover, 2.5)
+    self.assertAlmostEqual(gain_margin,
+                           -20.0 * numpy.log10(numpy.sqrt(0.25 * 0.1)))
+
+
+class TestAugment(unittest.TestCase):
+  def setUp(self):
+    self.loop = MakeLoop('Shooter')
+    self.loop.dt = 0.01
+
+  def test_DeltaU(self):
+    """Tests that U is carried as the first state."""
+    augmented = self.loop.AugmentDeltaU('ShooterDeltaU')
+    self.assertEqual('ShooterDeltaU', augmented._name)
+    augmented.X = numpy.matrix([[2.0], [1.0], [-1.0]])
+    augmented.Update(numpy.matrix([[0.5]]))
+    self.loop.X = numpy.matrix([[1.0], [-1.0]])
+    self.loop.Update(numpy.matrix([[2.0]]))
+    assert_almost_equal(augmented.X[0, 0], 2.5)
+    assert_almost_equal(augmented.X[1:], self.loop.X)
+    assert_almost_equal(augmented.Y, self.loop.Y)
+
+  def test_Integral(self):
+    """Tests that the integral states accumulate dt (R - Y)."""
+    augmented = self.loop.AugmentIntegral()
+    augmented.X = numpy.matrix([[1.0], [-1.0], [0.5]])
+    augmented.Update(numpy.matrix([[2.0], [3.0]]))
+    assert_almost_equal(augmented.X[2, 0], 0.5 + 0.01 * (3.0 - -1.0))
+    assert_almost_equal(augmented.Y[1, 0], augmented.X[2, 0])
+
+  def test_IntegralSteadyState(self):
+    """Tests that a step to a nonzero goal settles with no error.
+
+    The plant being driven has a different gain than the one designed with.
+    """
+    augmented = self.loop.AugmentIntegral()
+    augmented.PlaceControllerPoles([0.8, 0.85, 0.9], num_inputs=1)
+    assert_array_equal([[0.0, 0.0, 0.0]], augmented.K[1:])
+
+    plant = MakeLoop('Shooter', 1.2)
+    plant.dt = 0.01
+    plant = plant.AugmentIntegral()
+    goal = 1.5
+    for _ in xrange(1000):
+      U = -augmented.K[:1] * plant.X
+      plant.Update(numpy.bmat([[U], [numpy.matrix([[goal]])]]))
+    assert_almost_equal(plant.Y[0, 0], goal)
+
+  def test_InputDisturbance(self):
+    """Tests that the disturbance adds to U, and can be observed."""
+    augmented = self.loop.AugmentInputDisturbance()
+    augmented.X = numpy.matrix([[1.0], [-1.0], [0.25]])
+    augmented.Update(numpy.matrix([[2.0]]))
+    self.loop.X = numpy.matrix([[1.0], [-1.0]])
+    self.loop.Update(numpy.matrix([[2.25]]))
+    assert_almost_equal(augmented.X[:2], self.loop.X)
+    assert_almost_equal(augmented.X[2, 0], 0.25)
+
+    observability = numpy.vstack([augmented.C * augmented.A ** i
+                                  for i in xrange(3)])
+    self.assertEqual(3, numpy.linalg.matrix_rank(observability))
+
+
+class TestStepMatrices(unittest.TestCase):
+  def setUp(self):
+    self.loop = MakeLoop('Shooter')
+
+  def Simulate(self, X, U, k):
+    self.loop.X = X
+    for _ in xrange(k):
+      self.loop.Update(U)
+    return self.loop.X
+
+  def test_MatchesUpdate(self):
+    """Tests that k steps at once match k calls to Update."""
+    X = numpy.matrix([[1.0], [2.0]])
+    U = numpy.matrix([[3.0]])
+    for k in [0, 1, 2, 5, 8, 13, 64]:
+      A_k, B_k = self.loop.StepMatrices(k)
+      assert_almost_equal(A_k * X + B_k * U, self.Simulate(X, U, k))
+
+  def test_Predict(self):
+    """Tests that Predict clips U like Update."""
+    X = numpy.matrix([[1.0], [2.0]])
+    U = numpy.matrix([[30.0]])
+    assert_almost_equal(self.loop.Predict(X, U, 7), self.Simulate(X, U, 7))
+
+  def test_Cache(self):
+    """Tests that repeats are cached, and changing A invalidates them."""
+    self.assertIs(self.loop.StepMatrices(9)[0], self.loop.StepMatrices(9)[0])
+    for k in xrange(control_loop.STEP_MATRIX_CACHE_SIZE + 4):
+      self.loop.StepMatrices(k)
+    self.assertEqual(control_loop.STEP_MATRIX_CACHE_SIZE,
+                     len(self.loop._step_matrix_cache))
+    self.assertNotIn(0, self.loop._step_matrix_cache)
+
+    self.loop.A = self.loop.A * 0.5
+    assert_almost_equal(self.loop.StepMatrices(1)[0], self.loop.A)
+
+  def test_Negative(self):
+    self.assertRaises(ValueError, self.loop.StepMatrices, -1)
+
+
+class TestDesignCache(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache_file = os.path.join(self.directory, 'design_cache')
+    self.old_cache = dict(control_loop._design_cache)
+    control_loop._design_cache.clear()
+    self.calls = 0
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    control_loop._design_cache.clear()
+    control_loop._design_cache.update(self.old_cache)
+
+  def Design(self):
+    self.calls += 1
+    return (numpy.matrix([[float(self.calls)]]),)
+
+  def test_RoundTrip(self):
+    """Tests that saved designs are reused after loading."""
+    control_loop._CachedDesign('key', self.Design)
+    control_loop.SaveDesignCache(self.cache_file)
+    control_loop._design_cache.clear()
+    control_loop.LoadDesignCache(self.cache_file)
+    self.assertEqual(1.0, control_loop._CachedDesign('key', self.Design)[0])
+    self.assertEqual(1, self.calls)
+
+  def test_OldVersion(self):
+    """Tests that designs saved by other design code are ignored."""
+    control_loop._CachedDesign('key', self.Design)
+    old_version = control_loop.DESIGN_CACHE_VERSION
+    control_loop.DESIGN_CACHE_VERSION = old_version + 1
+    try:
+      control_loop.SaveDesignCache(self.cache_file)
+      # Designs made by the in process code aren't reused either.
+      self.assertEqual(2.0,
+                       control_loop._CachedDesign('key', self.Design)[0])
+    finally:
+      control_loop.DESIGN_CACHE_VERSION = old_version
+    control_loop._design_cache.clear()
+    control_loop.LoadDesignCache(self.cache_file)
+    self.assertEqual({}, control_loop._design_cache)
+
+  def test_BadFiles(self):
+    """Tests that unreadable cache files are a miss, not an error."""
+    for contents in ['', 'garbage', cPickle.dumps({'a': 1}),
+                     cPickle.dumps((1,)), 'cno_such_module\nThing\n.']:
+      with open(self.cache_file, 'wb') as fd:
+        fd.write(contents)
+      control_loop.LoadDesignCache(self.cache_file)
+      self.assertEqual({}, control_loop._design_cache)
+    control_loop.LoadDesignCache(os.path.join(self.directory, 'missing'))
+
+
+class CountingLoop(control_loop.ControlLoop):
+  """A loop which counts how many times it has been designed."""
+  num_designs = 0
+
+  def __init__(self, name, scale=1.0):
+    super(CountingLoop, self).__init__(name)
+    CountingLoop.num_designs += 1
+    designed = MakeLoop(name, scale)
+    for matrix_name in ['A', 'B', 'C', 'D', 'L', 'K', 'U_max', 'U_min']:
+      setattr(self, matrix_name, getattr(designed, matrix_name))
+    self.InitializeState()
+
+
+class TestModel(unittest.TestCase):
+  def setUp(self):
+    control_loop._model_registry.clear()
+    CountingLoop.num_designs = 0
+
+  def test_DesignedOnce(self):
+    """Tests that each configuration is only designed once."""
+    first = control_loop.Model(CountingLoop, 'Slow')
+    second = control_loop.Model(CountingLoop, 'Slow')
+    fast = control_loop.Model(CountingLoop, 'Slow', scale=2.0)
+    self.assertEqual(2, CountingLoop.num_designs)
+    assert_array_equal(first.K, second.K)
+    self.assertNotEqual(first.K[0, 1], fast.K[0, 1])
+
+  def test_CopiesAreIndependent(self):
+    """Tests that stepping or editing a copy leaves the others alone."""
+    first = control_loop.Model(CountingLoop, 'Slow')
+    second = control_loop.Model(CountingLoop, 'Slow')
+    first.Update(numpy.matrix([[5.0]]))
+    first.K[0, 0] += 1.0
+    assert_array_equal(second.X, numpy.zeros((2, 1)))
+    self.assertNotEqual(first.K[0, 0], second.K[0, 0])
+
+
+class TestArrayStepper(unittest.TestCase):
+  def test_MatchesControlLoop(self):
+    """Tests that the stepper matches Update and UpdateObserver."""
+    loop = MakeLoop('Shooter')
+    stepper = control_loop.ArrayStepper(loop)
+    X = stepper.X
+    for U in numpy.linspace(-5.0, 15.0, 50):
+      U = numpy.matrix([[U]])
+      loop.Update(U)
+      loop.UpdateObserver(U)
+      stepper.Update(U)
+      stepper.UpdateObserver(U)
+      assert_array_equal(loop.X, stepper.X)
+      assert_array_equal(loop.Y, stepper.Y)
+      assert_array_equal(loop.X_hat, stepper.X_hat)
+
+    # The state is updated in place.
+    self.assertTrue(X is stepper.X)
+
+
+class TestScalarStepper(unittest.TestCase):
+  def test_MatchesControlLoop(self):
+    """Tests that the float stepper matches Update and UpdateObserver."""
+    loop = MakeLoop('Shooter')
+    stepper = loop.Stepper()
+    self.assertTrue(isinstance(stepper, control_loop.ScalarStepper))
+    for U in numpy.linspace(-5.0, 15.0, 50):
+      loop.Update(numpy.matrix([[U]]))
+      loop.UpdateObserver(numpy.matrix([[U]]))
+      stepper.Update(U)
+      stepper.UpdateObserver(U)
+      assert_array_equal(loop.X, stepper.X)
+      assert_array_equal(loop.Y, stepper.Y)
+      assert_array_equal(loop.X_hat, stepper.X_hat)
+
+  def test_Simulate(self):
+    """Tests that Simulate matches stepping one at a time."""
+    loop = MakeLoop('Shooter')
+    U = numpy.linspace(-5.0, 15.0, 20)
+    X, Y = loop.Stepper().Simulate(U)
+    for step in xrange(len(U)):
+      loop.Update(numpy.matrix([[U[step]]]))
+      assert_array_equal(loop.X.T, X[step:step + 1, :])
+      assert_array_equal(loop.Y.T, Y[step:step + 1, :])
+
+  def test_State(self):
+    """Tests that both steppers read the state the same way."""
+    loop = MakeLoop('Shooter')
+    loop.X = numpy.matrix([[1.5], [-2.0]])
+    for stepper in [control_loop.ScalarStepper(loop),
+                    control_loop.ArrayStepper(loop)]:
+      self.assertEqual(-2.0, stepper.State(1))
+      self.assertTrue(isinstance(stepper.State(0), float))
+
+  def test_BigLoopsUseArrays(self):
+    """Tests that loops with more than one input use an ArrayStepper."""
+    loop = MakeLoop('Shooter')
+    loop.B = numpy.matrix(numpy.eye(2))
+    loop.D = numpy.matrix(numpy.zeros((1, 2)))
+    loop.U_max = numpy.matrix([[12.0], [12.0]])
+    loop.U_min = numpy.matrix([[-12.0], [-12.0]])
+    self.assertTrue(isinstance(loop.Stepper(), control_loop.ArrayStepper))
+
+
+class TestGainSchedule(unittest.TestCase):
+  def setUp(self):
+    self.loops = [MakeLoop('Slow', 1.0), MakeLoop('Fast', 3.0),
+                  MakeLoop('Medium', 2.0)]
+    self.schedule = control_loop.GainSchedule([0.0, 300.0, 100.0],
+                                              self.loops)
+
+  def test_Sorted(self):
+    """Tests that the loops are sorted by breakpoint."""
+    assert_array_equal(self.schedule.breakpoints, [0.0, 100.0, 300.0])
+    self.assertEqual([self.loops[0], self.loops[2], self.loops[1]],
+                     self.schedule.loops)
+
+  def test_Lookup(self):
+    """Tests the lookup, including values off the ends."""
+    self.assertEqual(0, self.schedule.Lookup(-10.0))
+    self.assertEqual(0, self.schedule.Lookup(99.0))
+    self.assertEqual(1, self.schedule.Lookup(100.0))
+    self.assertEqual(1, self.schedule.Lookup(299.0))
+    self.assertEqual(2, self.schedule.Lookup(1000.0))
+
+  def test_Interpolate(self):
+    """Tests that K and L are interpolated between neighbors."""
+    K, L = self.schedule.Interpolate(200.0)
+    assert_almost_equal(K, (self.loops[2].K + self.loops[1].K) / 2.0)
+    assert_almost_equal(L, (self.loops[2].L + self.loops[1].L) / 2.0)
+
+    K, L = self.schedule.Interpolate(-50.0)
+    assert_array_equal(K, self.loops[0].K)
+
+  def test_DuplicateBreakpoints(self):
+    """Tests that duplicate breakpoints are rejected."""
+    self.assertRaises(ValueError, control_loop.GainSchedule, [1.0, 1.0],
+                      self.loops[:2])
+
+
+class TestControlLoopWriter(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.loops = [MakeLoop('Slow', 1.0), MakeLoop('Fast', 3.0)]
+    self.writer = control_loop.ControlLoopWriter('Shooter', self.loops)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_CheckStability(self):
+    """Tests that every loop's poles are found, and unstable ones rejected."""
+    report = self.writer.CheckStability()
+    for loop, poles in zip(self.loops, report.controller_poles):
+      assert_almost_equal(
+          numpy.sort_complex(poles),
+          numpy.sort_complex(numpy.linalg.eigvals(loop.A - loop.B * loop.K)))
+    self.assertEqual([], report.unstable)
+
+    self.loops[1].K = -self.loops[1].K
+    java_file = os.path.join(self.directory, 'ShooterGains.java')
+    self.assertRaises(ValueError, self.writer.Write, java_file)
+    self.assertFalse(os.path.exists(java_file))
+
+  def test_EveryWriterChecksStability(self):
+    """Tests that unstable loops aren't written by any of the gain writers."""
+    self.loops[1].K = -self.loops[1].K
+    cc_file = os.path.join(self.directory, 'shooter.cc')
+    header_file = os.path.join(self.directory, 'shooter.h')
+    binary_file = os.path.join(self.directory, 'shooter.bin')
+    self.assertRaises(ValueError, self.writer.WriteCC, 'shooter.h', cc_file)
+    self.assertRaises(ValueError, self.writer.WriteHeader, header_file)
+    self.assertRaises(ValueError, self.writer.WriteBinary, binary_file)
+    self.assertEqual([], os.listdir(self.directory))
+
+  def test_NegativeRealPoles(self):
+    """Tests that negative real poles are alternating, not underdamped."""
+    loop = control_loop.ControlLoop('Ringing')
+    loop.A = numpy.matrix([[-0.5]])
+    loop.B = numpy.matrix([[1.0]])
+    loop.C = numpy.matrix([[1.0]])
+    loop.K = numpy.matrix([[0.0]])
+    loop.L = numpy.matrix([[-0.3]])
+    report = control_loop.StabilityReport([loop])
+    self.assertEqual([], report.unstable)
+    self.assertEqual([], report.marginal)
+    self.assertEqual(2, len(report.alternating))
+    assert_array_equal([1.0, 1.0], report.min_damping)
+
+    loop.K = numpy.matrix([[0.497]])
+    report = control_loop.StabilityReport([loop])
+    self.assertEqual(1, len(report.marginal))
+
+  def test_WriteBinary(self):
+    """Tests that the binary schedule round trips at full precision."""
+    binary_file = os.path.join(self.directory, 'shooter.bin')
+    self.assertTrue(self.writer.WriteBinary(binary_file))
+
+    loops = control_loop.ReadBinary(binary_file)
+    self.assertEqual(2, len(loops))
+    for expected, actual in zip(self.loops, loops):
+      for name in ['A', 'B', 'C', 'D', 'L', 'K', 'U_max', 'U_min']:
+        assert_array_equal(getattr(expected, name), getattr(actual, name))
+
+  def test_ReadBinaryBadFile(self):
+    """Tests that truncated files are rejected."""
+    binary_file = os.path.join(self.directory, 'shooter.bin')
+    self.writer.WriteBinary(binary_file)
+    with open(binary_file, 'rb') as fd:
+      contents = fd.read()
+    with open(binary_file, 'wb') as fd:
+      fd.write(contents[:-8])
+    self.assertRaises(ValueError, control_loop.ReadBinary, binary_file)
+
+  def test_UnchangedFileIsNotWritten(self):
+    """Tests that identical output leaves the file alone."""
+    java_file = os.path.join(self.directory, 'ShooterGains.java')
+    self.assertTrue(self.writer.WriteJava(java_file))
+    os.utime(java_file, (0, 0))
+    self.assertFalse(self.writer.WriteJava(java_file))
+    self.assertEqual(0, os.stat(java_file).st_mtime)
+
+    self.loops[1].K[0, 0] += 1.0
+    self.assertTrue(self.writer.WriteJava(java_file))
+
+
+if __name__ == '__main__':
+  unittest.main()
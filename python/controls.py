@@ -21,8 +21,7 @@ class PolePlacementError(Error):
 
 
 # TODO(aschuh): dplace should take a control system object.
-# There should also exist a function to manipulate laplace expressions, and
-# something to plot bode plots and all that.
+# There should also exist a function to manipulate laplace expressions.
 def dplace(A, B, poles, alpha=1e-6):
   """Set the poles of (A - BF) to poles.
 
@@ -99,3 +98,240 @@ def c2d(A, B, dt):
       diage[count, count] = (numpy.exp(eig * dt) - 1.0) / eig
 
   return (P * diag * numpy.linalg.inv(P), P * diage * numpy.linalg.inv(P) * B)
+
+
+def batch_c2d(A, B, dt):
+  """Converts a stack of continuous time systems to discrete time.
+
+  Vectorized version of c2d over the first axis, for evaluating many sampled
+  plants at once.
+
+  Args:
+    A: numpy.array(N x n x n), The continuous time A matrices.
+    B: numpy.array(N x n x m), The continuous time B matrices.
+    dt: float, The time step.
+
+  Returns:
+    (A, B), numpy.array(N x n x n) and numpy.array(N x n x m), the discrete
+      time matrices.  C and D are unchanged.
+  """
+  e, P = numpy.linalg.eig(A)
+  P_inverse = numpy.linalg.inv(P)
+  exp_e = numpy.exp(e * dt)
+  zero = numpy.abs(e) < 1.0e-16
+  integral = numpy.where(zero, dt,
+                         (exp_e - 1.0) / numpy.where(zero, 1.0, e))
+
+  A_discrete = numpy.einsum('kij,kj,kjl->kil', P, exp_e, P_inverse)
+  B_discrete = numpy.einsum('kij,kj,kjl,klm->kim', P, integral, P_inverse, B)
+  return numpy.real(A_discrete), numpy.real(B_discrete)
+
+
+# Eigenvector matrices with a condition number above this are too close to
+# defective to evaluate frequency responses with.
+_MAX_EIGENVECTOR_CONDITION = 1.0e8
+
+
+def freqresp(A, B, C, D, frequencies, dt):
+  """Evaluates the frequency response of a discrete time system.
+
+  Evaluates C (zI - A)^-1 B + D at z = e^(j w dt) for every frequency at once.
+  A is diagonalized once, A = P diag(e) P^-1, so each frequency only costs a
+  scaling by 1 / (z - e) instead of an inverse.  If A is too close to
+  defective to diagonalize accurately, the stack of zI - A is solved instead.
+
+  Args:
+    A: numpy.matrix(n x n), The discrete time A matrix.
+    B: numpy.matrix(n x m), The B matrix.
+    C: numpy.matrix(p x n), The C matrix.
+    D: numpy.matrix(p x m), The D matrix.
+    frequencies: array(F), The frequencies in radians per second.
+    dt: float, The time step.
+
+  Returns:
+    numpy.array(F x p x m), the complex response at each frequency.
+  """
+  A = numpy.asarray(A)
+  B = numpy.asarray(B)
+  C = numpy.asarray(C)
+  D = numpy.asarray(D)
+  z = numpy.exp(1j * numpy.asarray(frequencies, dtype=numpy.float64) * dt)
+
+  e, P = numpy.linalg.eig(A)
+  if numpy.linalg.cond(P) < _MAX_EIGENVECTOR_CONDITION:
+    CP = C.dot(P)
+    P_inverse_B = numpy.linalg.solve(P, B)
+    response = numpy.einsum('in,kn,nj->kij', CP,
+                            1.0 / (z[:, numpy.newaxis] - e), P_inverse_B)
+  else:
+    zI_A = z[:, numpy.newaxis, numpy.newaxis] * numpy.eye(A.shape[0]) - A
+    response = numpy.einsum(
+        'in,knj->kij', C,
+        numpy.linalg.solve(zI_A, numpy.broadcast_to(B, zI_A.shape[:1] +
+                                                    B.shape)))
+  return response + D
+
+
+def margins(frequencies, loop_gain):
+  """Computes the gain and phase margins of a single input loop gain.
+
+  Crossings between grid points are linearly interpolated, so the grid needs to
+  be fine enough to resolve them.
+
+  Args:
+    frequencies: array(F), The increasing frequencies in radians per second.
+    loop_gain: array(F), The complex loop gain at each frequency.
+
+  Returns:
+    (gain_margin, phase_margin, phase_crossover, gain_crossover).  The gain
+      margin is in dB and the phase margin is in degrees.  Each is the smallest
+      found, and is inf with a nan crossover frequency if there is no crossing
+      on the grid.
+  """
+  frequencies = numpy.asarray(frequencies, dtype=numpy.float64)
+  loop_gain = numpy.asarray(loop_gain).ravel()
+  magnitude = numpy.abs(loop_gain)
+  phase = numpy.unwrap(numpy.angle(loop_gain))
+
+  def Crossings(values):
+    """Returns the indices and fractions where values crosses an integer."""
+    indices = numpy.nonzero(numpy.floor(values[:-1]) !=
+                            numpy.floor(values[1:]))[0]
+    levels = numpy.maximum(numpy.floor(values[indices]),
+                           numpy.floor(values[indices + 1]))
+    fractions = (levels - values[indices]) / (values[indices + 1] -
+                                              values[indices])
+    return indices, fractions
+
+  def Interpolate(values, indices, fractions):
+    return values[indices] + fractions * (values[indices + 1] -
+                                          values[indices])
+
+  # The phase crosses -180 degrees when (phase + pi) / 2 pi crosses an integer.
+  indices, fractions = Crossings((phase + numpy.pi) / (2.0 * numpy.pi))
+  log_magnitude = numpy.log10(numpy.maximum(magnitude, 1.0e-300))
+  gain_margins = -20.0 * Interpolate(log_magnitude, indices, fractions)
+  if len(gain_margins):
+    best = numpy.argmin(gain_margins)
+    gain_margin = gain_margins[best]
+    phase_crossover = Interpolate(frequencies, indices, fractions)[best]
+  else:
+    gain_margin, phase_crossover = float('inf'), float('nan')
+
+  # The magnitude crosses 1 when log10 |L| changes sign.
+  indices = numpy.nonzero((log_magnitude[:-1] >= 0.0) !=
+                          (log_magnitude[1:] >= 0.0))[0]
+  fractions = -log_magnitude[indices] / (log_magnitude[indices + 1] -
+                                         log_magnitude[indices])
+  crossing_phases = numpy.degrees(Interpolate(phase, indices, fractions))
+  phase_margins = numpy.mod(crossing_phases + 180.0, 360.0)
+  phase_margins = numpy.where(phase_margins > 180.0, phase_margins - 360.0,
+                              phase_margins)
+  if len(phase_margins):
+    best = numpy.argmin(phase_margins)
+    phase_margin = phase_margins[best]
+    gain_crossover = Interpolate(frequencies, indices, fractions)[best]
+  else:
+    phase_margin, gain_crossover = float('inf'), float('nan')
+
+  return gain_margin, phase_margin, phase_crossover, gain_crossover
+
+
+def dlyap(A, Q, max_iterations=64):
+  """Solves the discrete Lyapunov equation A X A^T - X + Q = 0 for X.
+
+  Uses the doubling iteration X = Q + A Q A^T + A^2 Q A^2^T + ..., squaring A
+  each time, which converges quadratically when A is stable.
+
+  Args:
+    A: numpy.matrix(n x n), A stable matrix.
+    Q: numpy.matrix(n x n), A symmetric matrix.
+    max_iterations: int, The number of doublings to try.
+
+  Raises:
+    ValueError: A is not stable, or the iteration didn't converge.
+
+  Returns:
+    numpy.matrix(n x n), X.
+  """
+  A = numpy.matrix(A, dtype=numpy.float64)
+  X = numpy.matrix(Q, dtype=numpy.float64)
+  if numpy.max(numpy.abs(numpy.linalg.eigvals(A))) >= 1.0:
+    raise ValueError("A must be stable.")
+
+  for _ in xrange(max_iterations):
+    step = A * X * A.T
+    X = X + step
+    if numpy.max(numpy.abs(step)) <= 1e-15 * max(numpy.max(numpy.abs(X)),
+                                                   1e-300):
+      return (X + X.T) / 2.0
+    A = A * A
+  raise ValueError("Lyapunov iteration did not converge.")
+
+
+def _GramianFactor(gramian):
+  """Returns L with L L^T = gramian, for a positive semidefinite gramian."""
+  values, vectors = numpy.linalg.eigh(gramian)
+  return numpy.matrix(vectors) * numpy.matrix(
+      numpy.diag(numpy.sqrt(numpy.maximum(values, 0.0))))
+
+
+def balred(A, B, C, D, order=None, tolerance=None):
+  """Reduces a stable discrete time system by balanced truncation.
+
+  The controllability and observability gramians are balanced with the square
+  root method, and the states with the smallest Hankel singular values are
+  dropped.  The H infinity norm of the error is at most twice the sum of the
+  dropped Hankel singular values.
+
+  Args:
+    A: numpy.matrix(n x n), The A matrix.  It must be stable.
+    B: numpy.matrix(n x m), The B matrix.
+    C: numpy.matrix(p x n), The C matrix.
+    D: numpy.matrix(p x m), The D matrix.
+    order: int, The number of states to keep.
+    tolerance: float, If order is None, keep the fewest states which keep the
+      error bound within tolerance.  If both are None, only the states with
+      zero Hankel singular values are dropped.
+
+  Raises:
+    ValueError: A is not stable, order is out of range, or it keeps a state
+      with a zero Hankel singular value, like when the system is entirely
+      uncontrollable or unobservable.
+
+  Returns:
+    (A, B, C, D, hankel), the reduced numpy.matrix system, and numpy.array(n)
+      of all the Hankel singular values, largest first.
+  """
+  A = numpy.matrix(A, dtype=numpy.float64)
+  B = numpy.matrix(B, dtype=numpy.float64)
+  C = numpy.matrix(C, dtype=numpy.float64)
+  num_states = A.shape[0]
+
+  controllability = _GramianFactor(dlyap(A, B * B.T))
+  observability = _GramianFactor(dlyap(A.T, C.T * C))
+  U, hankel, V_transpose = numpy.linalg.svd(observability.T * controllability)
+
+  if order is None:
+    if tolerance is None:
+      order = numpy.sum(hankel > 1e-12 * hankel[0])
+    else:
+      # tail_bounds[r] is the error bound when keeping r states.
+      tail_bounds = 2.0 * numpy.concatenate((numpy.cumsum(hankel[::-1])[::-1],
+                                             [0.0]))
+      order = numpy.nonzero(tail_bounds <= tolerance)[0][0]
+    order = max(int(order), 1)
+  if not 0 < order <= num_states:
+    raise ValueError("order must be between 1 and %d." % num_states)
+  # Balancing divides by the square roots of the kept singular values.
+  if hankel[order - 1] <= 1e-12 * hankel[0]:
+    raise ValueError("Only %d states have nonzero Hankel singular values, "
+                     "can't keep %d." % (numpy.sum(hankel > 1e-12 * hankel[0]),
+                                         order))
+
+  scale = numpy.matrix(numpy.diag(1.0 / numpy.sqrt(hankel[:order])))
+  T = controllability * numpy.matrix(V_transpose[:order, :]).T * scale
+  T_inverse = scale * numpy.matrix(U[:, :order]).T * observability.T
+
+  return (T_inverse * A * T, T_inverse * B, C * T,
+          numpy.matrix(D, dtype=numpy.float64), hankel)
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+
+import controls
+import numpy
+from numpy.testing import *
+import unittest
+
+
+class TestDlyap(unittest.TestCase):
+  def test_Solves(self):
+    """Tests that the solution satisfies the Lyapunov equation."""
+    A = numpy.matrix([[0.9, 0.2], [-0.1, 0.7]])
+    Q = numpy.matrix([[1.0, 0.1], [0.1, 2.0]])
+    X = controls.dlyap(A, Q)
+    assert_almost_equal(A * X * A.T - X + Q, numpy.zeros((2, 2)))
+
+  def test_Unstable(self):
+    """Tests that unstable systems are rejected."""
+    self.assertRaises(ValueError, controls.dlyap,
+                      numpy.matrix([[1.1]]), numpy.matrix([[1.0]]))
+
+
+class TestBalred(unittest.TestCase):
+  def setUp(self):
+    # A well damped mode, a fast mode barely coupled to the output, and a
+    # mode the input can't reach.
+    self.A = numpy.matrix([[0.9, 0.0, 0.0],
+                           [0.0, 0.1, 0.0],
+                           [0.0, 0.0, 0.5]])
+    self.B = numpy.matrix([[1.0], [1.0], [0.0]])
+    self.C = numpy.matrix([[1.0, 0.001, 1.0]])
+    self.D = numpy.matrix([[0.0]])
+    self.frequencies = numpy.linspace(0.0, 314.0, 50)
+
+  def test_DropsUnreachable(self):
+    """Tests that states which don't affect the response are dropped."""
+    A, B, C, D, hankel = controls.balred(self.A, self.B, self.C, self.D)
+    self.assertEqual((2, 2), A.shape)
+    self.assertEqual(3, len(hankel))
+    assert_almost_equal(
+        controls.freqresp(A, B, C, D, self.frequencies, 0.01),
+        controls.freqresp(self.A, self.B, self.C, self.D, self.frequencies,
+                          0.01))
+
+  def test_ErrorBound(self):
+    """Tests that the error is within twice the dropped singular values."""
+    A, B, C, D, hankel = controls.balred(self.A, self.B, self.C, self.D,
+                                         tolerance=2e-3)
+    self.assertEqual((1, 1), A.shape)
+    error = numpy.abs(
+        controls.freqresp(A, B, C, D, self.frequencies, 0.01) -
+        controls.freqresp(self.A, self.B, self.C, self.D, self.frequencies,
+                          0.01))
+    self.assertTrue(error.max() <= 2.0 * numpy.sum(hankel[1:]))
+
+  def test_ZeroSingularValues(self):
+    """Tests that states with zero Hankel singular values can't be kept."""
+    self.assertRaises(ValueError, controls.balred, self.A, self.B, self.C,
+                      self.D, order=3)
+    self.assertRaises(ValueError, controls.balred, self.A,
+                      numpy.zeros((3, 1)), self.C, self.D)
+    self.assertRaises(ValueError, controls.balred, self.A, self.B,
+                      numpy.zeros((1, 3)), self.D, tolerance=1.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,407 @@
+#!/usr/bin/python
+
+"""
+Estimation of the shooter model from logged or streaming data.
+
+ShooterEstimator tracks the shooter's first order model with recursive least
+squares, so wheel swaps and wear show up as drift in the estimated inertia
+without refitting whole logs.  RtsSmoother runs a Kalman filter forward and
+a Rauch-Tung-Striebel smoother backward over a whole log, in chunks, to give
+clean state trajectories for fitting and replay.
+
+The Shooter model is
+  dv/dt = a v + b u,  a = -Kt / (Kv G^2 J R),  b = Kt / (G J R)
+so J and R only appear as their product.  With voltage and velocity alone,
+only J R can be identified, and the estimator reports J assuming R is the
+designed value, or R assuming J is.
+"""
+
+import math
+import sys
+
+import numpy
+import shooter
+
+# The default forgetting factor, per sample.  Older samples are weighted by it
+# to the power of their age, so at 10 ms, data a few seconds old still counts.
+DEFAULT_FORGETTING_FACTOR = 0.999
+
+# The default relative change in J R at which the gains should be regenerated.
+DEFAULT_REGENERATE_THRESHOLD = 0.1
+
+# The default effective number of samples needed before reporting drift.
+DEFAULT_MIN_SAMPLES = 100.0
+
+# Rough standard deviations of the shooter's process noise per step, and of
+# the velocity measurement, in rad/s.
+SHOOTER_PROCESS_NOISE = 1.0
+SHOOTER_MEASUREMENT_NOISE = 5.0
+
+# The default number of samples the smoother takes at once.
+DEFAULT_CHUNK_SIZE = 4096
+
+# The largest fraction a log's mean time step may differ from the model's by
+# before the model can't be used to smooth it.
+MAX_DT_MISMATCH = 0.05
+
+
+class ShooterEstimator(object):
+  """Recursive least squares estimator of the shooter model.
+
+  Each pair of samples gives the equation
+    v(n + 1) - v(n) = dt (a (v(n) + v(n + 1)) / 2 + b u(n))
+  which is the trapezoidal integral of the continuous model, with u(n) held
+  over the step.  Only the sufficient statistics of the weighted least squares
+  problem are kept, a 2 x 2 information matrix and a 2 vector, so memory is
+  constant however long the stream runs.  Every chunk is folded in with array
+  operations, which gives the same result as one RLS update per sample.
+
+  a and b are estimated freely, and J R is estimated from the same statistics
+  with a and b constrained to the Shooter model structure.
+
+  Attributes:
+    num_samples: float, The effective number of samples, with forgetting.
+  """
+
+  def __init__(self, model, forgetting_factor=DEFAULT_FORGETTING_FACTOR,
+               regenerate_threshold=DEFAULT_REGENERATE_THRESHOLD,
+               min_samples=DEFAULT_MIN_SAMPLES, prior_weight=1e-3):
+    """Constructs an estimator starting from the model's parameters.
+
+    Args:
+      model: shooter.Shooter, The designed model, which provides the motor
+        constants and the prior.
+      forgetting_factor: float, The weight of a sample relative to the one
+        after it, in (0, 1].
+      regenerate_threshold: float, The relative change in J R past which
+        NeedsRegeneration is True.
+      min_samples: float, The effective number of samples needed before
+        NeedsRegeneration can be True.
+      prior_weight: float, The weight of the model's a and b, as an
+        information matrix of prior_weight * I.
+    """
+    if not 0.0 < forgetting_factor <= 1.0:
+      raise ValueError('forgetting_factor must be in (0, 1], got %f.' %
+                       forgetting_factor)
+    self._model = model
+    self._forgetting_factor = forgetting_factor
+    self._regenerate_threshold = regenerate_threshold
+    self._min_samples = min_samples
+    self._design_JR = model.J * model.R
+    # a and b per unit of 1 / (J R).
+    self._structure = numpy.array(
+        [-model.Kt / (model.Kv * model.G * model.G), model.Kt / model.G])
+    prior = self._structure / self._design_JR
+    self._information = numpy.eye(2) * prior_weight
+    self._moment = self._information.dot(prior)
+    self.num_samples = 0.0
+    self._last = None
+
+  def Update(self, voltage, velocity, dt):
+    """Folds in a chunk of samples.
+
+    The last sample of each chunk is remembered, so consecutive chunks are
+    treated as one stream.
+
+    Args:
+      voltage: numpy.array(n), The voltage applied from each sample to the
+        next.
+      velocity: numpy.array(n), The measured velocity, in rad/s.
+      dt: float or numpy.array(n), The time since the previous sample.  The
+        first sample of the stream has no previous one, so its dt is unused.
+    """
+    voltage = numpy.asarray(voltage, dtype=numpy.float64).reshape(-1)
+    velocity = numpy.asarray(velocity, dtype=numpy.float64).reshape(-1)
+    dt = numpy.broadcast_to(numpy.asarray(dt, dtype=numpy.float64),
+                            velocity.shape)
+    if self._last is not None:
+      voltage = numpy.concatenate(([self._last[0]], voltage))
+      velocity = numpy.concatenate(([self._last[1]], velocity))
+      dt = numpy.concatenate(([0.0], dt))
+    if velocity.shape[0] == 0:
+      return
+    self._last = (voltage[-1], velocity[-1])
+    if velocity.shape[0] < 2:
+      return
+
+    step = dt[1:]
+    regressors = numpy.column_stack(
+        (step * (velocity[:-1] + velocity[1:]) / 2.0, step * voltage[:-1]))
+    change = numpy.diff(velocity)
+
+    num_new = change.shape[0]
+    decay = self._forgetting_factor ** num_new
+    weights = self._forgetting_factor ** numpy.arange(num_new - 1, -1, -1.0)
+    weighted = regressors * weights[:, numpy.newaxis]
+    self._information = (decay * self._information +
+                         weighted.T.dot(regressors))
+    self._moment = decay * self._moment + weighted.T.dot(change)
+    self.num_samples = decay * self.num_samples + weights.sum()
+
+  def ContinuousPlant(self):
+    """Returns the freely estimated continuous time (A, B), numpy.matrix."""
+    a, b = numpy.linalg.solve(self._information, self._moment)
+    return numpy.matrix([[a]]), numpy.matrix([[b]])
+
+  def JR(self):
+    """Returns the estimated product of J and R, from the model structure."""
+    structure = self._structure
+    return (structure.dot(self._information).dot(structure) /
+            structure.dot(self._moment))
+
+  def J(self):
+    """Returns the estimated J, assuming R is the model's."""
+    return self.JR() / self._model.R
+
+  def R(self):
+    """Returns the estimated R, assuming J is the model's."""
+    return self.JR() / self._model.J
+
+  def Drift(self):
+    """Returns the change in J R relative to the model's."""
+    return self.JR() / self._design_JR - 1.0
+
+  def NeedsRegeneration(self):
+    """Returns True if J R has drifted past the threshold.
+
+    Always False until min_samples have been seen.
+    """
+    return (self.num_samples >= self._min_samples and
+            abs(self.Drift()) > self._regenerate_threshold)
+
+
+class RtsSmoother(object):
+  """Kalman filter and Rauch-Tung-Striebel smoother over a log, in chunks.
+
+  The model is
+    X(n + 1) = A X(n) + B U(n) + w,  Y(n) = C X(n) + D U(n) + v
+  with w ~ N(0, Q) and v ~ N(0, R), the loop's A, B, C and D.
+
+  The covariances don't depend on the data, so the filter and smoother gains
+  are computed up front until they converge, and the converged gains are used
+  from then on.  Feed the log to Update a chunk at a time.  A sample's
+  smoothed state is returned once lag more samples have been seen, since the
+  effect of later samples on it has decayed below tolerance by then, and
+  Finish returns the rest.  Only the samples not yet returned are kept.
+  """
+
+  def __init__(self, loop, Q, R, X0=None, P0=None, lag=None,
+               tolerance=1e-9, max_gains=100000):
+    """Constructs a smoother and computes its gains.
+
+    Args:
+      loop: ControlLoop, The model.
+      Q: numpy.matrix(n x n), The process noise covariance.
+      R: numpy.matrix(p x p), The measurement noise covariance.
+      X0: numpy.matrix(n x 1), The expected state at the first sample.  Zero
+        if None.
+      P0: numpy.matrix(n x n), The covariance of the state at the first
+        sample.  If None, it is large, so the first measurements decide.
+      lag: int, The number of samples after a sample needed to return it.  If
+        None, enough for the smoother gains to decay below tolerance.
+      tolerance: float, The relative change in the gains at which they have
+        converged.
+      max_gains: int, The most time varying gains to keep.
+
+    Raises:
+      ValueError: The gains didn't converge in max_gains samples.
+    """
+    self.A = numpy.array(loop.A, dtype=numpy.float64)
+    self.B = numpy.array(loop.B, dtype=numpy.float64)
+    self.C = numpy.array(loop.C, dtype=numpy.float64)
+    self.D = numpy.array(loop.D, dtype=numpy.float64)
+    Q = numpy.array(Q, dtype=numpy.float64)
+    R = numpy.array(R, dtype=numpy.float64)
+    num_states = self.A.shape[0]
+    if P0 is None:
+      P0 = numpy.eye(num_states) * 1e6 * max(numpy.abs(Q).max(),
+                                             numpy.abs(R).max())
+
+    # The filter gains K(n) and smoother gains J(n) for the first samples.
+    self._filter_gains = []
+    self._smoother_gains = []
+    P = numpy.array(P0, dtype=numpy.float64)
+    identity = numpy.eye(num_states)
+    while True:
+      K = numpy.linalg.solve(self.C.dot(P).dot(self.C.T) + R,
+                             self.C.dot(P)).T
+      P_filtered = (identity - K.dot(self.C)).dot(P)
+      P = self.A.dot(P_filtered).dot(self.A.T) + Q
+      J = numpy.linalg.solve(P, self.A.dot(P_filtered)).T
+      if self._filter_gains and self._Converged(K, J, tolerance):
+        break
+      if len(self._filter_gains) >= max_gains:
+        raise ValueError('The gains didn\'t converge in %d samples.' %
+                         max_gains)
+      self._filter_gains.append(K)
+      self._smoother_gains.append(J)
+
+    if lag is None:
+      decay = numpy.abs(numpy.linalg.eigvals(J)).max()
+      if decay < tolerance:
+        lag = 1
+      else:
+        lag = int(numpy.ceil(numpy.log(tolerance) / numpy.log(decay)))
+    self.lag = max(1, lag)
+
+    if X0 is None:
+      self._X_predicted = numpy.zeros(num_states)
+    else:
+      self._X_predicted = numpy.array(X0, dtype=numpy.float64).reshape(-1)
+    self._count = 0
+    # The filtered states and inputs of the samples not yet returned.
+    self._X_filtered = numpy.zeros((0, num_states))
+    self._U = numpy.zeros((0, self.B.shape[1]))
+
+  def _Converged(self, K, J, tolerance):
+    def Close(a, b):
+      return numpy.abs(a - b).max() <= tolerance * max(numpy.abs(a).max(),
+                                                       1e-300)
+    return (Close(K, self._filter_gains[-1]) and
+            Close(J, self._smoother_gains[-1]))
+
+  def _Gain(self, gains, index):
+    return gains[min(index, len(gains) - 1)]
+
+  def _Filter(self, U, Y):
+    """Runs the filter over a chunk, returning the filtered states."""
+    X_filtered = numpy.empty((U.shape[0], self.A.shape[0]))
+    X = self._X_predicted
+    for i in xrange(U.shape[0]):
+      K = self._Gain(self._filter_gains, self._count + i)
+      X = X + K.dot(Y[i] - self.C.dot(X) - self.D.dot(U[i]))
+      X_filtered[i] = X
+      X = self.A.dot(X) + self.B.dot(U[i])
+    self._X_predicted = X
+    self._count += U.shape[0]
+    return X_filtered
+
+  def _Smooth(self, num_samples):
+    """Smooths back from the last pending sample, and returns the first
+    num_samples pending samples."""
+    X_filtered = self._X_filtered
+    first = self._count - X_filtered.shape[0]
+    X_smoothed = numpy.empty_like(X_filtered)
+    X_smoothed[-1] = X_filtered[-1]
+    for i in xrange(X_filtered.shape[0] - 2, -1, -1):
+      J = self._Gain(self._smoother_gains, first + i)
+      X_predicted = self.A.dot(X_filtered[i]) + self.B.dot(self._U[i])
+      X_smoothed[i] = X_filtered[i] + J.dot(X_smoothed[i + 1] - X_predicted)
+    self._X_filtered = X_filtered[num_samples:]
+    self._U = self._U[num_samples:]
+    return X_smoothed[:num_samples]
+
+  def Update(self, U, Y):
+    """Adds a chunk of the log.
+
+    Args:
+      U: numpy.array(T x m), The inputs applied after each measurement.
+      Y: numpy.array(T x p), The measurements.
+
+    Returns:
+      numpy.array(N x n), the smoothed states of the next N samples, N may be
+        0.
+    """
+    U = numpy.asarray(U, dtype=numpy.float64).reshape(-1, self.B.shape[1])
+    Y = numpy.asarray(Y, dtype=numpy.float64).reshape(-1, self.C.shape[0])
+    self._X_filtered = numpy.vstack((self._X_filtered, self._Filter(U, Y)))
+    self._U = numpy.vstack((self._U, U))
+    num_ready = self._X_filtered.shape[0] - self.lag
+    if num_ready <= 0:
+      return numpy.zeros((0, self.A.shape[0]))
+    return self._Smooth(num_ready)
+
+  def Finish(self):
+    """Returns the smoothed states of the rest of the log."""
+    if not self._X_filtered.shape[0]:
+      return numpy.zeros((0, self.A.shape[0]))
+    return self._Smooth(self._X_filtered.shape[0])
+
+
+def Smooth(smoother, U, Y, chunk_size=DEFAULT_CHUNK_SIZE):
+  """Smooths a whole log with an RtsSmoother, chunk_size samples at a time.
+
+  Returns:
+    numpy.array(T x n), the smoothed states.
+  """
+  chunks = [smoother.Update(U[start:start + chunk_size],
+                            Y[start:start + chunk_size])
+            for start in xrange(0, len(U), chunk_size)]
+  chunks.append(smoother.Finish())
+  return numpy.vstack(chunks)
+
+
+def SmoothShooterVelocity(model, voltage, velocity, dt=None,
+                          chunk_size=DEFAULT_CHUNK_SIZE):
+  """Smooths a shooter log's velocity with the Shooter model.
+
+  The model steps at its own dt, so the log must have been sampled at about
+  the same rate.
+
+  Args:
+    model: shooter.Shooter, The model.
+    voltage: numpy.array(T), The voltage applied after each measurement.
+    velocity: numpy.array(T), The measured velocity, in rad/s.
+    dt: float or numpy.array(T), The time steps of the log.  If None, the log
+      is assumed to match the model.
+
+  Raises:
+    ValueError: The mean of dt differs from model.dt by more than
+      MAX_DT_MISMATCH.
+
+  Returns:
+    numpy.array(T), the smoothed velocity.
+  """
+  if dt is not None:
+    mean_dt = numpy.mean(dt)
+    if abs(mean_dt - model.dt) > MAX_DT_MISMATCH * model.dt:
+      raise ValueError('The log has a mean dt of %g, but the model has %g.' % (
+          mean_dt, model.dt))
+  smoother = RtsSmoother(
+      model, numpy.matrix([[SHOOTER_PROCESS_NOISE ** 2]]),
+      numpy.matrix([[SHOOTER_MEASUREMENT_NOISE ** 2]]))
+  return Smooth(smoother, numpy.asarray(voltage), numpy.asarray(velocity),
+                chunk_size)[:, 0]
+
+
+def ReadShooterLog(filename):
+  """Reads a step response log as estimator input.
+
+  Returns:
+    (voltage, velocity, dt), numpy.array(n), with the velocity in rad/s and
+      dt from the timestamps.
+  """
+  shooter_data = shooter.ReadStepResponse(filename)
+  voltage = shooter_data[:, 1] * 12.0
+  velocity = shooter_data[:, 2] * 2.0 * math.pi / 60.0
+  dt = numpy.concatenate(([shooter_data[0, 3]], numpy.diff(shooter_data[:, 0])))
+  return voltage, velocity, dt
+
+
+def main(argv):
+  if len(argv) not in (2, 3):
+    print "Expected a step response csv and an optional chunk size"
+    quit()
+  chunk_size = int(argv[2]) if len(argv) == 3 else 100
+
+  model = shooter.Shooter()
+  estimator = ShooterEstimator(model)
+  voltage, velocity, dt = ReadShooterLog(argv[1])
+  for start in xrange(0, voltage.shape[0], chunk_size):
+    end = start + chunk_size
+    estimator.Update(voltage[start:end], velocity[start:end], dt[start:end])
+    A_continuous, B_continuous = estimator.ContinuousPlant()
+    print ("%5d samples: a %8.4f b %8.4f, J %.5f (R %.5f), drift %+.1f%%" % (
+        min(end, voltage.shape[0]), A_continuous[0, 0], B_continuous[0, 0],
+        estimator.J(), estimator.R(), estimator.Drift() * 100.0))
+
+  if estimator.NeedsRegeneration():
+    print "J R has drifted %+.1f%%, regenerate the gains with J = %.5f" % (
+        estimator.Drift() * 100.0, estimator.J())
+  else:
+    print "The model is within %.0f%% of the log" % (
+        DEFAULT_REGENERATE_THRESHOLD * 100.0)
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+import control_loop_test
+import controls
+import estimation
+import numpy
+from numpy.testing import *
+import shooter
+import unittest
+
+
+def SimulateShooter(model, J, voltage, dt=0.01):
+  """Returns the velocity of the model with inertia J, exactly discretized."""
+  a = model.A_continuous[0, 0] * model.J / J
+  b = model.B_continuous[0, 0] * model.J / J
+  A, B = controls.c2d(numpy.matrix([[a]]), numpy.matrix([[b]]), dt)
+  velocity = numpy.zeros(len(voltage))
+  for i in xrange(1, len(voltage)):
+    velocity[i] = A[0, 0] * velocity[i - 1] + B[0, 0] * voltage[i - 1]
+  return velocity
+
+
+class TestShooterEstimator(unittest.TestCase):
+  def setUp(self):
+    self.model = shooter.Shooter()
+    random = numpy.random.RandomState(0)
+    # Hold random voltages for 50 steps at a time.
+    self.voltage = numpy.repeat(random.uniform(-2.0, 12.0, 40), 50)
+
+  def test_RecoversJ(self):
+    """Tests that a heavier wheel is found and flagged."""
+    velocity = SimulateShooter(self.model, 1.3 * self.model.J, self.voltage)
+    estimator = estimation.ShooterEstimator(self.model)
+    self.assertFalse(estimator.NeedsRegeneration())
+    estimator.Update(self.voltage, velocity, 0.01)
+    assert_allclose(estimator.J(), 1.3 * self.model.J, rtol=1e-3)
+    assert_allclose(estimator.R(), 1.3 * self.model.R, rtol=1e-3)
+    assert_allclose(estimator.ContinuousPlant()[0],
+                    self.model.A_continuous / 1.3, rtol=1e-3)
+    self.assertTrue(estimator.NeedsRegeneration())
+
+  def test_Chunks(self):
+    """Tests that chunking doesn't change the estimate."""
+    velocity = SimulateShooter(self.model, self.model.J, self.voltage)
+    velocity += numpy.random.RandomState(1).randn(len(velocity))
+    whole = estimation.ShooterEstimator(self.model)
+    whole.Update(self.voltage, velocity, 0.01)
+    chunked = estimation.ShooterEstimator(self.model)
+    for start in xrange(0, len(velocity), 37):
+      chunked.Update(self.voltage[start:start + 37],
+                     velocity[start:start + 37], 0.01)
+    assert_allclose(chunked.JR(), whole.JR(), rtol=1e-9)
+    assert_allclose(chunked.num_samples, whole.num_samples, rtol=1e-9)
+    self.assertFalse(whole.NeedsRegeneration())
+
+  def test_Forgetting(self):
+    """Tests that the estimate follows a wheel swap."""
+    estimator = estimation.ShooterEstimator(self.model,
+                                            forgetting_factor=0.99)
+    estimator.Update(self.voltage,
+                     SimulateShooter(self.model, self.model.J, self.voltage),
+                     0.01)
+    estimator.Update(self.voltage, SimulateShooter(
+        self.model, 0.5 * self.model.J, self.voltage), 0.01)
+    assert_allclose(estimator.Drift(), -0.5, atol=1e-2)
+
+  def test_BadForgettingFactor(self):
+    self.assertRaises(ValueError, estimation.ShooterEstimator, self.model,
+                      forgetting_factor=1.5)
+
+
+def FullRts(loop, Q, R, P0, U, Y):
+  """A direct RTS smoother over the whole log, with time varying gains."""
+  A, B, C = loop.A, loop.B, loop.C
+  X = numpy.matrix(numpy.zeros((A.shape[0], 1)))
+  P = P0
+  filtered = []
+  predicted = []
+  for i in xrange(len(U)):
+    predicted.append((X, P))
+    K = P * C.T * numpy.linalg.inv(C * P * C.T + R)
+    X = X + K * (Y[i] - C * X)
+    P = (numpy.eye(A.shape[0]) - K * C) * P
+    filtered.append((X, P))
+    X = A * X + B * U[i]
+    P = A * P * A.T + Q
+  smoothed = [filtered[-1][0]]
+  for i in xrange(len(U) - 2, -1, -1):
+    X_filtered, P_filtered = filtered[i]
+    X_predicted, P_predicted = predicted[i + 1]
+    J = P_filtered * A.T * numpy.linalg.inv(P_predicted)
+    smoothed.append(X_filtered + J * (smoothed[-1] - X_predicted))
+  return numpy.hstack(smoothed[::-1]).T.A
+
+
+class TestRtsSmoother(unittest.TestCase):
+  def setUp(self):
+    self.loop = control_loop_test.MakeLoop('Shooter')
+    self.loop.A = self.loop.A * 0.98
+    self.Q = numpy.matrix(numpy.diag([0.01, 0.04]))
+    self.R = numpy.matrix([[0.25]])
+    random = numpy.random.RandomState(3)
+    self.U = numpy.repeat(random.uniform(-2.0, 12.0, 30), 10)
+    self.X = numpy.zeros((len(self.U), 2))
+    X = numpy.zeros(2)
+    for i in xrange(len(self.U)):
+      self.X[i] = X
+      X = (self.loop.A.A.dot(X) + self.loop.B.A[:, 0] * self.U[i] +
+           random.randn(2) * numpy.sqrt(numpy.diag(self.Q)))
+    self.Y = self.X[:, 1] + random.randn(len(self.U)) * 0.5
+
+  def test_MatchesFullRts(self):
+    """Tests that converged gains and chunks match the textbook smoother."""
+    P0 = numpy.matrix(numpy.eye(2))
+    expected = FullRts(self.loop, self.Q, self.R, P0, self.U, self.Y)
+    for chunk_size in [7, 64, 1000]:
+      smoother = estimation.RtsSmoother(self.loop, self.Q, self.R, P0=P0)
+      assert_allclose(estimation.Smooth(smoother, self.U, self.Y, chunk_size),
+                      expected, rtol=1e-6, atol=1e-6)
+
+  def test_BoundedMemory(self):
+    """Tests that only lag samples are kept between chunks."""
+    smoother = estimation.RtsSmoother(self.loop, self.Q, self.R, lag=20)
+    smoothed = smoother.Update(self.U[:100], self.Y[:100])
+    self.assertEqual((80, 2), smoothed.shape)
+    self.assertEqual(20, smoother._X_filtered.shape[0])
+    smoothed = smoother.Update(self.U[100:], self.Y[100:])
+    self.assertEqual((200, 2), smoothed.shape)
+    self.assertEqual((20, 2), smoother.Finish().shape)
+    self.assertEqual((0, 2), smoother.Finish().shape)
+
+  def test_ReducesError(self):
+    """Tests that smoothing beats the raw measurements."""
+    smoother = estimation.RtsSmoother(self.loop, self.Q, self.R)
+    smoothed = estimation.Smooth(smoother, self.U, self.Y)
+    self.assertLess(numpy.std(smoothed[:, 1] - self.X[:, 1]),
+                    0.6 * numpy.std(self.Y - self.X[:, 1]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+"""
+Thin client for gen_daemon.py.
+
+Usage: gen_client.py <generator> [generator arguments...]
+
+Sends the command to the gain generation daemon, starting the daemon first if
+it isn't running, and prints what the generator printed.  Only the standard
+library is imported, so the client starts quickly.  Set GEN_DAEMON_SOCKET to
+use a socket other than the default.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+# How long to wait for a newly started daemon, in seconds.
+STARTUP_TIMEOUT = 30.0
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Matches gen_daemon.DEFAULT_SOCKET.
+DEFAULT_SOCKET = os.path.join(_DIRECTORY, '.gen_daemon.sock')
+
+
+def _Connect(address):
+  """Returns a socket connected to the daemon, or None if it isn't running."""
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    client.connect(address)
+  except socket.error:
+    client.close()
+    return None
+  return client
+
+
+def _StartDaemon(address):
+  """Starts the daemon in the background and waits for it to listen."""
+  with open(os.devnull, 'w') as devnull:
+    subprocess.Popen([sys.executable, os.path.join(_DIRECTORY, 'gen_daemon.py'),
+                      address], stdout=devnull, stderr=devnull,
+                     close_fds=True, preexec_fn=os.setsid)
+  deadline = time.time() + STARTUP_TIMEOUT
+  while time.time() < deadline:
+    client = _Connect(address)
+    if client is not None:
+      return client
+    time.sleep(0.05)
+  raise RuntimeError('Gain generation daemon did not start on %s' % address)
+
+
+def Generate(generator, argv, address=DEFAULT_SOCKET):
+  """Runs a generator in the daemon.
+
+  Returns:
+    dict, the daemon's reply, with 'status', 'output' and 'seconds'.
+  """
+  client = _Connect(address) or _StartDaemon(address)
+  try:
+    stream = client.makefile('rwb')
+    stream.write(json.dumps({'generator': generator, 'argv': argv,
+                             'cwd': os.getcwd()}) + '\n')
+    stream.flush()
+    return json.loads(stream.readline())
+  finally:
+    client.close()
+
+
+def main(argv):
+  if len(argv) < 2:
+    print "Expected a generator name and its arguments"
+    quit()
+
+  reply = Generate(argv[1], argv[2:],
+                   os.environ.get('GEN_DAEMON_SOCKET', DEFAULT_SOCKET))
+  sys.stdout.write(reply['output'])
+  return reply['status']
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
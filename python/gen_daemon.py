@@ -0,0 +1,350 @@
+#!/usr/bin/python
+
+"""
+Long lived gain generation daemon.
+
+Starting a new interpreter for every regeneration means importing numpy,
+Slycot and friends, and rebuilding every model from scratch.  This daemon
+keeps all of that loaded, along with the design cache, and runs generator
+mains like shooter.main in process on request from gen_client.py.
+
+Every module loaded from the generators' directory is reloaded when its source
+changes, along with the modules which import it, and the design cache survives
+the reload because its keys fingerprint every input.  Modules from anywhere
+else, like numpy, are never reloaded.  If a reload fails, the run reports the
+error and the module is tried again on the next run.  The
+daemon also watches the generator sources and the input files named on the
+command lines it has run, such as step response CSVs.  Files a run writes,
+like the gain files, are outputs and aren't watched.  When one changes, it reruns
+those commands, so the gains stay current without asking.
+
+The protocol is one JSON object per line each way.  A request is
+  {"generator": "shooter", "argv": [...], "cwd": "/path"}
+and the reply is
+  {"status": 0, "output": "...", "seconds": 0.01}
+"""
+
+import SocketServer
+import cStringIO
+import errno
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import types
+
+import control_loop
+
+# The generators the daemon can run, by name.  Each module has a main(argv).
+GENERATORS = {
+    'shooter': 'shooter',
+    'transfer': 'transfer',
+}
+
+# How often the watched files are checked, in seconds.
+WATCH_PERIOD = 1.0
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# The default socket, next to this file.
+DEFAULT_SOCKET = os.path.join(_DIRECTORY, '.gen_daemon.sock')
+
+
+def _ModificationTime(filename):
+  """Returns the modification time of a file, or None if it doesn't exist."""
+  try:
+    return os.stat(filename).st_mtime
+  except OSError:
+    return None
+
+
+def _FileTimes(cwd, argv):
+  """Returns the modification times of the existing files named in argv."""
+  times = {}
+  for arg in argv:
+    filename = os.path.join(cwd, arg)
+    if os.path.isfile(filename):
+      times[filename] = _ModificationTime(filename)
+  return times
+
+
+def _SourceFile(module):
+  """Returns the .py file a module was loaded from."""
+  filename = module.__file__
+  if filename.endswith('.pyc') or filename.endswith('.pyo'):
+    filename = filename[:-1]
+  return filename
+
+
+class Generator(object):
+  """Runs generator mains in process, keeping modules and caches warm.
+
+  Run is not reentrant.  The daemon serializes requests with a lock.
+  """
+
+  def __init__(self, generators=None, directory=_DIRECTORY):
+    """Imports the generators.
+
+    Args:
+      generators: dict, The module of each generator by name.  Defaults to
+        GENERATORS.
+      directory: string, The directory whose modules are reloaded when they
+        change.  It must be on sys.path.
+    """
+    self._lock = threading.Lock()
+    self._generators = GENERATORS if generators is None else generators
+    self._directory = os.path.abspath(directory)
+    # The source modification time of each module from directory when it was
+    # last loaded, by name.
+    self._module_times = {}
+    # The most recent run of each distinct command, keyed by (generator, cwd,
+    # argv), with the modification times of its input files.
+    self._commands = {}
+    # The files each command has written, by command.
+    self._outputs = {}
+    for name in self._generators.itervalues():
+      __import__(name)
+    self._RecordModuleTimes()
+
+  def _DirectoryModules(self):
+    """Returns the modules loaded from the directory, by name."""
+    modules = {}
+    for name, module in sys.modules.items():
+      if module is None or name in ('__main__', __name__):
+        continue
+      filename = getattr(module, '__file__', None)
+      if (filename and os.path.dirname(os.path.abspath(filename)) ==
+          self._directory):
+        modules[name] = module
+    return modules
+
+  def _RecordModuleTimes(self):
+    """Records the source times of modules from the directory new since last."""
+    for name, module in self._DirectoryModules().iteritems():
+      if name not in self._module_times:
+        self._module_times[name] = _ModificationTime(_SourceFile(module))
+
+  def _ReloadChangedModules(self):
+    """Reloads the changed modules and their importers, keeping the design cache.
+
+    Raises:
+      Exception: A module failed to reload.  Its time isn't recorded, so it is
+        tried again next time.
+
+    Returns:
+      boolean, True if anything was reloaded.
+    """
+    modules = self._DirectoryModules()
+    stale = set(name for name, module in modules.iteritems()
+                if _ModificationTime(_SourceFile(module)) !=
+                self._module_times.get(name))
+    if not stale:
+      return False
+
+    imports = dict(
+        (name, set(value.__name__ for value in vars(module).itervalues()
+                   if isinstance(value, types.ModuleType) and
+                   value.__name__ in modules))
+        for name, module in modules.iteritems())
+    # Modules which import a stale module hold its old classes, so they are
+    # stale too.
+    while True:
+      importers = set(name for name in modules
+                      if name not in stale and imports[name] & stale)
+      if not importers:
+        break
+      stale |= importers
+
+    # Reload the imported modules before the modules which import them.
+    order = []
+    visiting = set()
+    def Visit(name):
+      if name in order or name in visiting or name not in stale:
+        return
+      visiting.add(name)
+      for imported in sorted(imports[name]):
+        Visit(imported)
+      order.append(name)
+    for name in sorted(stale):
+      Visit(name)
+
+    design_cache = dict(control_loop._design_cache)
+    try:
+      for name in order:
+        self._module_times.pop(name, None)
+      for name in order:
+        module = reload(modules[name])
+        self._module_times[name] = _ModificationTime(_SourceFile(module))
+    finally:
+      control_loop._design_cache.update(design_cache)
+    return True
+
+  def _InputFiles(self, command):
+    """Returns the modification times of the input files of a command.
+
+    These are the existing files named in its argv which no run of it has
+    written.  A file which a run left alone because its contents didn't change
+    counts as an input until a run writes it.
+    """
+    _, cwd, argv = command
+    outputs = self._outputs.get(command, ())
+    return dict((filename, times) for filename, times
+                in _FileTimes(cwd, argv).iteritems()
+                if filename not in outputs)
+
+  def Run(self, generator, argv, cwd):
+    """Runs a generator's main with argv in cwd.
+
+    Plots are never shown from the daemon.  Pass --plot_file=<file> to write
+    them to a file.
+
+    Returns:
+      (status, output), the exit status and everything the generator printed.
+    """
+    with self._lock:
+      return self._RunLocked(generator, argv, cwd)
+
+  def _RunLocked(self, generator, argv, cwd):
+    if generator not in self._generators:
+      return 2, 'Unknown generator %s, expected one of %s\n' % (
+          generator, ', '.join(sorted(self._generators)))
+
+    command = (generator, cwd, tuple(argv))
+    argv = list(argv)
+    if not any(arg.startswith('--plot_file=') for arg in argv):
+      argv.append('--noplot')
+
+    before = _FileTimes(cwd, argv)
+    output = cStringIO.StringIO()
+    old_cwd = os.getcwd()
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output
+    status = 0
+    try:
+      self._ReloadChangedModules()
+      os.chdir(cwd)
+      module = sys.modules[self._generators[generator]]
+      status = module.main([module.__file__] + argv) or 0
+    except SystemExit as e:
+      status = e.code if isinstance(e.code, int) else 1
+    except Exception:
+      traceback.print_exc(file=output)
+      status = 1
+    finally:
+      sys.stdout, sys.stderr = old_stdout, old_stderr
+      os.chdir(old_cwd)
+
+    self._RecordModuleTimes()
+    after = _FileTimes(cwd, argv)
+    self._outputs.setdefault(command, set()).update(
+        filename for filename, times in after.iteritems()
+        if times != before.get(filename))
+    self._commands[command] = self._InputFiles(command)
+    return status, output.getvalue()
+
+  def RerunStale(self):
+    """Reruns the commands whose sources or input files changed.
+
+    Returns:
+      array[(command, status)], the commands which were rerun.
+    """
+    with self._lock:
+      try:
+        modules_changed = self._ReloadChangedModules()
+      except Exception:
+        traceback.print_exc()
+        modules_changed = True
+      rerun = []
+      for command, times in self._commands.items():
+        generator, cwd, argv = command
+        if modules_changed or self._InputFiles(command) != times:
+          status, _ = self._RunLocked(generator, argv, cwd)
+          rerun.append((command, status))
+      return rerun
+
+
+class _GeneratorHandler(SocketServer.StreamRequestHandler):
+  def handle(self):
+    for line in iter(self.rfile.readline, ''):
+      start = time.time()
+      try:
+        request = json.loads(line)
+        status, output = self.server.generator.Run(
+            request['generator'], request.get('argv', []),
+            request.get('cwd', os.getcwd()))
+      except (ValueError, KeyError, TypeError) as e:
+        status, output = 2, 'Bad request: %s\n' % e
+      self.wfile.write(json.dumps({'status': status, 'output': output,
+                                   'seconds': time.time() - start}) + '\n')
+      self.wfile.flush()
+
+
+class _ThreadingUnixStreamServer(SocketServer.ThreadingMixIn,
+                                 SocketServer.UnixStreamServer):
+  daemon_threads = True
+
+
+def _Watch(generator):
+  """Reruns stale commands forever."""
+  while True:
+    time.sleep(WATCH_PERIOD)
+    for (name, cwd, argv), status in generator.RerunStale():
+      sys.__stderr__.write('Reran %s %s in %s: status %d\n' % (
+          name, ' '.join(argv), cwd, status))
+
+
+def _LockAddress(address):
+  """Locks address for this process, so only one daemon serves it.
+
+  The lock is held until the returned file is closed or the process exits.
+
+  Returns:
+    file, the lock file, or None if another daemon holds the lock.
+  """
+  lock_file = open(address + '.lock', 'a')
+  try:
+    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except IOError as e:
+    lock_file.close()
+    if e.errno in (errno.EAGAIN, errno.EACCES):
+      return None
+    raise
+  return lock_file
+
+
+def main(argv):
+  if len(argv) > 2:
+    print "Expected an optional socket path"
+    quit()
+  address = argv[1] if len(argv) == 2 else DEFAULT_SOCKET
+
+  # Clients which find no daemon each start one.  Only the first gets the
+  # lock, and the rest exit before touching its socket.
+  lock_file = _LockAddress(address)
+  if lock_file is None:
+    sys.stderr.write('Another daemon is serving %s\n' % address)
+    return 1
+
+  # Holding the lock, any socket left over is from a daemon which died.
+  if os.path.exists(address):
+    os.unlink(address)
+  server = _ThreadingUnixStreamServer(address, _GeneratorHandler)
+  server.generator = Generator()
+
+  watcher = threading.Thread(target=_Watch, args=(server.generator,))
+  watcher.daemon = True
+  watcher.start()
+
+  sys.stderr.write('Generating gains on %s\n' % address)
+  try:
+    server.serve_forever()
+  finally:
+    os.unlink(address)
+    lock_file.close()
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
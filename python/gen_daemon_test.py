@@ -0,0 +1,108 @@
+#!/usr/bin/python
+
+import gen_daemon
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# A generator which copies its input to its output with a suffix.
+TOY_GENERATOR = """
+SUFFIX = %r
+
+def main(argv):
+  with open(argv[1]) as fd:
+    value = fd.read()
+  with open(argv[2], 'w') as fd:
+    fd.write(value + SUFFIX)
+  print 'Generated %%s from %%s' %% (argv[2], value)
+  if value == 'raise':
+    raise RuntimeError('Bad input')
+  return len(argv)
+"""
+
+
+def WriteLater(filename, contents, seconds=10):
+  """Writes filename and moves its modification time seconds later."""
+  mtime = os.stat(filename).st_mtime if os.path.exists(filename) else 0
+  with open(filename, 'w') as fd:
+    fd.write(contents)
+  mtime = max(mtime, os.stat(filename).st_mtime) + seconds
+  os.utime(filename, (mtime, mtime))
+
+
+class TestGenerator(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.module_file = os.path.join(self.directory, 'toy_generator.py')
+    WriteLater(self.module_file, TOY_GENERATOR % '!')
+    self.input_file = os.path.join(self.directory, 'input.txt')
+    WriteLater(self.input_file, 'gains')
+    self.output_file = os.path.join(self.directory, 'output.txt')
+    sys.path.insert(0, self.directory)
+    self.generator = gen_daemon.Generator({'toy': 'toy_generator'},
+                                          self.directory)
+    self.argv = ('input.txt', 'output.txt')
+
+  def tearDown(self):
+    sys.path.remove(self.directory)
+    del sys.modules['toy_generator']
+    shutil.rmtree(self.directory)
+
+  def ReadOutput(self):
+    with open(self.output_file) as fd:
+      return fd.read()
+
+  def test_Run(self):
+    """Tests that the output is captured and the status returned."""
+    stdout = sys.stdout
+    status, output = self.generator.Run('toy', list(self.argv),
+                                        self.directory)
+    self.assertIs(stdout, sys.stdout)
+    # The daemon adds --noplot.
+    self.assertEqual(4, status)
+    self.assertEqual('Generated output.txt from gains\n', output)
+    self.assertEqual('gains!', self.ReadOutput())
+
+  def test_Errors(self):
+    """Tests that unknown generators and exceptions are reported."""
+    self.assertEqual(2, self.generator.Run('shooter', [], self.directory)[0])
+
+    WriteLater(self.input_file, 'raise')
+    status, output = self.generator.Run('toy', list(self.argv),
+                                        self.directory)
+    self.assertEqual(1, status)
+    self.assertIn('RuntimeError: Bad input', output)
+
+  def test_RerunOnModuleChange(self):
+    """Tests that touching the generator reloads it and reruns the command."""
+    self.generator.Run('toy', list(self.argv), self.directory)
+    # Writing the output doesn't make the command stale.
+    self.assertEqual([], self.generator.RerunStale())
+
+    WriteLater(self.module_file, TOY_GENERATOR % '?')
+    self.assertEqual([(('toy', self.directory, self.argv), 4)],
+                     self.generator.RerunStale())
+    self.assertEqual('gains?', self.ReadOutput())
+    self.assertEqual([], self.generator.RerunStale())
+
+  def test_RerunOnInputChange(self):
+    """Tests that changing an input file reruns the command."""
+    self.generator.Run('toy', list(self.argv), self.directory)
+    WriteLater(self.input_file, 'new gains')
+    self.assertEqual(1, len(self.generator.RerunStale()))
+    self.assertEqual('new gains!', self.ReadOutput())
+
+  def test_LockAddress(self):
+    """Tests that only one lock on an address can be held at a time."""
+    address = os.path.join(self.directory, 'daemon.sock')
+    lock_file = gen_daemon._LockAddress(address)
+    self.assertIsNotNone(lock_file)
+    self.assertIsNone(gen_daemon._LockAddress(address))
+    lock_file.close()
+    gen_daemon._LockAddress(address).close()
+
+
+if __name__ == '__main__':
+  unittest.main()
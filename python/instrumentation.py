@@ -0,0 +1,256 @@
+"""
+Opt-in call counters and timers for the design and simulation entry points.
+
+Enable wraps dplace, c2d, HPolytope.Vertices, Update and UpdateObserver of
+ControlLoop and its steppers, and the ControlLoopWriter Write methods, and
+Disable puts the originals back, so there is no overhead at all when disabled.
+While enabled, each entry point records its number of calls, its total and
+recent per call wall times, and the number of numpy.matrix objects created
+during its calls.
+Calls into libcdd are counted too, when it can be loaded, to separate ctypes
+traffic from the rest of Vertices.
+
+The times and allocations of nested calls are included in their callers, so
+the time in ControlLoopWriter.WriteJava is also part of the time in
+ControlLoopWriter.Write.  Recording isn't locked, so counts from several threads
+may be slightly off.
+
+  instrumentation.Enable(dump_at_exit=True)
+
+or pass --instrument to a generator, like shooter.py, to print the summary when
+it finishes.
+"""
+
+import atexit
+import functools
+import sys
+import timeit
+
+import control_loop
+import controls
+import numpy
+
+# The number of most recent per call times kept by each entry point for the
+# percentiles.
+SAMPLE_CAPACITY = 4096
+
+# The percentiles reported by Summary.
+PERCENTILES = [50, 90, 99]
+
+
+class CallStats(object):
+  """Statistics of the calls to one entry point.
+
+  Attributes:
+    calls: int, The number of calls.
+    total_time: float, The total wall time spent in the calls, in seconds.
+    allocations: int, The number of numpy.matrix objects created in the calls.
+    samples: numpy.array(SAMPLE_CAPACITY), The most recent per call times, in
+      a ring.
+  """
+
+  def __init__(self):
+    self.calls = 0
+    self.total_time = 0.0
+    self.allocations = 0
+    self.samples = numpy.zeros(SAMPLE_CAPACITY)
+
+  def Record(self, seconds, allocations):
+    self.samples[self.calls % SAMPLE_CAPACITY] = seconds
+    self.calls += 1
+    self.total_time += seconds
+    self.allocations += allocations
+
+  def Percentiles(self, percentiles=PERCENTILES):
+    """Returns the percentiles of the recent per call times, in seconds."""
+    return numpy.percentile(self.samples[:min(self.calls, SAMPLE_CAPACITY)],
+                            percentiles)
+
+
+# CallStats by entry point name, while enabled or until Reset.
+_stats = {}
+
+# Calls to libcdd functions by name.
+_libcdd_calls = {}
+
+# The number of numpy.matrix objects created while enabled.
+_matrix_allocations = [0]
+
+# (owner, attribute name, original) of everything patched by Enable.
+_patches = []
+
+_dump_registered = [False]
+
+
+def _EntryPoints():
+  """Returns (owner, attribute name, stats name) of each timed entry point."""
+  entry_points = [
+      (controls, 'dplace', 'controls.dplace'),
+      (controls, 'c2d', 'controls.c2d'),
+      (control_loop.ControlLoop, 'Update', 'ControlLoop.Update'),
+      (control_loop.ControlLoop, 'UpdateObserver',
+       'ControlLoop.UpdateObserver'),
+  ]
+  # Simulations like shooter.SimulateStepResponse step through ControlLoop's
+  # steppers instead.
+  for stepper in [control_loop.ArrayStepper, control_loop.ScalarStepper]:
+    entry_points.extend(
+        (stepper, name, '%s.%s' % (stepper.__name__, name))
+        for name in ['Update', 'UpdateObserver'])
+  entry_points.extend(
+      (control_loop.ControlLoopWriter, name, 'ControlLoopWriter.' + name)
+      for name in sorted(vars(control_loop.ControlLoopWriter))
+      if name.startswith('Write'))
+  try:
+    import polytope
+  except (ImportError, OSError):
+    # libcdd isn't installed, so there are no polytopes to time.
+    pass
+  else:
+    entry_points.append((polytope.HPolytope, 'Vertices', 'HPolytope.Vertices'))
+    entry_points.extend(
+        (polytope.libcdd, name, None) for name in sorted(vars(polytope.libcdd))
+        if name.startswith('dd_') and callable(getattr(polytope.libcdd, name)))
+  return entry_points
+
+
+def _Timed(function, name):
+  """Returns function, recording its calls in _stats[name]."""
+  @functools.wraps(function)
+  def Wrapper(*args, **kwargs):
+    allocations = _matrix_allocations[0]
+    start = timeit.default_timer()
+    try:
+      return function(*args, **kwargs)
+    finally:
+      seconds = timeit.default_timer() - start
+      stats = _stats.get(name)
+      if stats is None:
+        stats = _stats[name] = CallStats()
+      stats.Record(seconds, _matrix_allocations[0] - allocations)
+  return Wrapper
+
+
+def _Counted(function, name):
+  """Returns function, counting its calls in _libcdd_calls[name]."""
+  @functools.wraps(function)
+  def Wrapper(*args, **kwargs):
+    _libcdd_calls[name] = _libcdd_calls.get(name, 0) + 1
+    return function(*args, **kwargs)
+  return Wrapper
+
+
+def _CountMatrix(function):
+  """Returns numpy.matrix.__array_finalize__, counting new matrices."""
+  @functools.wraps(function)
+  def Wrapper(self, obj):
+    _matrix_allocations[0] += 1
+    return function(self, obj)
+  return Wrapper
+
+
+def _Patch(owner, attribute, wrapper):
+  # Classes keep the plain function in their __dict__, and putting the wrapper
+  # there makes it a method like the original.
+  original = vars(owner)[attribute]
+  _patches.append((owner, attribute, original))
+  setattr(owner, attribute, wrapper(original))
+
+
+def IsEnabled():
+  """Returns True if the entry points are instrumented."""
+  return bool(_patches)
+
+
+def Enable(dump_at_exit=False, out=None):
+  """Instruments the entry points.  Does nothing if already enabled.
+
+  Args:
+    dump_at_exit: boolean, If True, the Summary is written to out when the
+      interpreter exits.
+    out: file, Where to write the summary at exit.  Defaults to stderr.
+  """
+  if dump_at_exit and not _dump_registered[0]:
+    _dump_registered[0] = True
+    atexit.register(lambda: (out or sys.stderr).write(Summary() + '\n'))
+  if IsEnabled():
+    return
+
+  for owner, attribute, name in _EntryPoints():
+    if name is None:
+      _Patch(owner, attribute,
+             lambda function, attribute=attribute: _Counted(function,
+                                                            attribute))
+    else:
+      _Patch(owner, attribute,
+             lambda function, name=name: _Timed(function, name))
+  _Patch(numpy.matrix, '__array_finalize__', _CountMatrix)
+
+
+def Disable():
+  """Restores the original entry points.  The statistics are kept."""
+  while _patches:
+    owner, attribute, original = _patches.pop()
+    setattr(owner, attribute, original)
+
+
+def Reset():
+  """Clears the statistics."""
+  _stats.clear()
+  _libcdd_calls.clear()
+  _matrix_allocations[0] = 0
+
+
+def Stats():
+  """Returns a copy of the statistics.
+
+  Returns:
+    dict, with the CallStats of each entry point called by name in 'calls',
+      the number of calls to each libcdd function in 'libcdd', and the total
+      numpy.matrix objects created in 'matrix_allocations'.
+  """
+  return {'calls': dict(_stats), 'libcdd': dict(_libcdd_calls),
+          'matrix_allocations': _matrix_allocations[0]}
+
+
+def Summary():
+  """Returns a table of the statistics, slowest total time first."""
+  lines = ['%-36s %8s %10s %10s %10s %10s %10s' % (
+      'entry point', 'calls', 'total ms',
+      'p%d us' % PERCENTILES[0], 'p%d us' % PERCENTILES[1],
+      'p%d us' % PERCENTILES[2], 'matrices')]
+  for name, stats in sorted(_stats.iteritems(),
+                            key=lambda item: -item[1].total_time):
+    lines.append('%-36s %8d %10.2f %10.1f %10.1f %10.1f %10d' % (
+        (name, stats.calls, stats.total_time * 1e3) +
+        tuple(stats.Percentiles() * 1e6) + (stats.allocations,)))
+  if _libcdd_calls:
+    lines.append('libcdd calls: %s' % ', '.join(
+        '%s %d' % item for item in sorted(_libcdd_calls.iteritems())))
+  lines.append('%d numpy.matrix objects created' % _matrix_allocations[0])
+  return '\n'.join(lines)
+
+
+def ExtractInstrumentFlag(argv):
+  """Removes --instrument from a command line.
+
+  Generators with the flag Start before doing anything, and Finish when done.
+
+  Returns:
+    (argv, enabled), the command line without the flag, and whether it was
+      there.
+  """
+  remaining_argv = [arg for arg in argv if arg != '--instrument']
+  return remaining_argv, len(remaining_argv) != len(argv)
+
+
+def Start():
+  """Clears the statistics and enables instrumentation."""
+  Reset()
+  Enable()
+
+
+def Finish(out=None):
+  """Disables instrumentation and writes the Summary to out, or stderr."""
+  Disable()
+  (out or sys.stderr).write(Summary() + '\n')
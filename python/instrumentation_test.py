@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+import control_loop
+import control_loop_test
+import controls
+import cStringIO
+import instrumentation
+import numpy
+import os
+import shooter
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+class TestInstrumentation(unittest.TestCase):
+  def setUp(self):
+    self.original_update = vars(control_loop.ControlLoop)['Update']
+    self.original_dplace = controls.dplace
+    self.loop = control_loop_test.MakeLoop('Shooter')
+    instrumentation.Start()
+
+  def tearDown(self):
+    instrumentation.Disable()
+
+  def test_Counts(self):
+    """Tests that calls and matrix allocations are recorded."""
+    for _ in xrange(3):
+      self.loop.Update(numpy.matrix([[1.0]]))
+    stats = instrumentation.Stats()
+    update = stats['calls']['ControlLoop.Update']
+    self.assertEqual(3, update.calls)
+    self.assertGreater(update.total_time, 0.0)
+    self.assertGreater(update.allocations, 0)
+    self.assertEqual(3, len(update.Percentiles()))
+    self.assertNotIn('ControlLoop.UpdateObserver', stats['calls'])
+    self.assertIn('ControlLoop.Update', instrumentation.Summary())
+
+  def test_Disable(self):
+    """Tests that Disable restores the originals and keeps the stats."""
+    self.assertTrue(instrumentation.IsEnabled())
+    self.assertIsNot(self.original_dplace, controls.dplace)
+    self.loop.Update(numpy.matrix([[1.0]]))
+    instrumentation.Disable()
+    self.assertFalse(instrumentation.IsEnabled())
+    self.assertIs(self.original_update,
+                  vars(control_loop.ControlLoop)['Update'])
+    self.assertIs(self.original_dplace, controls.dplace)
+    self.loop.Update(numpy.matrix([[1.0]]))
+    self.assertEqual(
+        1, instrumentation.Stats()['calls']['ControlLoop.Update'].calls)
+
+  def test_Steppers(self):
+    """Tests that shooter.py --instrument reports the simulation steps."""
+    instrumentation.Disable()
+    directory = tempfile.mkdtemp()
+    try:
+      log = os.path.join(directory, 'step.csv')
+      with open(log, 'w') as fd:
+        for i in xrange(20):
+          fd.write('%f, 1.0, %f, 0.01\n' % (0.01 * i, 100.0 * i))
+      stderr = sys.stderr
+      sys.stderr = summary = cStringIO.StringIO()
+      try:
+        shooter.main(['shooter.py', '--instrument',
+                      '--plot_file=' + os.path.join(directory, 'plot.png'),
+                      log, os.path.join(directory, 'ShooterGains.java'),
+                      os.path.join(directory, 'PlainShooterGains.java')])
+      finally:
+        sys.stderr = stderr
+    finally:
+      shutil.rmtree(directory)
+
+    self.assertEqual(
+        20, instrumentation.Stats()['calls']['ScalarStepper.Update'].calls)
+    self.assertIn('ScalarStepper.Update', summary.getvalue())
+
+  def test_ExtractFlag(self):
+    self.assertEqual((['shooter.py', 'a'], True),
+                     instrumentation.ExtractInstrumentFlag(
+                         ['shooter.py', '--instrument', 'a']))
+    self.assertEqual((['shooter.py'], False),
+                     instrumentation.ExtractInstrumentFlag(['shooter.py']))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+"""
+Fixed period runner for control loops, with timing instrumentation.
+
+Runs the observer update, control law and plant step of one or more loops
+every dt against the simulated plants, the way the robot would, to check that
+the math keeps up.  The compute time, start jitter and deadline misses of the
+most recent cycles are kept in a fixed size ring buffer, and can be exported
+as histograms for latency budget checks.
+
+The runner sleeps until each cycle's start time on a single thread.  Python 2
+has no asyncio, and there is nothing else to interleave with the loops here.
+"""
+
+import json
+import sys
+import time
+
+import composite_loop
+import numpy
+
+# The number of cycles of timing kept by default.  A minute at 10 ms.
+DEFAULT_CAPACITY = 6000
+
+# The histogram bin edges used by default, in seconds.
+DEFAULT_BINS = numpy.concatenate(([0.0], numpy.logspace(-6.0, -1.0, 26)))
+
+
+class TimingRing(object):
+  """Keeps the timing of the most recent cycles in preallocated arrays.
+
+  Attributes:
+    compute_time: numpy.array(capacity), Seconds spent running each cycle.
+    jitter: numpy.array(capacity), Seconds each cycle started after its
+      scheduled time.
+    missed: numpy.array(capacity, bool), True if the cycle finished after the
+      next cycle should have started.
+    count: int, The total number of cycles recorded, including overwritten
+      ones.
+    total_missed: int, The total number of deadline misses recorded.
+  """
+
+  def __init__(self, capacity=DEFAULT_CAPACITY):
+    self.compute_time = numpy.zeros(capacity)
+    self.jitter = numpy.zeros(capacity)
+    self.missed = numpy.zeros(capacity, dtype=bool)
+    self.count = 0
+    self.total_missed = 0
+
+  def Record(self, jitter, compute_time, missed):
+    """Records one cycle, overwriting the oldest once full."""
+    index = self.count % self.compute_time.shape[0]
+    self.jitter[index] = jitter
+    self.compute_time[index] = compute_time
+    self.missed[index] = missed
+    self.count += 1
+    if missed:
+      self.total_missed += 1
+
+  def _Valid(self, values):
+    """Returns the recorded part of values, oldest first."""
+    capacity = values.shape[0]
+    if self.count <= capacity:
+      return values[:self.count]
+    return numpy.roll(values, -(self.count % capacity))
+
+  def Histograms(self, bins=DEFAULT_BINS):
+    """Returns histograms of the compute time and jitter in the buffer.
+
+    Returns:
+      dict, with 'bins' (the edges, in seconds), 'compute_time' and 'jitter'
+        (the counts in each bin), 'cycles' and 'missed' (in the buffer), and
+        'total_cycles' and 'total_missed'.
+    """
+    return {
+        'bins': list(bins),
+        'compute_time': numpy.histogram(self._Valid(self.compute_time),
+                                        bins)[0].tolist(),
+        'jitter': numpy.histogram(self._Valid(self.jitter), bins)[0].tolist(),
+        'cycles': len(self._Valid(self.missed)),
+        'missed': int(self._Valid(self.missed).sum()),
+        'total_cycles': self.count,
+        'total_missed': self.total_missed,
+    }
+
+  def Summary(self):
+    """Returns a one line summary of the timing in the buffer."""
+    compute_time = self._Valid(self.compute_time)
+    jitter = self._Valid(self.jitter)
+    if not len(compute_time):
+      return 'No cycles recorded'
+    return ('%d cycles, compute p50 %.1f us p99 %.1f us max %.1f us, '
+            'jitter p99 %.1f us max %.1f us, %d deadline misses' % (
+                self.count,
+                numpy.percentile(compute_time, 50) * 1e6,
+                numpy.percentile(compute_time, 99) * 1e6,
+                compute_time.max() * 1e6,
+                numpy.percentile(jitter, 99) * 1e6,
+                jitter.max() * 1e6,
+                self.total_missed))
+
+
+class LoopRunner(object):
+  """Runs a set of loops against their simulated plants on a fixed period.
+
+  The loops are stepped together by a composite_loop.CompositeStepper, and
+  their goals are set through its views.
+  """
+
+  def __init__(self, loops, period=None, capacity=DEFAULT_CAPACITY,
+               clock=time.time, sleep=time.sleep):
+    """Constructs a runner starting from the loops' current states.
+
+    Args:
+      loops: array[ControlLoop], The loops to run.
+      period: float, The period in seconds.  If None, the loops' dt is used.
+      capacity: int, The number of cycles of timing to keep.
+      clock: function, Returns the current time in seconds.
+      sleep: function, Sleeps for the provided number of seconds.
+    """
+    self.composite = composite_loop.CompositeLoop('Runner', loops)
+    self.stepper = self.composite.Stepper()
+    self.period = self.composite.dt if period is None else period
+    self.timing = TimingRing(capacity)
+    self._clock = clock
+    self._sleep = sleep
+
+  def View(self, name):
+    """Returns the MechanismView of the loop with the provided name."""
+    return self.stepper.View(name)
+
+  def Run(self, num_cycles):
+    """Runs the loops for num_cycles periods.
+
+    A cycle which overruns its deadline doesn't cause the following cycles to
+    be run back to back to catch up.  The next cycle starts at the next period
+    boundary instead, like a timer which drops ticks.
+    """
+    period = self.period
+    scheduled = self._clock()
+    for _ in xrange(num_cycles):
+      now = self._clock()
+      if now < scheduled:
+        self._sleep(scheduled - now)
+        now = self._clock()
+      start = now
+      self.stepper.Step()
+      end = self._clock()
+
+      deadline = scheduled + period
+      self.timing.Record(start - scheduled, end - start, end > deadline)
+      if end > deadline:
+        scheduled += period * numpy.ceil((end - scheduled) / period)
+      else:
+        scheduled = deadline
+
+
+def main(argv):
+  if len(argv) not in (2, 3, 4) or argv[1] not in ('shooter', 'transfer',
+                                                    'both'):
+    print ("Expected shooter, transfer or both, an optional number of seconds"
+           " and an optional histogram .json name")
+    quit()
+
+  loops = []
+  goals = []
+  if argv[1] in ('shooter', 'both'):
+    import shooter
+    loops.append(shooter.Shooter())
+    goals.append(numpy.matrix([[300.0]]))
+  if argv[1] in ('transfer', 'both'):
+    import transfer
+    loops.append(transfer.Transfer())
+    goals.append(numpy.matrix([[1.0], [0.0]]))
+
+  runner = LoopRunner(loops)
+  for loop, goal in zip(loops, goals):
+    runner.View(loop._name).R[:] = goal
+  seconds = float(argv[2]) if len(argv) >= 3 else 10.0
+  runner.Run(int(seconds / runner.period))
+  print runner.timing.Summary()
+
+  if len(argv) == 4:
+    with open(argv[3], 'w') as fd:
+      json.dump(runner.timing.Histograms(), fd, indent=2)
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+import control_loop_test
+import loop_runner
+import numpy
+from numpy.testing import *
+import unittest
+
+
+class FakeClock(object):
+  """A clock which only moves when slept on or advanced."""
+
+  def __init__(self):
+    self.now = 100.0
+
+  def Time(self):
+    return self.now
+
+  def Sleep(self, seconds):
+    self.now += seconds
+
+
+class TestTimingRing(unittest.TestCase):
+  def test_Wraps(self):
+    """Tests that only the most recent cycles are kept, oldest first."""
+    timing = loop_runner.TimingRing(capacity=3)
+    for i in xrange(5):
+      timing.Record(0.0, float(i), i == 1)
+    assert_array_equal(timing._Valid(timing.compute_time), [2.0, 3.0, 4.0])
+    histograms = timing.Histograms(bins=[0.0, 2.5, 10.0])
+    self.assertEqual([1, 2], histograms['compute_time'])
+    self.assertEqual(0, histograms['missed'])
+    self.assertEqual(1, histograms['total_missed'])
+    self.assertEqual(5, histograms['total_cycles'])
+
+
+class TestLoopRunner(unittest.TestCase):
+  def setUp(self):
+    self.clock = FakeClock()
+    self.runner = loop_runner.LoopRunner(
+        [control_loop_test.MakeLoop('Left', 1.0)], capacity=10,
+        clock=self.clock.Time, sleep=self.clock.Sleep)
+    self.compute_times = []
+    step = self.runner.stepper.Step
+
+    def SlowStep():
+      step()
+      self.clock.now += self.compute_times.pop(0)
+    self.runner.stepper.Step = SlowStep
+
+  def test_Deadlines(self):
+    """Tests that overruns are recorded and skip to the next period."""
+    compute_times = [0.002, 0.025, 0.002, 0.002]
+    self.compute_times = list(compute_times)
+    self.runner.Run(4)
+    timing = self.runner.timing
+    assert_almost_equal(timing._Valid(timing.compute_time), compute_times)
+    assert_array_equal(timing._Valid(timing.missed),
+                       [False, True, False, False])
+    # The overrun ends 35 ms in, so the next cycle starts at 40 ms.
+    assert_almost_equal(timing._Valid(timing.jitter), [0.0, 0.0, 0.0, 0.0])
+    assert_almost_equal(self.clock.now, 100.052)
+
+  def test_Runs(self):
+    """Tests that the loops are stepped toward their goals."""
+    self.compute_times = [0.0] * 10
+    self.runner.View('Left').R[1, 0] = 100.0
+    self.runner.Run(10)
+    self.assertTrue(self.runner.View('Left').X[1, 0] > 0.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
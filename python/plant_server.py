@@ -0,0 +1,373 @@
+#!/usr/bin/python
+
+"""
+Local software in the loop plant server.
+
+Hosts a set of ControlLoop plants over a Unix socket or loopback TCP, so robot
+code tests can drive simulated mechanisms from outside this process.  Every
+connection is its own simulated robot, with its own state for each plant.
+
+The protocol is one JSON object per line each way.  A request is
+  {"plant": "Shooter", "U": [12.0]}
+to step that plant once with U (clipped to U_min and U_max), and the reply is
+  {"Y": [...]}
+with the new output.  {"plant": "Shooter", "reset": true} zeros the state and
+replies {"Y": [...]}.  Bad requests, and requests which fail to step, get
+{"error": "..."}.
+
+Steps from concurrent connections are batched.  A single thread takes every
+request waiting in the queue, and steps all the robots using the same plant
+with one set of array operations.
+"""
+
+import Queue
+import SocketServer
+import json
+import os
+import socket
+import sys
+import threading
+
+import numpy
+
+
+class PlantBank(object):
+  """The states of every robot using one plant, stacked in arrays.
+
+  Each robot owns a row of X and Y, allocated with Allocate.  The arrays
+  double in size when full.
+  """
+
+  def __init__(self, loop, capacity=16):
+    """Constructs an empty bank.
+
+    Args:
+      loop: ControlLoop, The plant.  Only its A, B, C, D, U_max and U_min are
+        used.
+      capacity: int, The number of robots to allocate space for up front.
+    """
+    self.name = loop._name
+    self.A_transpose = numpy.array(loop.A, dtype=numpy.float64).T
+    self.B_transpose = numpy.array(loop.B, dtype=numpy.float64).T
+    self.C_transpose = numpy.array(loop.C, dtype=numpy.float64).T
+    self.D_transpose = numpy.array(loop.D, dtype=numpy.float64).T
+    self.U_max = numpy.array(loop.U_max, dtype=numpy.float64).T
+    self.U_min = numpy.array(loop.U_min, dtype=numpy.float64).T
+    self.num_inputs = self.B_transpose.shape[0]
+    self.X = numpy.zeros((capacity, self.A_transpose.shape[0]))
+    self.Y = numpy.zeros((capacity, self.C_transpose.shape[1]))
+    self._free = range(capacity - 1, -1, -1)
+
+  def Allocate(self):
+    """Returns the row of a new robot, with a zero state."""
+    if not self._free:
+      capacity = self.X.shape[0]
+      self.X = numpy.vstack((self.X, numpy.zeros_like(self.X)))
+      self.Y = numpy.vstack((self.Y, numpy.zeros_like(self.Y)))
+      self._free = range(2 * capacity - 1, capacity - 1, -1)
+    row = self._free.pop()
+    self.Reset(row)
+    return row
+
+  def Release(self, row):
+    """Frees the row of a robot which disconnected."""
+    self._free.append(row)
+
+  def Reset(self, row):
+    """Zeros the state of a robot."""
+    self.X[row] = 0.0
+    self.Y[row] = 0.0
+
+  def Step(self, rows, U):
+    """Steps several robots at once, like ControlLoop.Update.
+
+    Args:
+      rows: numpy.array(N), The rows of the robots to step.
+      U: numpy.array(N x m), The input of each robot.
+
+    Returns:
+      numpy.array(N x p), the new outputs.
+    """
+    U = numpy.clip(U, self.U_min, self.U_max)
+    X = self.X[rows].dot(self.A_transpose) + U.dot(self.B_transpose)
+    Y = X.dot(self.C_transpose) + U.dot(self.D_transpose)
+    self.X[rows] = X
+    self.Y[rows] = Y
+    return Y
+
+
+class _Request(object):
+  """A step or function call waiting for the batcher."""
+
+  def __init__(self, bank=None, row=None, U=None, function=None):
+    self.bank = bank
+    self.row = row
+    self.U = U
+    self.function = function
+    self.Y = None
+    self.error = None
+    self.done = threading.Event()
+
+  def Wait(self):
+    """Waits for the batcher, and returns Y or raises its exception."""
+    self.done.wait()
+    if self.error is not None:
+      raise self.error
+    return self.Y
+
+
+class StepBatcher(object):
+  """Steps every waiting request on one thread, batched by plant.
+
+  Handlers call Step or Call, which queue a step or function call and wait for
+  it.  The banks are only touched from the batcher thread, so they need no
+  locks.  Exceptions are raised in the waiting handler, and a batch which
+  fails is stepped again one robot at a time, so only the bad requests fail.
+  Stop finishes the queued requests and ends the thread.
+
+  Attributes:
+    num_batches: int, The number of batches stepped.
+    num_steps: int, The number of robot steps in them.
+  """
+
+  def __init__(self):
+    self._queue = Queue.Queue()
+    # Guards _stopped, so nothing is queued after the stop marker.
+    self._lock = threading.Lock()
+    self._stopped = False
+    self.num_batches = 0
+    self.num_steps = 0
+    self._thread = threading.Thread(target=self._Run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Step(self, bank, row, U):
+    """Steps one robot, batched with any other waiting steps.
+
+    Returns:
+      numpy.array(p), the new output.
+    """
+    return self._Submit(_Request(bank, row, U))
+
+  def Call(self, function, *args):
+    """Runs function(*args) on the batcher thread, and returns the result."""
+    return self._Submit(_Request(function=lambda: function(*args)))
+
+  def Stop(self):
+    """Finishes the queued requests, and waits for the thread to exit.
+
+    Later calls to Step and Call raise RuntimeError.  Stopping twice is fine.
+    """
+    with self._lock:
+      if not self._stopped:
+        self._stopped = True
+        # None marks the end of the queue.
+        self._queue.put(None)
+    self._thread.join()
+
+  def _Submit(self, request):
+    """Queues request and waits for it to be done."""
+    with self._lock:
+      if self._stopped:
+        raise RuntimeError('The step batcher is stopped')
+      self._queue.put(request)
+    return request.Wait()
+
+  def _Run(self):
+    stopping = False
+    while not stopping:
+      requests = [self._queue.get()]
+      while True:
+        try:
+          requests.append(self._queue.get_nowait())
+        except Queue.Empty:
+          break
+      # Nothing is queued after the stop marker, so it is always last.
+      if requests[-1] is None:
+        requests.pop()
+        stopping = True
+
+      batches = {}
+      for request in requests:
+        if request.function is not None:
+          try:
+            request.Y = request.function()
+          except Exception as e:
+            request.error = e
+          request.done.set()
+        else:
+          batches.setdefault(request.bank, []).append(request)
+
+      for bank, batch in batches.iteritems():
+        try:
+          self._StepBatch(bank, batch)
+        except Exception:
+          # Bank.Step doesn't change any state unless it succeeds, so the
+          # robots can be stepped again on their own.
+          for request in batch:
+            try:
+              self._StepBatch(bank, [request])
+            except Exception as e:
+              request.error = e
+        for request in batch:
+          request.done.set()
+
+  def _StepBatch(self, bank, batch):
+    """Steps the requests of batch, which all use bank, and stores Y."""
+    Y = bank.Step(numpy.array([request.row for request in batch]),
+                  numpy.array([request.U for request in batch]))
+    self.num_batches += 1
+    self.num_steps += len(batch)
+    for request, y in zip(batch, Y):
+      request.Y = y
+
+
+class _PlantHandler(SocketServer.StreamRequestHandler):
+  """Serves one simulated robot for the life of a connection."""
+
+  def handle(self):
+    batcher = self.server.batcher
+    banks = self.server.banks
+    rows = {}
+    try:
+      for line in iter(self.rfile.readline, ''):
+        try:
+          reply = self._Handle(json.loads(line), banks, rows, batcher)
+        except Exception as e:
+          # Anything raised by a request, here or on the batcher thread, is
+          # reported to the robot, which can keep going.
+          reply = {'error': str(e)}
+        self.wfile.write(json.dumps(reply) + '\n')
+        self.wfile.flush()
+    finally:
+      for name, row in rows.iteritems():
+        batcher.Call(banks[name].Release, row)
+
+  def _Handle(self, request, banks, rows, batcher):
+    name = request['plant']
+    if name not in banks:
+      raise KeyError('Unknown plant %s' % name)
+    bank = banks[name]
+    if name not in rows:
+      rows[name] = batcher.Call(bank.Allocate)
+
+    if request.get('reset'):
+      batcher.Call(bank.Reset, rows[name])
+      return {'Y': [0.0] * bank.Y.shape[1]}
+
+    U = numpy.array(request['U'], dtype=numpy.float64).reshape(-1)
+    if U.shape[0] != bank.num_inputs:
+      raise ValueError('%s expects %d inputs, got %d' % (
+          name, bank.num_inputs, U.shape[0]))
+    return {'Y': batcher.Step(bank, rows[name], U).tolist()}
+
+
+class _ThreadingUnixStreamServer(SocketServer.ThreadingMixIn,
+                                 SocketServer.UnixStreamServer):
+  daemon_threads = True
+
+  def server_close(self):
+    SocketServer.UnixStreamServer.server_close(self)
+    self.batcher.Stop()
+
+
+class _ThreadingTCPServer(SocketServer.ThreadingMixIn,
+                          SocketServer.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def server_close(self):
+    SocketServer.TCPServer.server_close(self)
+    self.batcher.Stop()
+
+
+def MakeServer(address, loops):
+  """Makes a server hosting the plants of loops.
+
+  Args:
+    address: string or (host, port), A Unix socket path, or a TCP address.
+    loops: array[ControlLoop], The plants to host, by name.
+
+  Raises:
+    ValueError: Two loops have the same name.
+
+  Returns:
+    SocketServer.BaseServer, the server.  Call serve_forever to run it, and
+      server_close to stop its StepBatcher.
+  """
+  names = [loop._name for loop in loops]
+  duplicates = sorted(set(name for name in names if names.count(name) > 1))
+  if duplicates:
+    raise ValueError('Plants must have unique names, got %s more than once' %
+                     ', '.join(duplicates))
+
+  if isinstance(address, basestring):
+    if os.path.exists(address):
+      os.unlink(address)
+    server = _ThreadingUnixStreamServer(address, _PlantHandler)
+  else:
+    server = _ThreadingTCPServer(address, _PlantHandler)
+  server.banks = dict((loop._name, PlantBank(loop)) for loop in loops)
+  server.batcher = StepBatcher()
+  return server
+
+
+class PlantClient(object):
+  """Talks to a plant server as one simulated robot."""
+
+  def __init__(self, address):
+    """Connects to the server at address, a socket path or (host, port)."""
+    if isinstance(address, basestring):
+      self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+      self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self._socket.connect(address)
+    self._file = self._socket.makefile('rwb')
+
+  def _Call(self, request):
+    self._file.write(json.dumps(request) + '\n')
+    self._file.flush()
+    reply = json.loads(self._file.readline())
+    if 'error' in reply:
+      raise ValueError(reply['error'])
+    return reply['Y']
+
+  def Step(self, plant, U):
+    """Steps the plant with U, a list of inputs, and returns its output."""
+    return self._Call({'plant': plant, 'U': list(U)})
+
+  def Reset(self, plant):
+    """Zeros the state of the plant."""
+    return self._Call({'plant': plant, 'reset': True})
+
+  def Close(self):
+    self._file.close()
+    self._socket.close()
+
+
+def main(argv):
+  if len(argv) != 2:
+    print "Expected a Unix socket path or host:port to listen on"
+    quit()
+
+  if ':' in argv[1]:
+    host, port = argv[1].rsplit(':', 1)
+    address = (host, int(port))
+  else:
+    address = argv[1]
+
+  import shooter
+  import transfer
+  server = MakeServer(address, [shooter.Shooter(),
+                                shooter.ShooterDeltaU(name='ShooterDeltaU'),
+                                transfer.Transfer()])
+  print "Serving %s on %s" % (', '.join(sorted(server.banks)), argv[1])
+  try:
+    server.serve_forever()
+  finally:
+    server.server_close()
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
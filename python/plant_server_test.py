@@ -0,0 +1,123 @@
+#!/usr/bin/python
+
+import control_loop_test
+import numpy
+from numpy.testing import *
+import os
+import plant_server
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class TestPlantServer(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.address = os.path.join(self.directory, 'plant.sock')
+    self.server = plant_server.MakeServer(
+        self.address, [control_loop_test.MakeLoop('Left', 1.0)])
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.thread.join()
+    self.server.server_close()
+    self.assertFalse(self.server.batcher._thread.is_alive())
+    shutil.rmtree(self.directory)
+
+  def test_ConcurrentRobots(self):
+    """Tests that concurrent robots each match a ControlLoop."""
+    errors = []
+
+    def Robot(index):
+      loop = control_loop_test.MakeLoop('Left', 1.0)
+      client = plant_server.PlantClient(self.address)
+      try:
+        for step in xrange(50):
+          U = numpy.matrix([[float(index + step % 7) - 3.0]])
+          Y = client.Step('Left', [U[0, 0]])
+          loop.Update(U)
+          assert_almost_equal(Y, loop.Y.T.tolist()[0])
+      except AssertionError as e:
+        errors.append(e)
+      finally:
+        client.Close()
+
+    threads = [threading.Thread(target=Robot, args=(i,)) for i in xrange(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual([], errors)
+    self.assertEqual(8 * 50, self.server.batcher.num_steps)
+
+  def test_Errors(self):
+    """Tests that bad requests are reported without dropping the robot."""
+    client = plant_server.PlantClient(self.address)
+    self.assertRaises(ValueError, client.Step, 'Right', [1.0])
+    self.assertRaises(ValueError, client.Step, 'Left', [1.0, 2.0])
+    client.Step('Left', [1.0])
+    self.assertEqual([0.0], client.Reset('Left'))
+    client.Close()
+
+  def test_FailedStepDoesNotHang(self):
+    """Tests that a request which fails to step gets an error, not a hang."""
+    bank = self.server.banks['Left']
+    step = bank.Step
+
+    def FailingStep(rows, U):
+      if (U == 99.0).any():
+        raise RuntimeError('Plant failed')
+      return step(rows, U)
+    bank.Step = FailingStep
+
+    replies = []
+
+    def Robot(U):
+      client = plant_server.PlantClient(self.address)
+      try:
+        client.Step('Left', [U])
+        replies.append('ok')
+      except ValueError as e:
+        replies.append(str(e))
+      finally:
+        client.Close()
+
+    threads = [threading.Thread(target=Robot, args=(U,))
+               for U in [1.0, 99.0, 2.0]]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join(5.0)
+      self.assertFalse(thread.is_alive())
+    self.assertEqual(['Plant failed', 'ok', 'ok'], sorted(replies))
+
+    self.assertRaises(ZeroDivisionError, self.server.batcher.Call,
+                      lambda: 1 / 0)
+    client = plant_server.PlantClient(self.address)
+    self.assertEqual(1, len(client.Step('Left', [1.0])))
+    client.Close()
+
+  def test_StopBatcher(self):
+    """Tests that a stopped batcher ends its thread and refuses new work."""
+    batcher = plant_server.StepBatcher()
+    self.assertEqual(3, batcher.Call(lambda x: x + 1, 2))
+    batcher.Stop()
+    self.assertFalse(batcher._thread.is_alive())
+    self.assertRaises(RuntimeError, batcher.Call, lambda: None)
+    batcher.Stop()
+
+  def test_DuplicateNames(self):
+    """Tests that plants with the same name are rejected."""
+    self.assertRaises(ValueError, plant_server.MakeServer,
+                      os.path.join(self.directory, 'duplicate.sock'),
+                      [control_loop_test.MakeLoop('Left', 1.0),
+                       control_loop_test.MakeLoop('Left', 2.0)])
+
+
+if __name__ == '__main__':
+  unittest.main()
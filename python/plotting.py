@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+"""
+Plotting helpers for comparing simulations with reality.
+
+Matplotlib is only imported once a plot is actually made, so generating gains
+doesn't pay for it.  Plots can be written to a file instead of shown, which
+doesn't need a display.  Long series are decimated by keeping the min and max
+of each bucket of samples, which keeps the peaks while plotting a few thousand
+points instead of millions.
+"""
+
+import math
+import numpy
+
+# The default maximum number of points plotted per series.
+DEFAULT_MAX_POINTS = 4000
+
+
+def ExtractPlotFlags(argv):
+  """Removes the plotting flags from a command line.
+
+  --noplot disables plotting, and --plot_file=<file> writes the plot to a file
+  instead of showing it.
+
+  Args:
+    argv: array[string], The command line.
+
+  Returns:
+    (argv, enabled, filename), the command line without the plotting flags,
+      whether to plot, and the file to plot to or None to show the plot.
+  """
+  remaining_argv = []
+  enabled = True
+  filename = None
+  for arg in argv:
+    if arg == '--noplot':
+      enabled = False
+    elif arg.startswith('--plot_file='):
+      filename = arg[len('--plot_file='):]
+    else:
+      remaining_argv.append(arg)
+  return remaining_argv, enabled, filename
+
+
+def Decimate(x, y, max_points=DEFAULT_MAX_POINTS):
+  """Reduces a series to the min and max sample of each bucket of samples.
+
+  Args:
+    x: array(n), The x coordinates.
+    y: array(n), The y coordinates.
+    max_points: int, The maximum number of points to return.
+
+  Raises:
+    ValueError: max_points is less than 2, which can't hold a min and a max.
+
+  Returns:
+    (x, y), numpy.array, the decimated series in the original order.  Series
+      with no more than max_points points are returned unmodified.
+  """
+  if max_points < 2:
+    raise ValueError('max_points must be at least 2, got %d.' % max_points)
+  x = numpy.asarray(x)
+  y = numpy.asarray(y)
+  num_points = y.shape[0]
+  if num_points <= max_points:
+    return x, y
+
+  num_buckets = max_points // 2
+  bucket_size = int(math.ceil(float(num_points) / num_buckets))
+  num_full_buckets = num_points // bucket_size
+  full_length = num_full_buckets * bucket_size
+
+  buckets = y[:full_length].reshape((num_full_buckets, bucket_size))
+  offsets = numpy.arange(num_full_buckets) * bucket_size
+  indices = [offsets + numpy.argmin(buckets, axis=1),
+             offsets + numpy.argmax(buckets, axis=1)]
+
+  if full_length < num_points:
+    remainder = y[full_length:]
+    indices.append(numpy.array([full_length + numpy.argmin(remainder),
+                                full_length + numpy.argmax(remainder)]))
+
+  # numpy.unique also sorts, which puts the min and max back in time order.
+  indices = numpy.unique(numpy.concatenate(indices))
+  return x[indices], y[indices]
+
+
+def _Pylab(headless):
+  """Imports and returns pylab, using a non-interactive backend if headless.
+
+  pylab may already be imported with an interactive backend, like in the
+  gen_daemon.py process, so the backend is switched rather than chosen.
+  """
+  from matplotlib import pylab
+  if headless:
+    pylab.switch_backend('Agg')
+  return pylab
+
+
+def Plot(series, filename=None, max_points=DEFAULT_MAX_POINTS, title=None):
+  """Plots a list of series on one set of axes.
+
+  Args:
+    series: array[(x, y, label)], The series to plot.
+    filename: string, The file to write the plot to.  If None, the plot is
+      shown instead.
+    max_points: int, The maximum number of points to plot per series.
+    title: string, The title of the plot, or None.
+  """
+  pylab = _Pylab(headless=filename is not None)
+  figure = pylab.figure()
+  for x, y, label in series:
+    decimated_x, decimated_y = Decimate(x, y, max_points)
+    pylab.plot(decimated_x, decimated_y, label=label)
+  if title:
+    pylab.title(title)
+  pylab.legend()
+
+  if filename is None:
+    pylab.show()
+  else:
+    figure.savefig(filename)
+    pylab.close(figure)
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+import numpy
+from numpy.testing import *
+import os
+import plotting
+import shutil
+import tempfile
+import unittest
+
+
+class TestDecimate(unittest.TestCase):
+  def setUp(self):
+    random = numpy.random.RandomState(4)
+    self.x = numpy.cumsum(random.uniform(0.5, 1.5, 10001))
+    self.y = random.randn(10001)
+
+  def CheckDecimated(self, x, y, max_points):
+    """Decimates x and y to max_points, and checks the result."""
+    decimated_x, decimated_y = plotting.Decimate(x, y, max_points)
+    self.assertLessEqual(len(decimated_y), max_points)
+    self.assertEqual(len(decimated_x), len(decimated_y))
+    self.assertTrue((numpy.diff(decimated_x) > 0.0).all())
+    # Every point is one of the originals.
+    indices = numpy.searchsorted(x, decimated_x)
+    assert_array_equal(x[indices], decimated_x)
+    assert_array_equal(y[indices], decimated_y)
+    return decimated_x, decimated_y, indices
+
+  def test_KeepsPeaks(self):
+    """Tests that the min and max of every bucket are kept."""
+    _, decimated_y, indices = self.CheckDecimated(self.x, self.y, 1000)
+    self.assertEqual(self.y.max(), decimated_y.max())
+    self.assertEqual(self.y.min(), decimated_y.min())
+    bucket_size = int(numpy.ceil(len(self.y) / 500.0))
+    for start in xrange(0, len(self.y), bucket_size):
+      bucket = self.y[start:start + bucket_size]
+      kept = decimated_y[(indices >= start) & (indices < start + bucket_size)]
+      self.assertIn(bucket.max(), kept)
+      self.assertIn(bucket.min(), kept)
+
+  def test_Lengths(self):
+    """Tests odd lengths and limits, and series shorter than the limit."""
+    for length in [2, 3, 999, 1000, 1001, 10001]:
+      for max_points in [2, 3, 7, 1000, 1001]:
+        self.CheckDecimated(self.x[:length], self.y[:length], max_points)
+
+    decimated_x, decimated_y = plotting.Decimate(self.x[:11], self.y[:11], 20)
+    assert_array_equal(self.x[:11], decimated_x)
+    assert_array_equal(self.y[:11], decimated_y)
+
+  def test_TooFewPoints(self):
+    """Tests that a limit too small for a min and a max is rejected."""
+    self.assertRaises(ValueError, plotting.Decimate, self.x, self.y, 1)
+
+
+class TestPlot(unittest.TestCase):
+  def test_PlotFile(self):
+    """Tests that plotting to a file switches an interactive backend off."""
+    from matplotlib import pylab
+    pylab.switch_backend('TkAgg')
+    directory = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(directory, 'plot.png')
+      plotting.Plot([(numpy.arange(10), numpy.arange(10) ** 2, 'Square')],
+                    filename=filename)
+      self.assertTrue(os.path.getsize(filename) > 0)
+    finally:
+      shutil.rmtree(directory)
+    self.assertEqual('agg', pylab.get_backend().lower())
+
+
+if __name__ == '__main__':
+  unittest.main()
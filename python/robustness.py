@@ -0,0 +1,271 @@
+#!/usr/bin/python
+
+"""
+Monte Carlo robustness analysis over physical parameter uncertainty.
+
+Samples the physical parameters (J, R, Kt, Kv, G) of a loop, rebuilds and
+discretizes every sampled plant at once, and runs the loop's fixed K and L
+against all of them.  The samples are split across a process pool, and each
+process analyzes its share with vectorized operations.
+"""
+
+import multiprocessing
+import sys
+
+import controls
+import numpy
+import step_metrics
+
+# The default relative standard deviation of each physical parameter.
+DEFAULT_UNCERTAINTY = {
+    'J': 0.10,
+    'R': 0.15,
+    'Kt': 0.05,
+    'Kv': 0.05,
+    'G': 0.0,
+}
+
+# Spectral radii at or above this are unstable.
+UNSTABLE_RADIUS = 1.0
+
+
+def SampleParameters(loop, num_samples, uncertainty=None, seed=None):
+  """Samples the physical parameters of a loop from normal distributions.
+
+  Args:
+    loop: ControlLoop, The loop with the nominal parameters as attributes.
+    num_samples: int, The number of samples.
+    uncertainty: dict, The relative standard deviation of each parameter,
+      keyed by attribute name.  If None, DEFAULT_UNCERTAINTY is used.
+    seed: int, The random seed, or None.
+
+  Returns:
+    dict, numpy.array(num_samples) of samples keyed by attribute name.  Samples
+      are kept above 1% of nominal so the plants stay physical.
+  """
+  if uncertainty is None:
+    uncertainty = DEFAULT_UNCERTAINTY
+  random = numpy.random.RandomState(seed)
+  parameters = {}
+  for name in sorted(uncertainty):
+    nominal = getattr(loop, name)
+    samples = random.normal(nominal, abs(nominal) * uncertainty[name],
+                            num_samples)
+    parameters[name] = numpy.maximum(samples, 0.01 * nominal)
+  return parameters
+
+
+def ClosedLoopA(loop, A, B):
+  """Returns the closed loop A matrices of sampled plants with loop's K and L.
+
+  The state is [X; X_hat], the plant and the observer's estimate of it, with
+  U = -K X_hat.
+
+  Args:
+    loop: ControlLoop, The designed loop.
+    A: numpy.array(N x n x n), The discrete time A of each sampled plant.
+    B: numpy.array(N x n x m), The discrete time B of each sampled plant.
+
+  Returns:
+    numpy.array(N x 2n x 2n), the closed loop A matrices.
+  """
+  num_states = loop.A.shape[0]
+  K = numpy.asarray(loop.K)
+  L = numpy.asarray(loop.L)
+  C = numpy.asarray(loop.C)
+
+  closed_loop = numpy.zeros((A.shape[0], 2 * num_states, 2 * num_states))
+  closed_loop[:, :num_states, :num_states] = A
+  closed_loop[:, :num_states, num_states:] = -numpy.einsum('kij,jl->kil',
+                                                           B, K)
+  closed_loop[:, num_states:, :num_states] = L.dot(C)
+  closed_loop[:, num_states:, num_states:] = numpy.asarray(
+      loop.A - loop.B * loop.K - loop.L * loop.C)
+  return closed_loop
+
+
+def SimulateStep(loop, A, B, goal, num_steps):
+  """Simulates the loop's controller driving every sampled plant to goal.
+
+  Steps like transfer.main: U = clip(K (R - X_hat)), then UpdateObserver(U) and
+  Update(U), using the loop's nominal model in the observer.
+
+  Args:
+    loop: ControlLoop, The designed loop.
+    A: numpy.array(N x n x n), The discrete time A of each sampled plant.
+    B: numpy.array(N x n x m), The discrete time B of each sampled plant.
+    goal: numpy.matrix(n x 1), The goal state R.
+    num_steps: int, The number of steps to simulate.
+
+  Returns:
+    (Y, U), numpy.array(N x num_steps), the first output and the first input
+      of each plant at each step.
+  """
+  A_hat = numpy.asarray(loop.A)
+  B_hat = numpy.asarray(loop.B)
+  C = numpy.asarray(loop.C)
+  D = numpy.asarray(loop.D)
+  K = numpy.asarray(loop.K)
+  L = numpy.asarray(loop.L)
+  U_max = numpy.asarray(loop.U_max).T
+  U_min = numpy.asarray(loop.U_min).T
+  R = numpy.asarray(goal).T
+
+  num_samples = A.shape[0]
+  X = numpy.zeros((num_samples, A_hat.shape[0]))
+  X_hat = numpy.zeros((num_samples, A_hat.shape[0]))
+  Y = numpy.zeros((num_samples, C.shape[0]))
+
+  outputs = numpy.zeros((num_samples, num_steps))
+  inputs = numpy.zeros((num_samples, num_steps))
+  for step in xrange(num_steps):
+    U = numpy.clip((R - X_hat).dot(K.T), U_min, U_max)
+    X_hat = (X_hat.dot(A_hat.T) + U.dot(B_hat.T) +
+             (Y - X_hat.dot(C.T) - U.dot(D.T)).dot(L.T))
+    X = numpy.einsum('kij,kj->ki', A, X) + numpy.einsum('kij,kj->ki', B, U)
+    Y = X.dot(C.T) + U.dot(D.T)
+    outputs[:, step] = Y[:, 0]
+    inputs[:, step] = U[:, 0]
+  return outputs, inputs
+
+
+def BatchPlant(loop, parameters):
+  """Returns the discrete time A and B of the loop for each parameter sample.
+
+  Loops augmented in discrete time, like shooter.ShooterDeltaU, have
+  BatchDiscretePlant.  Everything else has BatchContinuousPlant, which is
+  discretized with the loop's dt.
+
+  Args:
+    loop: ControlLoop, The designed loop.
+    parameters: dict, The sampled parameters from SampleParameters.
+
+  Returns:
+    (A, B), numpy.array(N x n x n) and numpy.array(N x n x m), one plant per
+      sample.
+  """
+  if hasattr(loop, 'BatchDiscretePlant'):
+    return loop.BatchDiscretePlant(parameters)
+  A_continuous, B_continuous = loop.BatchContinuousPlant(parameters)
+  return controls.batch_c2d(A_continuous, B_continuous, loop.dt)
+
+
+def Analyze(loop, parameters, goal, num_steps):
+  """Analyzes the loop against every sampled plant, vectorized.
+
+  Args:
+    loop: ControlLoop, The designed loop.  See BatchPlant.
+    parameters: dict, The sampled parameters from SampleParameters.
+    goal: numpy.matrix(n x 1), The goal state of the step.
+    num_steps: int, The length of the step response.
+
+  Returns:
+    dict, numpy.array with one entry per sample of the closed loop eigenvalues,
+      spectral_radius and the metrics from step_metrics.StepMetrics.
+  """
+  A, B = BatchPlant(loop, parameters)
+
+  eigenvalues = numpy.linalg.eigvals(ClosedLoopA(loop, A, B))
+  outputs, _ = SimulateStep(loop, A, B, goal, num_steps)
+
+  results = step_metrics.StepMetrics(outputs, (loop.C * goal)[0, 0], loop.dt)
+  results['eigenvalues'] = eigenvalues
+  results['spectral_radius'] = numpy.abs(eigenvalues).max(axis=1)
+  return results
+
+
+def _AnalyzeChunk(arguments):
+  """Pool entry point for Analyze."""
+  return Analyze(*arguments)
+
+
+def RunMonteCarlo(loop, goal, num_samples, num_steps=200, uncertainty=None,
+                  processes=None, seed=None):
+  """Samples the parameters of loop and analyzes the samples in parallel.
+
+  Args:
+    loop: ControlLoop, The designed loop.  See BatchPlant.
+    goal: numpy.matrix(n x 1), The goal state of the step.
+    num_samples: int, The number of samples.
+    num_steps: int, The length of the step response.
+    uncertainty: dict, See SampleParameters.
+    processes: int, The number of worker processes.  If None, one per cpu.
+    seed: int, The random seed, or None.
+
+  Returns:
+    (parameters, results), the sampled parameters and the results from
+      Analyze, concatenated across the workers.
+  """
+  parameters = SampleParameters(loop, num_samples, uncertainty, seed)
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+  chunks = numpy.array_split(numpy.arange(num_samples), processes)
+  work = [(loop, dict((name, values[chunk])
+                      for name, values in parameters.iteritems()),
+           goal, num_steps)
+          for chunk in chunks if len(chunk)]
+
+  pool = multiprocessing.Pool(processes=processes)
+  try:
+    chunk_results = pool.map(_AnalyzeChunk, work)
+  finally:
+    pool.close()
+    pool.join()
+
+  results = dict((name, numpy.concatenate([result[name]
+                                           for result in chunk_results]))
+                 for name in chunk_results[0])
+  return parameters, results
+
+
+def FormatReport(results):
+  """Formats the distribution of the results as a table of percentiles."""
+  percentiles = [5, 50, 95]
+  lines = ['%-20s %12s %12s %12s %12s' % (
+      ('metric',) + tuple('p%d' % p for p in percentiles) + ('worst',))]
+  for name, worst in [('spectral_radius', numpy.max),
+                      ('rise_time', numpy.max),
+                      ('overshoot', numpy.max),
+                      ('settling_time', numpy.max),
+                      ('steady_state_error', lambda x: x[numpy.argmax(
+                          numpy.abs(x))])]:
+    values = results[name]
+    finite = values[numpy.isfinite(values)]
+    if len(finite) == 0:
+      lines.append('%-20s %12s' % (name, 'never'))
+      continue
+    lines.append('%-20s %12.6g %12.6g %12.6g %12.6g' % (
+        (name,) + tuple(numpy.percentile(finite, percentiles)) +
+        (worst(finite),)))
+    if len(finite) != len(values):
+      lines.append('%-20s %d samples never got there' % (
+          '', len(values) - len(finite)))
+
+  num_unstable = numpy.sum(results['spectral_radius'] >= UNSTABLE_RADIUS)
+  lines.append('')
+  lines.append('%d of %d samples unstable' % (
+      num_unstable, len(results['spectral_radius'])))
+  return '\n'.join(lines) + '\n'
+
+
+def main(argv):
+  if len(argv) not in (2, 3) or argv[1] not in ('shooter', 'transfer'):
+    print "Expected shooter or transfer and an optional number of samples"
+    quit()
+
+  if argv[1] == 'shooter':
+    import shooter
+    loop = shooter.Shooter()
+    goal = numpy.matrix([[300.0]])
+  else:
+    import transfer
+    loop = transfer.Transfer()
+    goal = numpy.matrix([[1.0], [0.0]])
+
+  num_samples = int(argv[2]) if len(argv) == 3 else 10000
+  _, results = RunMonteCarlo(loop, goal, num_samples)
+  sys.stdout.write(FormatReport(results))
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+import controls
+import numpy
+from numpy.testing import *
+import robustness
+import shooter
+import unittest
+
+
+class TestRobustness(unittest.TestCase):
+  def setUp(self):
+    self.loop = shooter.Shooter()
+
+  def test_NominalMatchesLoop(self):
+    """Tests that unperturbed samples rebuild the designed plant."""
+    uncertainty = dict((name, 0.0)
+                       for name in robustness.DEFAULT_UNCERTAINTY)
+    parameters = robustness.SampleParameters(self.loop, 3, uncertainty)
+    A_continuous, B_continuous = self.loop.BatchContinuousPlant(parameters)
+    A, B = controls.batch_c2d(A_continuous, B_continuous, self.loop.dt)
+    for i in xrange(3):
+      assert_almost_equal(A[i], self.loop.A)
+      assert_almost_equal(B[i], self.loop.B)
+
+    closed_loop = robustness.ClosedLoopA(self.loop, A, B)
+    expected = numpy.sort_complex(numpy.concatenate((
+        numpy.linalg.eigvals(self.loop.A - self.loop.B * self.loop.K),
+        numpy.linalg.eigvals(self.loop.A - self.loop.L * self.loop.C))))
+    assert_almost_equal(
+        numpy.sort_complex(numpy.linalg.eigvals(closed_loop[0])), expected)
+
+  def test_DeltaUNominalMatchesLoop(self):
+    """Tests that unperturbed samples rebuild the augmented delta U plant."""
+    loop = shooter.ShooterDeltaU()
+    uncertainty = dict((name, 0.0)
+                       for name in robustness.DEFAULT_UNCERTAINTY)
+    parameters = robustness.SampleParameters(loop, 2, uncertainty)
+    A, B = robustness.BatchPlant(loop, parameters)
+    for i in xrange(2):
+      assert_almost_equal(A[i], loop.A)
+      assert_almost_equal(B[i], loop.B)
+
+  def test_RunMonteCarlo(self):
+    """Tests that the workers' results are merged in sample order."""
+    goal = numpy.matrix([[300.0]])
+    parameters, results = robustness.RunMonteCarlo(
+        self.loop, goal, 50, num_steps=20, processes=2, seed=5)
+    self.assertEqual((50,), results['spectral_radius'].shape)
+
+    single = dict((name, values[40:41])
+                  for name, values in parameters.iteritems())
+    expected = robustness.Analyze(self.loop, single, goal, 20)
+    assert_almost_equal(results['spectral_radius'][40:41],
+                        expected['spectral_radius'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -3,12 +3,26 @@
 import numpy
 import math
 import sys
-from matplotlib import pylab
 import control_loop
+import controls
+import instrumentation
+import plotting
 
 class Shooter(control_loop.ControlLoop):
   def __init__(self, name="Shooter"):
     super(Shooter, self).__init__(name)
+    self._InitializePlant()
+
+    self.PlaceControllerPoles([.6])
+
+    self.rpl = .45
+    self.ipl = 0.07
+    self.PlaceObserverPoles([0.3])
+
+    self.InitializeState()
+
+  def _InitializePlant(self):
+    """Sets the physical constants, the discrete plant and the input limits."""
     # Stall Torque in N m
     self.stall_torque = 1.4
     # Stall Current in Amps
@@ -42,34 +56,35 @@ class Shooter(control_loop.ControlLoop):
     self.A, self.B = self.ContinuousToDiscrete(
         self.A_continuous, self.B_continuous, self.dt)
 
-    self.PlaceControllerPoles([.6])
-
-    self.rpl = .45
-    self.ipl = 0.07
-    self.PlaceObserverPoles([0.3])
-
     self.U_max = numpy.matrix([[12.0]])
     self.U_min = numpy.matrix([[-2.0]])
 
-    self.InitializeState()
+  def BatchContinuousPlant(self, parameters):
+    """Returns the continuous time A and B for arrays of physical parameters.
 
-class ShooterDeltaU(Shooter):
-  def __init__(self, name="Shooter"):
-    super(ShooterDeltaU, self).__init__(name)
-    A_unaugmented = self.A
-    B_unaugmented = self.B
-
-    self.A = numpy.matrix([[1.0, 0.0],
-                           [0.0, 0.0]])
-    self.A[1:2, 1:2] = A_unaugmented
-    self.A[1:2, 0:1] = B_unaugmented
+    Args:
+      parameters: dict, Arrays of J, R, Kt, Kv and G.  Missing parameters use
+        the values from the constructor.
 
-    self.B = numpy.matrix([[1.0],
-                           [0.0]])
-   #self.B[1:2, 0:1] = B_unaugmented
+    Returns:
+      (A, B), numpy.array(N x 1 x 1), one plant per parameter sample.
+    """
+    J, R, Kt, Kv, G = self._BatchParameters(parameters,
+                                            ['J', 'R', 'Kt', 'Kv', 'G'])
+    A = (-Kt / Kv / (J * G * G * R)).reshape((-1, 1, 1))
+    B = (Kt / (J * G * R)).reshape((-1, 1, 1))
+    return A, B
 
-    self.C = numpy.matrix([[0.0, 1.0]])
-    self.D = numpy.matrix([[0.0]])
+class ShooterDeltaU(Shooter):
+  def __init__(self, name="Shooter"):
+    # Skips the design in Shooter.__init__, since only the plant is augmented.
+    super(Shooter, self).__init__(name)
+    self._InitializePlant()
+    augmented = self.AugmentDeltaU()
+    self.A = augmented.A
+    self.B = augmented.B
+    self.C = augmented.C
+    self.D = augmented.D
 
     self.PlaceControllerPoles([0.7, 0.32])
 
@@ -89,45 +104,111 @@ class ShooterDeltaU(Shooter):
 
     self.InitializeState()
 
+  def BatchDiscretePlant(self, parameters):
+    """Returns the discrete time A and B for arrays of physical parameters.
 
-def main(argv):
-  if len(argv) != 4:
-    print "Expected step response csv and .java file names"
-    quit()
+    The plain shooter plant of each sample is discretized, then augmented like
+    AugmentDeltaU.  The delta U augmentation only exists in discrete time, so
+    robustness.BatchPlant uses this instead of BatchContinuousPlant.
 
-  # Simulate the response of the system to a step input.
-  shooter_data = numpy.genfromtxt(argv[1], delimiter=',')
-  shooter = Shooter()
-  simulated_v = []
-  real_x = []
+    Args:
+      parameters: dict, Arrays of J, R, Kt, Kv and G.  Missing parameters use
+        the values from the constructor.
+
+    Returns:
+      (A, B), numpy.array(N x 2 x 2) and numpy.array(N x 2 x 1), one plant per
+        parameter sample.
+    """
+    A_continuous, B_continuous = super(
+        ShooterDeltaU, self).BatchContinuousPlant(parameters)
+    A_plant, B_plant = controls.batch_c2d(A_continuous, B_continuous, self.dt)
+    A = numpy.zeros((A_plant.shape[0], 2, 2))
+    A[:, 0, 0] = 1.0
+    A[:, 1:, :1] = B_plant
+    A[:, 1:, 1:] = A_plant
+    B = numpy.zeros((A_plant.shape[0], 2, 1))
+    B[:, 0, 0] = 1.0
+    return A, B
+
+
+def ReadStepResponse(filename):
+  """Reads a step response log.
+
+  Args:
+    filename: string, The CSV file to read.  See the README for the format.
+
+  Returns:
+    numpy.array(n x 4), one row per sample.
+  """
+  return numpy.genfromtxt(filename, delimiter=',')
+
+
+def SimulateStepResponse(shooter, shooter_data):
+  """Replays the logged control signal through the shooter model.
+
+  Args:
+    shooter: Shooter, The model to simulate.  Its state is updated.
+    shooter_data: numpy.array(n x 4), The log from ReadStepResponse.
+
+  Returns:
+    (voltage, simulated_v, real_v), lists of the applied voltage, the simulated
+      velocity after each step and the measured velocity, both in rad/s.
+  """
   voltage = []
-  x_vel = []
-  initial_t = shooter_data[0, 0]
+  simulated_v = []
+  real_v = []
+  stepper = shooter.Stepper()
   for i in xrange(shooter_data.shape[0]):
-    voltage.append(shooter_data[i, 1] * 12.0 * 10)
-    shooter.Update(numpy.matrix([[shooter_data[i, 1] * 12.0]]))
-    simulated_v.append(shooter.X[0, 0])
-    real_x.append(shooter_data[i, 2] * 2.0 * math.pi / 60.0)
+    voltage.append(shooter_data[i, 1] * 12.0)
+    stepper.Update(shooter_data[i, 1] * 12.0)
+    simulated_v.append(stepper.State(0))
+    real_v.append(shooter_data[i, 2] * 2.0 * math.pi / 60.0)
+  stepper.CopyStateTo(shooter)
+  return voltage, simulated_v, real_v
 
-  pylab.plot(range(shooter_data.shape[0]),
-             voltage, label='Voltage')
-  offset = 1
-  pylab.plot(range(offset, shooter_data.shape[0] + offset),
-             simulated_v, label='Simulation')
-  pylab.plot(range(shooter_data.shape[0]), real_x, label='Reality')
-  pylab.legend()
-  pylab.show()
 
+def main(argv):
+  argv, plot_enabled, plot_file = plotting.ExtractPlotFlags(argv)
+  argv, design_cache = control_loop.ExtractDesignCacheFlag(argv)
+  argv, instrument = instrumentation.ExtractInstrumentFlag(argv)
+  if len(argv) != 4:
+    print "Expected step response csv and .java file names"
+    quit()
 
+  if instrument:
+    instrumentation.Start()
+  if design_cache:
+    control_loop.LoadDesignCache(design_cache)
 
-  shooter = ShooterDeltaU()
+  # Simulate the response of the system to a step input.
+  if plot_enabled:
+    shooter_data = ReadStepResponse(argv[1])
+    shooter = control_loop.Model(Shooter)
+    voltage, simulated_v, real_x = SimulateStepResponse(shooter, shooter_data)
+
+    num_samples = shooter_data.shape[0]
+    offset = 1
+    # Scale the voltage up so it shows up next to the velocities.
+    plotting.Plot([(numpy.arange(num_samples),
+                    numpy.array(voltage) * 10, 'Voltage'),
+                   (numpy.arange(offset, num_samples + offset),
+                    simulated_v, 'Simulation'),
+                   (numpy.arange(num_samples), real_x, 'Reality')],
+                  filename=plot_file)
+
+  shooter = control_loop.Model(ShooterDeltaU)
   loop_writer = control_loop.ControlLoopWriter("Shooter", [shooter])
   loop_writer.Write(argv[2])
 
-  shooter = Shooter()
+  shooter = control_loop.Model(Shooter)
   loop_writer = control_loop.ControlLoopWriter("PlainShooter", [shooter])
   loop_writer.Write(argv[3])
 
+  if design_cache:
+    control_loop.SaveDesignCache(design_cache)
+  if instrument:
+    instrumentation.Finish()
+
 
 if __name__ == '__main__':
   sys.exit(main(sys.argv))
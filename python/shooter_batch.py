@@ -0,0 +1,236 @@
+#!/usr/bin/python
+
+"""
+Batch processing of shooter step response logs.
+
+Fits a first order model to every log in a directory or glob, replays the log
+through the Shooter model and scores both, fanning the logs out to a process
+pool.  The per-log results are merged into one summary table.  With
+--smooth, the first order model is fit to the RTS smoothed velocity instead of
+the measured one.  The smoother uses the Shooter model, so everything is still
+scored against the measured velocity.
+"""
+
+import glob
+import math
+import multiprocessing
+import os
+import sys
+
+import estimation
+import numpy
+import shooter
+
+# The columns of the summary table, in order.
+SUMMARY_COLUMNS = ['log', 'samples', 'duration', 'fit_a', 'fit_b', 'fit_tau',
+                   'fit_rms', 'model_rms', 'model_max_error']
+
+# The shooter model used by each worker process.  Built once per process.
+_shooter_model = None
+
+# True if each worker fits to the smoothed velocity.
+_smooth = False
+
+
+def FindLogs(pattern):
+  """Returns the sorted list of logs matching a directory or glob.
+
+  Args:
+    pattern: string, A directory (all the .csv files in it are used) or a glob.
+  """
+  if os.path.isdir(pattern):
+    pattern = os.path.join(pattern, '*.csv')
+  return sorted(glob.glob(pattern))
+
+
+def FitFirstOrder(voltage, velocity):
+  """Least squares fit of v(n + 1) = a v(n) + b u(n) to a log.
+
+  Args:
+    voltage: numpy.array(n), The applied voltage.
+    velocity: numpy.array(n), The measured velocity.
+
+  Returns:
+    (a, b), floats, the discrete time model.
+  """
+  regressors = numpy.column_stack((velocity[:-1], voltage[:-1]))
+  solution = numpy.linalg.lstsq(regressors, velocity[1:], rcond=-1)[0]
+  return solution[0], solution[1]
+
+
+def SimulateFirstOrder(a, b, voltage, initial_velocity):
+  """Simulates v(n + 1) = a v(n) + b u(n) over the provided voltages.
+
+  Returns:
+    numpy.array(n), the velocity after each step.
+  """
+  simulated_v = numpy.zeros(len(voltage))
+  v = initial_velocity
+  for i in xrange(len(voltage)):
+    v = a * v + b * voltage[i]
+    simulated_v[i] = v
+  return simulated_v
+
+
+def _Rms(error):
+  """Returns the root mean square of an array."""
+  return math.sqrt(numpy.mean(numpy.square(error)))
+
+
+def _InitWorker(smooth=False):
+  """Builds the shooter model once per worker process."""
+  global _shooter_model, _smooth
+  _shooter_model = shooter.Shooter()
+  _smooth = smooth
+
+
+def ProcessLog(filename):
+  """Fits, replays and scores a single step response log.
+
+  Args:
+    filename: string, The log to process.
+
+  Returns:
+    dict, one row of the summary table keyed by SUMMARY_COLUMNS.  If the log
+      could not be processed, the row only has 'log' and 'error' set.
+  """
+  global _shooter_model
+  if _shooter_model is None:
+    _InitWorker()
+
+  try:
+    return _ProcessLog(filename)
+  except Exception as e:
+    return {'log': filename, 'error': str(e)}
+
+
+def _ProcessLog(filename):
+  """Does the work of ProcessLog, raising if the log can't be processed."""
+  shooter_data = shooter.ReadStepResponse(filename)
+  if shooter_data.ndim != 2 or shooter_data.shape[0] < 3:
+    raise ValueError('Expected at least 3 samples')
+  _shooter_model.InitializeState()
+  voltage, simulated_v, real_v = shooter.SimulateStepResponse(
+      _shooter_model, shooter_data)
+
+  voltage = numpy.array(voltage)
+  simulated_v = numpy.array(simulated_v)
+  real_v = numpy.array(real_v)
+  if _smooth:
+    fit_velocity = estimation.SmoothShooterVelocity(
+        _shooter_model, voltage, real_v, shooter_data[:, 3])
+  else:
+    fit_velocity = real_v
+
+  # The simulated velocity after step n is measured at sample n + 1.
+  model_error = simulated_v[:-1] - real_v[1:]
+
+  fit_a, fit_b = FitFirstOrder(voltage, fit_velocity)
+  fit_v = SimulateFirstOrder(fit_a, fit_b, voltage, fit_velocity[0])
+  dt = numpy.mean(shooter_data[:, 3])
+  if 0.0 < fit_a < 1.0:
+    fit_tau = -dt / math.log(fit_a)
+  else:
+    fit_tau = float('nan')
+
+  return {
+      'log': filename,
+      'samples': shooter_data.shape[0],
+      'duration': shooter_data[-1, 0] - shooter_data[0, 0],
+      'fit_a': fit_a,
+      'fit_b': fit_b,
+      'fit_tau': fit_tau,
+      'fit_rms': _Rms(fit_v[:-1] - real_v[1:]),
+      'model_rms': _Rms(model_error),
+      'model_max_error': numpy.max(numpy.abs(model_error)),
+  }
+
+
+def ProcessLogs(filenames, processes=None, smooth=False):
+  """Processes all the logs in a process pool.
+
+  Args:
+    filenames: array[string], The logs to process.
+    processes: int, The number of worker processes.  If None, one per cpu.
+    smooth: boolean, If true, fit to the smoothed velocity.
+
+  Returns:
+    array[dict], the summary rows in the same order as filenames.
+  """
+  pool = multiprocessing.Pool(processes=processes, initializer=_InitWorker,
+                              initargs=(smooth,))
+  try:
+    return pool.map(ProcessLog, filenames)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _FormatValue(value):
+  """Formats a summary table cell."""
+  if isinstance(value, float):
+    return '%.6g' % value
+  return str(value)
+
+
+def FormatSummary(rows, csv=False):
+  """Formats the summary rows as a table, one log per line.
+
+  Args:
+    rows: array[dict], The rows from ProcessLogs.
+    csv: boolean, If true, format as CSV.  Otherwise, format as aligned text
+      with aggregate statistics and the logs which failed to process.
+  """
+  good_rows = [row for row in rows if 'error' not in row]
+  table = [SUMMARY_COLUMNS]
+  for row in good_rows:
+    table.append([_FormatValue(row[column]) for column in SUMMARY_COLUMNS])
+
+  if csv:
+    lines = [','.join(line) for line in table]
+  else:
+    widths = [max(len(line[i]) for line in table)
+              for i in xrange(len(SUMMARY_COLUMNS))]
+    lines = ['  '.join(cell.ljust(width)
+                            for cell, width in zip(line, widths)).rstrip()
+             for line in table]
+
+  if csv:
+    return '\n'.join(lines) + '\n'
+
+  if good_rows:
+    model_rms = [row['model_rms'] for row in good_rows]
+    lines.append('')
+    lines.append('%d logs, model rms error mean %.6g max %.6g' % (
+        len(good_rows), numpy.mean(model_rms), numpy.max(model_rms)))
+
+  for row in rows:
+    if 'error' in row:
+      lines.append('Failed to process %s: %s' % (row['log'], row['error']))
+
+  return '\n'.join(lines) + '\n'
+
+
+def main(argv):
+  smooth = '--smooth' in argv
+  argv = [arg for arg in argv if arg != '--smooth']
+  if len(argv) not in (2, 3):
+    print ("Expected a log directory or glob, an optional summary .csv name"
+           " and an optional --smooth")
+    quit()
+
+  filenames = FindLogs(argv[1])
+  if not filenames:
+    print "No logs found matching %s" % argv[1]
+    return 1
+
+  rows = ProcessLogs(filenames, smooth=smooth)
+  sys.stdout.write(FormatSummary(rows))
+
+  if len(argv) == 3:
+    with open(argv[2], 'w') as fd:
+      fd.write(FormatSummary(rows, csv=True))
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+import numpy
+from numpy.testing import *
+import os
+import shutil
+import shooter_batch
+import tempfile
+import unittest
+
+
+def WriteLog(filename, rows):
+  with open(filename, 'w') as fd:
+    for row in rows:
+      fd.write(', '.join(repr(value) for value in row) + '\n')
+
+
+class TestShooterBatch(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    shooter_batch._InitWorker()
+
+  def test_FindLogs(self):
+    """Tests that directories find their .csv files, sorted."""
+    for name in ['b.csv', 'a.csv', 'notes.txt']:
+      open(os.path.join(self.directory, name), 'w').close()
+    expected = [os.path.join(self.directory, name)
+                for name in ['a.csv', 'b.csv']]
+    self.assertEqual(expected, shooter_batch.FindLogs(self.directory))
+    self.assertEqual(expected[:1], shooter_batch.FindLogs(
+        os.path.join(self.directory, 'a*')))
+
+  def test_FitFirstOrder(self):
+    """Tests that an exact first order response is fit exactly."""
+    voltage = numpy.repeat([12.0, 0.0, 6.0], 20)
+    velocity = shooter_batch.SimulateFirstOrder(0.9, 2.0, voltage, 1.0)
+    velocity = numpy.concatenate(([1.0], velocity[:-1]))
+    fit_a, fit_b = shooter_batch.FitFirstOrder(voltage, velocity)
+    assert_almost_equal([fit_a, fit_b], [0.9, 2.0])
+
+  def test_ErrorRows(self):
+    """Tests that bad logs become error rows without stopping the others."""
+    short_log = os.path.join(self.directory, 'short.csv')
+    WriteLog(short_log, [[0.0, 1.0, 0.0, 0.01]])
+    good_log = os.path.join(self.directory, 'good.csv')
+    WriteLog(good_log, [[0.01 * i, 1.0, 100.0 * i, 0.01] for i in xrange(50)])
+    missing_log = os.path.join(self.directory, 'missing.csv')
+
+    rows = [shooter_batch.ProcessLog(filename)
+            for filename in [short_log, good_log, missing_log]]
+    self.assertEqual(['log', 'error'], sorted(rows[0], reverse=True))
+    self.assertNotIn('error', rows[1])
+    self.assertEqual(50, rows[1]['samples'])
+    self.assertIn('error', rows[2])
+
+  def test_Smooth(self):
+    """Tests that smoothing only changes the fit, and checks the log's dt."""
+    random = numpy.random.RandomState(2)
+    good_log = os.path.join(self.directory, 'good.csv')
+    WriteLog(good_log, [[0.01 * i, 1.0, 50.0 * i + random.randn() * 20.0, 0.01]
+                        for i in xrange(100)])
+    slow_log = os.path.join(self.directory, 'slow.csv')
+    WriteLog(slow_log, [[0.02 * i, 1.0, 100.0 * i, 0.02] for i in xrange(50)])
+
+    shooter_batch._InitWorker()
+    raw = shooter_batch.ProcessLog(good_log)
+    shooter_batch._InitWorker(smooth=True)
+    smoothed = shooter_batch.ProcessLog(good_log)
+    self.assertEqual(raw['model_rms'], smoothed['model_rms'])
+    self.assertEqual(raw['model_max_error'], smoothed['model_max_error'])
+    self.assertNotEqual(raw['fit_a'], smoothed['fit_a'])
+
+    self.assertIn('dt', shooter_batch.ProcessLog(slow_log)['error'])
+
+  def test_FormatSummary(self):
+    """Tests the aligned and CSV tables."""
+    row = dict((column, 1.5) for column in shooter_batch.SUMMARY_COLUMNS)
+    row['log'] = 'a.csv'
+    row['samples'] = 3
+    rows = [row, {'log': 'b.csv', 'error': 'Too short'}]
+
+    csv = shooter_batch.FormatSummary(rows, csv=True).splitlines()
+    self.assertEqual(','.join(shooter_batch.SUMMARY_COLUMNS), csv[0])
+    self.assertEqual('a.csv,3,' + ','.join(['1.5'] * 7), csv[1])
+    self.assertEqual(2, len(csv))
+
+    text = shooter_batch.FormatSummary(rows)
+    self.assertIn('1 logs, model rms error mean 1.5 max 1.5', text)
+    self.assertIn('Failed to process b.csv: Too short', text)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,179 @@
+"""
+Step response metrics of stacks of trajectories.
+
+Every function takes N runs of T samples stacked into an N x T array, from
+ControlLoop simulations or from logs, and computes its metric for all the runs
+at once with array operations.  final_value and initial_value may be scalars,
+or arrays with one value per run.  Times are in seconds, and are nan for runs
+which never get there.
+
+StepMetrics computes all of them, and Rank orders runs by a weighted sum, so
+design sweeps and batches of logs can be compared without plotting.
+"""
+
+import numpy
+
+# The default settling band, as a fraction of the step size.
+DEFAULT_SETTLING_BAND = 0.02
+
+
+def _Column(value, num_runs):
+  """Returns a scalar or array(N) as an N x 1 array."""
+  return numpy.broadcast_to(
+      numpy.asarray(value, dtype=numpy.float64).reshape(-1, 1), (num_runs, 1))
+
+
+def _Normalized(outputs, final_value, initial_value):
+  """Returns the outputs scaled so the step goes from 0 to 1."""
+  outputs = numpy.asarray(outputs, dtype=numpy.float64)
+  initial = _Column(initial_value, outputs.shape[0])
+  return (outputs - initial) / (_Column(final_value, outputs.shape[0]) -
+                                initial)
+
+
+def _FirstTrue(mask):
+  """Returns the index of the first True in each row, or nan if none are."""
+  return numpy.where(mask.any(axis=1), numpy.argmax(mask, axis=1), numpy.nan)
+
+
+def _SettlingStep(outside):
+  """Returns the step after the last True in each row, or 0 if none are."""
+  num_steps = outside.shape[1]
+  last_outside = num_steps - 1 - numpy.argmax(outside[:, ::-1], axis=1)
+  return numpy.where(outside.any(axis=1), last_outside + 1, 0)
+
+
+def RiseTime(outputs, final_value, dt, initial_value=0.0, low=0.1, high=0.9):
+  """Returns the time to go from low to high of the way to final_value."""
+  normalized = _Normalized(outputs, final_value, initial_value)
+  return (_FirstTrue(normalized >= high) - _FirstTrue(normalized >= low)) * dt
+
+
+def Overshoot(outputs, final_value, initial_value=0.0):
+  """Returns the overshoot past final_value, as a fraction of the step."""
+  normalized = _Normalized(outputs, final_value, initial_value)
+  return numpy.maximum(normalized.max(axis=1) - 1.0, 0.0)
+
+
+def SettlingTime(outputs, final_value, dt, initial_value=0.0,
+                 band=DEFAULT_SETTLING_BAND):
+  """Returns the time after which the outputs stay within band of the goal.
+
+  band is a fraction of the step.  Runs which are still outside the band at
+  the last sample never settled.
+  """
+  normalized = _Normalized(outputs, final_value, initial_value)
+  settling_step = _SettlingStep(numpy.abs(normalized - 1.0) > band)
+  return numpy.where(settling_step < normalized.shape[1],
+                     settling_step * dt, numpy.nan)
+
+
+def SteadyStateError(outputs, final_value, num_samples=1):
+  """Returns final_value minus the mean of the last num_samples outputs."""
+  outputs = numpy.asarray(outputs, dtype=numpy.float64)
+  return (_Column(final_value, outputs.shape[0])[:, 0] -
+          outputs[:, -num_samples:].mean(axis=1))
+
+
+def SaturationDuration(inputs, U_min, U_max, dt, tolerance=1e-9):
+  """Returns the time each run spent with its input at U_min or U_max.
+
+  Args:
+    inputs: numpy.array(N x T), The inputs applied.
+    U_min: float or numpy.array(N), The lower limit.
+    U_max: float or numpy.array(N), The upper limit.
+    dt: float, The time step.
+    tolerance: float, How close to a limit counts as on it.
+  """
+  inputs = numpy.asarray(inputs, dtype=numpy.float64)
+  num_runs = inputs.shape[0]
+  saturated = ((inputs <= _Column(U_min, num_runs) + tolerance) |
+               (inputs >= _Column(U_max, num_runs) - tolerance))
+  return saturated.sum(axis=1) * dt
+
+
+def DisturbanceRecovery(outputs, final_value, dt, disturbance_step,
+                        initial_value=0.0, band=DEFAULT_SETTLING_BAND):
+  """Measures the response to a disturbance at disturbance_step.
+
+  Returns:
+    (deviation, recovery_time), numpy.array(N), the largest distance from
+      final_value after the disturbance as a fraction of the step, and the
+      time from the disturbance until the outputs stay within band of
+      final_value.  recovery_time is nan for runs which never recover.
+  """
+  normalized = _Normalized(outputs, final_value, initial_value)
+  error = numpy.abs(normalized[:, disturbance_step:] - 1.0)
+  recovery_step = _SettlingStep(error > band)
+  recovery_time = numpy.where(recovery_step < error.shape[1],
+                              recovery_step * dt, numpy.nan)
+  return error.max(axis=1), recovery_time
+
+
+def StepMetrics(outputs, final_value, dt, initial_value=0.0,
+                settling_band=DEFAULT_SETTLING_BAND, inputs=None, U_min=None,
+                U_max=None, disturbance_step=None):
+  """Computes every step response metric for a stack of responses.
+
+  Args:
+    outputs: numpy.array(N x T), The responses.
+    final_value: float or numpy.array(N), The value the responses step to.
+    dt: float, The time step.
+    initial_value: float or numpy.array(N), The value they step from.
+    settling_band: float, The settling band as a fraction of the step.
+    inputs: numpy.array(N x T), The inputs applied.  If provided with U_min
+      and U_max, saturation_time is computed.
+    U_min: float or numpy.array(N), The lower input limit.
+    U_max: float or numpy.array(N), The upper input limit.
+    disturbance_step: int, The sample a disturbance was applied at.  If
+      provided, disturbance_deviation and recovery_time are computed, and the
+      other metrics only use the samples before it.
+
+  Returns:
+    dict, numpy.array(N) of rise_time (10% to 90%), overshoot (as a fraction
+      of the step), settling_time, steady_state_error, and the optional
+      metrics.
+  """
+  outputs = numpy.asarray(outputs, dtype=numpy.float64)
+  step_outputs = outputs[:, :disturbance_step]
+  metrics = {
+      'rise_time': RiseTime(step_outputs, final_value, dt, initial_value),
+      'overshoot': Overshoot(step_outputs, final_value, initial_value),
+      'settling_time': SettlingTime(step_outputs, final_value, dt,
+                                    initial_value, settling_band),
+      'steady_state_error': SteadyStateError(step_outputs, final_value),
+  }
+  if inputs is not None and U_min is not None and U_max is not None:
+    metrics['saturation_time'] = SaturationDuration(inputs, U_min, U_max, dt)
+  if disturbance_step is not None:
+    (metrics['disturbance_deviation'],
+     metrics['recovery_time']) = DisturbanceRecovery(
+         outputs, final_value, dt, disturbance_step, initial_value,
+         settling_band)
+  return metrics
+
+
+def Rank(metrics, weights):
+  """Orders runs by a weighted sum of their metrics, best first.
+
+  Lower is better for every metric, and the absolute value of
+  steady_state_error is used.  Runs with a nan metric which has a nonzero
+  weight, like one which never settled, are ranked last.
+
+  Args:
+    metrics: dict, From StepMetrics.
+    weights: dict, The weight of each metric to use, by name.
+
+  Returns:
+    (order, scores), numpy.array(N), the run indices best first, and the score
+      of each run.
+  """
+  scores = None
+  for name, weight in weights.iteritems():
+    values = numpy.asarray(metrics[name], dtype=numpy.float64)
+    if name == 'steady_state_error':
+      values = numpy.abs(values)
+    term = numpy.where(numpy.isnan(values), numpy.inf if weight else 0.0,
+                       weight * values)
+    scores = term if scores is None else scores + term
+  return numpy.argsort(scores, kind='mergesort'), scores
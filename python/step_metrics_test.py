@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+import numpy
+from numpy.testing import *
+import step_metrics
+import unittest
+
+
+class TestStepMetrics(unittest.TestCase):
+  def setUp(self):
+    self.outputs = numpy.array([[0.0, 0.5, 1.0, 1.2, 1.0, 1.0],
+                                [0.0, 0.1, 0.2, 0.3, 0.4, 0.5]])
+
+  def test_StepMetrics(self):
+    """Tests the step metrics on a hand made response."""
+    metrics = step_metrics.StepMetrics(self.outputs, 1.0, 0.5)
+    assert_almost_equal(metrics['rise_time'][0], 0.5)
+    self.assertTrue(numpy.isnan(metrics['rise_time'][1]))
+    assert_almost_equal(metrics['overshoot'], [0.2, 0.0])
+    assert_almost_equal(metrics['settling_time'][0], 2.0)
+    self.assertTrue(numpy.isnan(metrics['settling_time'][1]))
+    assert_almost_equal(metrics['steady_state_error'], [0.0, 0.5])
+    self.assertNotIn('saturation_time', metrics)
+
+  def test_PerRunValues(self):
+    """Tests steps between different values in each run."""
+    outputs = numpy.vstack((self.outputs * 2.0 + 1.0, -self.outputs))
+    metrics = step_metrics.StepMetrics(outputs, [3.0, 3.0, -1.0, -1.0], 0.5,
+                                       initial_value=[1.0, 1.0, 0.0, 0.0])
+    assert_almost_equal(metrics['overshoot'], [0.2, 0.0, 0.2, 0.0])
+    assert_almost_equal(metrics['settling_time'][[0, 2]], [2.0, 2.0])
+
+  def test_Saturation(self):
+    """Tests that time spent at either input limit counts as saturated."""
+    inputs = numpy.array([[12.0, 12.0, 5.0, -2.0],
+                          [0.0, 1.0, 2.0, 3.0]])
+    assert_almost_equal(
+        step_metrics.SaturationDuration(inputs, -2.0, 12.0, 0.01),
+        [0.03, 0.0])
+
+  def test_DisturbanceRecovery(self):
+    """Tests that the step metrics stop at the disturbance."""
+    outputs = numpy.array([[0.0, 1.0, 1.0, 0.6, 0.9, 1.0, 1.0],
+                           [0.0, 1.0, 1.0, 0.6, 0.7, 0.8, 0.9]])
+    metrics = step_metrics.StepMetrics(outputs, 1.0, 0.1, disturbance_step=3)
+    assert_almost_equal(metrics['settling_time'], [0.1, 0.1])
+    assert_almost_equal(metrics['disturbance_deviation'], [0.4, 0.4])
+    assert_almost_equal(metrics['recovery_time'][0], 0.2)
+    self.assertTrue(numpy.isnan(metrics['recovery_time'][1]))
+
+  def test_Rank(self):
+    """Tests that runs which never settle are ranked last."""
+    metrics = {'settling_time': numpy.array([numpy.nan, 2.0, 1.0]),
+               'steady_state_error': numpy.array([0.0, -0.5, 0.1])}
+    order, scores = step_metrics.Rank(
+        metrics, {'settling_time': 1.0, 'steady_state_error': 2.0})
+    assert_array_equal(order, [2, 1, 0])
+    assert_almost_equal(scores[1:], [3.0, 1.2])
+    order, _ = step_metrics.Rank(
+        metrics, {'settling_time': 0.0, 'steady_state_error': 1.0})
+    assert_array_equal(order, [0, 2, 1])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,9 +1,10 @@
 #!/usr/bin/python
 
 import control_loop
+import instrumentation
 import numpy
+import plotting
 import sys
-from matplotlib import pylab
 
 class Transfer(control_loop.ControlLoop):
   def __init__(self):
@@ -40,8 +41,8 @@ class Transfer(control_loop.ControlLoop):
     self.C = numpy.matrix([[1, 0]])
     self.D = numpy.matrix([[0]])
 
-    self.ContinuousToDiscrete(self.A_continuous, self.B_continuous,
-                              self.dt, self.C)
+    self.A, self.B = self.ContinuousToDiscrete(
+        self.A_continuous, self.B_continuous, self.dt)
 
     self.PlaceControllerPoles([.75, .6])
 
@@ -53,10 +54,37 @@ class Transfer(control_loop.ControlLoop):
     self.U_max = numpy.matrix([[12.0]])
     self.U_min = numpy.matrix([[-12.0]])
 
+    self.InitializeState()
+
+  def BatchContinuousPlant(self, parameters):
+    """Returns the continuous time A and B for arrays of physical parameters.
+
+    Args:
+      parameters: dict, Arrays of J, R, Kt, Kv and G.  Missing parameters use
+        the values from the constructor.
+
+    Returns:
+      (A, B), numpy.array(N x 2 x 2) and numpy.array(N x 2 x 1), one plant per
+        parameter sample.
+    """
+    J, R, Kt, Kv, G = self._BatchParameters(parameters,
+                                            ['J', 'R', 'Kt', 'Kv', 'G'])
+    A = numpy.zeros((J.shape[0], 2, 2))
+    A[:, 0, 1] = 1.0
+    A[:, 1, 1] = -Kt / Kv / (J * G * G * R)
+    B = numpy.zeros((J.shape[0], 2, 1))
+    B[:, 1, 0] = Kt / (J * G * R)
+    return A, B
+
 
 def main(argv):
+  argv, plot_enabled, plot_file = plotting.ExtractPlotFlags(argv)
+  argv, instrument = instrumentation.ExtractInstrumentFlag(argv)
+  if instrument:
+    instrumentation.Start()
+
   # Simulate the response of the system to a step input.
-  transfer = Transfer()
+  transfer = control_loop.Model(Transfer)
   simulated_x = []
   simulated_v = []
   for _ in xrange(100):
@@ -64,11 +92,12 @@ def main(argv):
     simulated_x.append(transfer.X[0, 0])
     simulated_v.append(transfer.X[1, 0])
 
-  pylab.plot(range(100), simulated_v)
-  pylab.show()
+  if plot_enabled:
+    plotting.Plot([(numpy.arange(100), simulated_v, 'Velocity')],
+                  filename=plot_file)
 
   # Simulate the closed loop response of the system to a step input.
-  transfer = Transfer()
+  transfer = control_loop.Model(Transfer)
   close_loop_x = []
   R = numpy.matrix([[1.0], [0.0]])
   for _ in xrange(100):
@@ -77,9 +106,6 @@ def main(argv):
     transfer.Update(U)
     close_loop_x.append(transfer.X[0, 0])
 
-  #pylab.plot(range(100), close_loop_x)
-  #pylab.show()
-
   # Write the generated constants out to a file.
   if len(argv) != 3:
     print "Expected .cc file name and .h file name"
@@ -89,6 +115,8 @@ def main(argv):
       loop_writer.Write(argv[2], argv[1])
     else:
       loop_writer.Write(argv[1], argv[2])
+  if instrument:
+    instrumentation.Finish()
 
 if __name__ == '__main__':
   sys.exit(main(sys.argv))
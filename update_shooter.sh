@@ -1,5 +1,13 @@
 #!/bin/bash
 #
 # Updates the shooter controller.
+#
+# Runs through the gain generation daemon (python/gen_daemon.py), which is
+# started on first use and keeps the libraries and designs loaded between runs.
+# It also regenerates the gains by itself when shooter_data.csv or the models
+# change.  The daemon never shows plots, so pass --plot_file=<file> to write
+# the step response plot to a file.  The designs are cached in
+# shooter/.design_cache, and gain files whose contents didn't change are left
+# untouched.
 
-./python/shooter.py shooter/shooter_data.csv shooter/ShooterGains.java shooter/ShooterGains2.java
+./python/gen_client.py shooter shooter/shooter_data.csv shooter/ShooterGains.java shooter/ShooterGains2.java --design_cache=shooter/.design_cache "$@"